@@ -0,0 +1,166 @@
+"""
+Text analysis shared by the indexer and the searcher: splitting documents and queries into words, and stemming them.
+
+Stems are memoized, so every distinct word is stemmed once however often it occurs, in a cache holding up to
+STEM_CACHE_SIZE words (emptied when full). NLTK is only imported once it is first needed.
+
+Documents are analyzed in one of two ways:
+	default:		the document is split into sentences by NLTK's Punkt tokenizer and each sentence into words by its
+					Treebank tokenizer, and the words are lowercased and stemmed. These are the terms the index has always
+					held.
+	single pass:	the document is read a line at a time, each line is split into sentences after every ., ! or ?
+					followed by whitespace, and each sentence into words by the Treebank tokenizer. This skips Punkt, but
+					words ending in a period may come out differently where Punkt would tell an abbreviation from the end
+					of a sentence, so an index built this way can hold slightly different terms.
+
+Documents may also be analyzed into the positions of their terms, for a positional index: every word (punctuation
+included) takes the next position, counting from 0 at the start of the document.
+
+Queries are split into search tokens, operators and parentheses exactly as nltk.word_tokenize would split them, except
+that the double quotes around phrases, NEAR/k operators and wildcard search tokens (words with a * in them, such as
+bank*) are split off first and kept as tokens of their own.
+"""
+
+import re
+
+# Queries made of nothing but these characters are split into the same tokens as nltk.word_tokenize would give, by
+# query_token_pattern, without loading NLTK.
+simple_query_pattern = re.compile(r"^[A-Za-z0-9()\s]*$")
+query_token_pattern = re.compile(r"[A-Za-z0-9]+|[()]")
+# Words that nltk.word_tokenize splits in two, such as "cannot" into "can" and "not".
+split_words = set(["cannot", "gimme", "gonna", "gotta", "lemme", "wanna"])
+# Phrase quotes, proximity operators and wildcard search tokens, split off queries before the rest is tokenized.
+query_operator_pattern = re.compile(r'("|\bNEAR/\d+\b|[^\s()"]*\*[^\s()"]*)')
+
+sentence_end_pattern = re.compile(r"(?<=[.!?])\s+")
+
+# The stemmer and the Treebank tokenizer, created by load_nltk on first use.
+stemmer = None
+word_tokenizer = None
+# word -> stemmed word, for the last STEM_CACHE_SIZE words or so.
+stem_cache = {}
+STEM_CACHE_SIZE = 65536
+
+
+def load_nltk():
+    """Imports NLTK and creates the stemmer and tokenizer, if that has not been done yet."""
+    global stemmer, word_tokenizer
+    if stemmer is None:
+        import nltk
+        stemmer = nltk.stem.porter.PorterStemmer()
+        word_tokenizer = nltk.tokenize.TreebankWordTokenizer()
+
+
+def stem(word):
+    """Stems a word, remembering the stems of the words seen before.
+
+    :param word: The word.
+    :return: The stemmed word.
+    """
+    stemmed = stem_cache.get(word)
+    if stemmed is None:
+        load_nltk()
+        if len(stem_cache) >= STEM_CACHE_SIZE:
+            stem_cache.clear()
+        stemmed = stem_cache[word] = stemmer.stem(word)
+    return stemmed
+
+
+def tokenize_query(query):
+    """Splits a query into search tokens, operators, parentheses, phrase quotes, NEAR/k operators and wildcard search
+    tokens.
+
+    :param query: A string containing the search query.
+    :return: A list of tokens.
+    """
+    query_tokens = []
+    for i, part in enumerate(query_operator_pattern.split(query)):
+        if i % 2:
+            query_tokens.append(part)
+        elif part.strip():
+            query_tokens.extend(tokenize_words(part))
+    return query_tokens
+
+
+def tokenize_words(query):
+    """Splits (part of) a query into search tokens, operators and parentheses, as nltk.word_tokenize does.
+
+    Queries of words, operators and parentheses alone are split with a regular expression. NLTK is only used (and
+    imported) for queries with other characters, which its tokenizer treats in more involved ways.
+
+    :param query: A string containing the search query.
+    :return: A list of tokens.
+    """
+    if simple_query_pattern.match(query):
+        query_tokens = query_token_pattern.findall(query)
+        if not any(token.lower() in split_words for token in query_tokens):
+            return query_tokens
+    import nltk
+    return nltk.word_tokenize(query)
+
+
+def document_terms(doc):
+    """Returns the set of terms of a document, analyzed the default way.
+
+    Words are lowercased and deduplicated before being stemmed, so every distinct word of the document is stemmed once.
+
+    :param doc: A string containing the document.
+    :return: A set of stemmed words.
+    """
+    import nltk
+    words = set()
+    for sentence in nltk.tokenize.sent_tokenize(doc):
+        words.update(word.lower() for word in nltk.tokenize.word_tokenize(sentence))
+    return set(stem(word) for word in words)
+
+
+def file_terms(doc_path, single_pass=False):
+    """Returns the set of terms of a document file.
+
+    :param doc_path: The file path of the document.
+    :param single_pass: True to analyze the document in a single pass (see above) rather than the default way.
+    :return: A set of stemmed words.
+    """
+    with open(doc_path) as doc_file:
+        if not single_pass:
+            return document_terms(doc_file.read())
+        load_nltk()
+        words = set()
+        for line in doc_file:
+            for sentence in sentence_end_pattern.split(line):
+                words.update(word.lower() for word in word_tokenizer.tokenize(sentence))
+    return set(stem(word) for word in words)
+
+
+def word_positions(words):
+    """Collects the positions of the terms of a document from its words.
+
+    :param words: An iterable of the words of the document, in order.
+    :return: A dict of stemmed word -> sorted list of the positions it occurs at.
+    """
+    positions = {}
+    for position, word in enumerate(words):
+        term = stem(word.lower())
+        if term in positions:
+            positions[term].append(position)
+        else:
+            positions[term] = [position]
+    return positions
+
+
+def file_term_positions(doc_path, single_pass=False):
+    """Returns the terms of a document file with the positions they occur at.
+
+    :param doc_path: The file path of the document.
+    :param single_pass: True to analyze the document in a single pass (see above) rather than the default way.
+    :return: A dict of stemmed word -> sorted list of the positions it occurs at. Its keys are the terms file_terms
+        returns.
+    """
+    with open(doc_path) as doc_file:
+        if not single_pass:
+            import nltk
+            return word_positions(word for sentence in nltk.tokenize.sent_tokenize(doc_file.read())
+                                  for word in nltk.tokenize.word_tokenize(sentence))
+        load_nltk()
+        return word_positions(word for line in doc_file for sentence in sentence_end_pattern.split(line)
+                              for word in word_tokenizer.tokenize(sentence))
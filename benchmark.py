@@ -0,0 +1,415 @@
+"""
+Query benchmark:
+
+Generates a synthetic corpus whose words follow a Zipf distribution, and a mix of queries over it, then indexes the
+corpus with index.py and evaluates the queries with every evaluation backend, measuring:
+	build:		the wall time of index.py, and the size of every file of the index
+	index load:	the time to open the index in a running interpreter, as search.py does before its first query (not
+				counting the start of Python and the imports, so not the whole startup time of search.py)
+	queries:	the latency of every query (p50, p95, p99 and mean, over all queries and for each kind of query), and the
+				number of queries evaluated per second
+
+The vocabulary is made of made-up words that the stemmer leaves as they are, ranked by frequency: the word of rank r
+occurs with a probability proportional to 1 / r^s. Queries come in three kinds:
+	deep:		nested NOT, AND and OR trees of words of any frequency, like those of queries.txt
+	selective:	ANDs of two or three rare words, which match few documents
+	hot:		ORs of three to six of the most frequent words, which match most documents
+
+Caches are left off, so every query is resolved in full. Corpora and queries are generated from a seed, so runs with the
+same settings (and seed) evaluate the same queries and can be compared.
+
+Results are written as JSON:
+	{"settings": {...}, "build": {"seconds": ..., "index_bytes": ...}, "index_load_ms": ...,
+	 "backends": {"list": {"queries": ..., "throughput_qps": ..., "latency_ms": {"p50": ..., "p95": ..., "p99": ...,
+	 "mean": ...}, "kinds": {"deep": {"p50": ..., ...}, ...}}, ...}}
+Given the JSON of an earlier run (-c), the metrics of both runs are printed side by side, and every metric more than the
+threshold (-r) worse than before is reported as a regression, making the exit status 1.
+"""
+
+import os
+import sys
+import json
+import getopt
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from bisect import bisect_right
+import analyzer
+import search
+
+QUERY_KINDS = ["deep", "selective", "hot"]
+# Word fractions of the vocabulary: hot words are the most frequent, and rare words the least frequent.
+HOT_WORDS = 0.01
+RARE_WORDS = 0.5
+
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz" for vowel in "aiou"]
+SENTENCE_LENGTH = 12
+
+
+def make_vocabulary(size, rnd):
+    """Makes up distinct words that the stemmer leaves unchanged, so that every word is a search token of its own.
+
+    :param size: The number of words.
+    :param rnd: The random.Random to draw syllables from.
+    :return: A list of words, in the order of their frequency rank.
+    """
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rnd.choice(SYLLABLES) for i in xrange(rnd.randint(2, 4)))
+        if word not in seen and analyzer.stem(word) == word:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def zipf_sampler(vocabulary, exponent, rnd):
+    """Returns a function drawing words from the vocabulary, the word of rank r with a probability proportional to
+    1 / r^exponent.
+
+    :param vocabulary: A list of words, in the order of their frequency rank.
+    :param exponent: The exponent s of the Zipf distribution.
+    :param rnd: The random.Random to draw with.
+    """
+    cumulative = []
+    total = 0.0
+    for rank in xrange(1, len(vocabulary) + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return lambda: vocabulary[min(bisect_right(cumulative, rnd.random() * total), len(vocabulary) - 1)]
+
+
+def generate_corpus(corpus_dir, document_count, vocabulary, exponent, document_length, rnd):
+    """Writes the documents of a synthetic corpus, one file per document named by its docID, counting from 1.
+
+    Document lengths are drawn uniformly from half to one and a half times the mean length, and words are split into
+    sentences of SENTENCE_LENGTH words.
+
+    :param corpus_dir: The directory to write the documents to.
+    :param document_count: The number of documents.
+    :param vocabulary: A list of words, in the order of their frequency rank.
+    :param exponent: The exponent of the Zipf distribution of the words.
+    :param document_length: The mean length of the documents in words.
+    :param rnd: The random.Random to draw with.
+    """
+    draw = zipf_sampler(vocabulary, exponent, rnd)
+    for docID in xrange(1, document_count + 1):
+        length = rnd.randint(max(document_length // 2, 1), max(document_length * 3 // 2, 1))
+        words = [draw() for i in xrange(length)]
+        sentences = [" ".join(words[i:i + SENTENCE_LENGTH]) + "." for i in xrange(0, length, SENTENCE_LENGTH)]
+        with open(os.path.join(corpus_dir, str(docID)), 'w') as doc_file:
+            doc_file.write("\n".join(sentences) + "\n")
+
+
+def deep_query(words, rnd, depth=3):
+    """Makes up a nested query of NOT, AND and OR over any of the words.
+
+    :param words: A list of words to pick from.
+    :param rnd: The random.Random to draw with.
+    :param depth: The most levels of nesting.
+    :return: A string containing the query.
+    """
+    if depth == 0 or rnd.random() < 0.2:
+        word = rnd.choice(words)
+        return "NOT " + word if rnd.random() < 0.2 else word
+    op = rnd.choice([" AND ", " OR ", " AND NOT "])
+    if op == " AND NOT ":
+        operands = [deep_query(words, rnd, depth - 1), deep_query(words, rnd, depth - 1)]
+    else:
+        operands = [deep_query(words, rnd, depth - 1) for i in xrange(rnd.randint(2, 4))]
+    return op.join("(" + operand + ")" if " " in operand else operand for operand in operands)
+
+
+def generate_queries(vocabulary, count, rnd):
+    """Makes up count queries of every kind.
+
+    :param vocabulary: A list of words, in the order of their frequency rank.
+    :param count: The number of queries of each kind.
+    :param rnd: The random.Random to draw with.
+    :return: A list of (kind, query) tuples, the kinds interleaved.
+    """
+    hot_words = vocabulary[:max(int(len(vocabulary) * HOT_WORDS), 6)]
+    rare_words = vocabulary[int(len(vocabulary) * (1 - RARE_WORDS)):]
+    queries = []
+    for i in xrange(count):
+        queries.append(("deep", deep_query(vocabulary, rnd)))
+        queries.append(("selective", " AND ".join(rnd.sample(rare_words, rnd.randint(2, 3)))))
+        queries.append(("hot", " OR ".join(rnd.sample(hot_words, rnd.randint(3, 6)))))
+    return queries
+
+
+def build_index(corpus_dir, index_dir, build_args):
+    """Indexes the corpus by running index.py.
+
+    :param corpus_dir: The directory of the documents.
+    :param index_dir: The directory to write the index to, as dictionary.bin and postings.bin.
+    :param build_args: A list of further arguments of index.py.
+    :return: A tuple of (dictionary file path, postings file path, seconds taken, total bytes of the index files).
+    """
+    dict_file = os.path.join(index_dir, "dictionary.bin")
+    postings_file = os.path.join(index_dir, "postings.bin")
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.py"),
+               "-i", corpus_dir, "-d", dict_file, "-p", postings_file] + build_args
+    begin = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(command, stdout=devnull)
+    seconds = time.time() - begin
+    index_bytes = sum([os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)])
+    return (dict_file, postings_file, seconds, index_bytes)
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value below which the given fraction of the values lie, by the nearest rank.
+
+    :param sorted_values: A non-empty sorted list of values.
+    :param fraction: The fraction, from 0 to 1.
+    """
+    rank = int(fraction * len(sorted_values) + 0.5)
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def latency_summary(latencies):
+    """Summarizes query latencies.
+
+    :param latencies: A non-empty list of latencies in milliseconds.
+    :return: A dict of "p50", "p95", "p99" and "mean" latencies.
+    """
+    latencies = sorted(latencies)
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "mean": sum(latencies) / len(latencies),
+    }
+
+
+def measure_index_load(dict_file, postings_file, repeat):
+    """Measures the time to open the index from this process, as the median of repeat openings.
+
+    :return: The time in milliseconds.
+    """
+    timings = []
+    for i in xrange(repeat):
+        begin = time.time()
+        index = search.load_index(dict_file, postings_file)
+        timings.append((time.time() - begin) * 1000.0)
+        index.close()
+    return percentile(sorted(timings), 0.5)
+
+
+def measure_backend(index, queries, backend, repeat):
+    """Evaluates every query repeat times with a backend, after one untimed round to warm up.
+
+    :param index: The storage.Index to evaluate the queries against.
+    :param queries: A list of (kind, query) tuples.
+    :param backend: The evaluation backend, one of search.backends.
+    :param repeat: The number of timed evaluations of every query.
+    :return: A dict of the measurements of the backend.
+    """
+    for kind, query in queries:
+        search.evaluate_query(query, index, backend)
+    latencies = []
+    kind_latencies = dict((kind, []) for kind in QUERY_KINDS)
+    begin = time.time()
+    for i in xrange(repeat):
+        for kind, query in queries:
+            query_begin = time.time()
+            search.evaluate_query(query, index, backend)
+            latency = (time.time() - query_begin) * 1000.0
+            latencies.append(latency)
+            kind_latencies[kind].append(latency)
+    seconds = time.time() - begin
+    return {
+        "queries": len(latencies),
+        "throughput_qps": len(latencies) / seconds if seconds > 0 else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "kinds": dict((kind, latency_summary(timings)) for kind, timings in kind_latencies.iteritems() if timings),
+    }
+
+
+def run_benchmark(work_dir, settings):
+    """Generates the corpus and queries, builds the index and measures every backend.
+
+    :param work_dir: The directory to write the corpus, queries and index to.
+    :param settings: A dict of the benchmark settings, as made by load_args.
+    :return: A dict of the results, as written to the JSON output.
+    """
+    rnd = random.Random(settings["seed"])
+    corpus_dir = os.path.join(work_dir, "corpus")
+    index_dir = os.path.join(work_dir, "index")
+    for directory in [corpus_dir, index_dir]:
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+    print "Generating {0} documents...".format(settings["documents"]),
+    sys.stdout.flush()
+    vocabulary = make_vocabulary(settings["vocabulary"], rnd)
+    generate_corpus(corpus_dir, settings["documents"], vocabulary, settings["exponent"], settings["document_length"], rnd)
+    queries = generate_queries(vocabulary, settings["queries"], rnd)
+    with open(os.path.join(work_dir, "queries.txt"), 'w') as queries_file:
+        queries_file.write("".join(query + "\n" for kind, query in queries))
+    print "DONE"
+
+    print "Building the index...",
+    sys.stdout.flush()
+    dict_file, postings_file, build_seconds, index_bytes = build_index(corpus_dir, index_dir, settings["build_args"])
+    print "DONE ({0:.2f} s, {1} bytes)".format(build_seconds, index_bytes)
+
+    results = {
+        "settings": settings,
+        "build": {"seconds": build_seconds, "index_bytes": index_bytes},
+        "index_load_ms": measure_index_load(dict_file, postings_file, settings["repeat"]),
+        "backends": {},
+    }
+    index = search.load_index(dict_file, postings_file)
+    for backend in settings["backends"]:
+        print "Evaluating {0} queries with the {1} backend...".format(len(queries) * settings["repeat"], backend),
+        sys.stdout.flush()
+        results["backends"][backend] = measure_backend(index, queries, backend, settings["repeat"])
+        print "DONE ({0:.1f} queries/s)".format(results["backends"][backend]["throughput_qps"])
+    index.close()
+    return results
+
+
+def metrics(results):
+    """Flattens the results of a run into the metrics compared across runs.
+
+    :param results: A dict of results, as returned by run_benchmark.
+    :return: A list of (name, value, True if higher is better) tuples.
+    """
+    flattened = [
+        ("build seconds", results["build"]["seconds"], False),
+        ("index bytes", results["build"]["index_bytes"], False),
+    ]
+    if "index_load_ms" in results:
+        # Runs from before the metric was renamed measured it as startup_ms, and are not compared on it.
+        flattened.append(("index load ms", results["index_load_ms"], False))
+    for backend in sorted(results["backends"]):
+        measured = results["backends"][backend]
+        flattened.append(("{0} throughput qps".format(backend), measured["throughput_qps"], True))
+        for name in ["p50", "p95", "p99"]:
+            flattened.append(("{0} {1} ms".format(backend, name), measured["latency_ms"][name], False))
+    return flattened
+
+
+def compare(results, baseline, threshold):
+    """Prints the metrics of a run next to those of an earlier run, and finds those that got worse by more than the
+    threshold.
+
+    :param results: A dict of results, as returned by run_benchmark.
+    :param baseline: A dict of the results of the earlier run, as read from its JSON output.
+    :param threshold: The fraction a metric may get worse by before it counts as a regression.
+    :return: A list of the names of the metrics that regressed.
+    """
+    if baseline.get("settings") != results["settings"]:
+        print "the baseline was run with other settings: {0}".format(json.dumps(baseline.get("settings"), sort_keys=True))
+    baseline_metrics = dict((name, value) for name, value, higher_better in metrics(baseline))
+    regressions = []
+    print "{0:<24}{1:>14}{2:>14}{3:>10}".format("metric", "baseline", "current", "change")
+    for name, value, higher_better in metrics(results):
+        if name not in baseline_metrics:
+            continue
+        before = baseline_metrics[name]
+        change = (value - before) / float(before) if before else 0.0
+        regressed = (-change if higher_better else change) > threshold
+        if regressed:
+            regressions.append(name)
+        print "{0:<24}{1:>14.3f}{2:>14.3f}{3:>+9.1%}{4}".format(name, before, value, change, "  REGRESSION" if regressed else "")
+    return regressions
+
+
+def usage():
+    """Prints the proper format for calling this script."""
+    print "usage: " + sys.argv[0] + " -o output-file-of-results [-w work-directory] [-n documents] [-v vocabulary-size] [-z zipf-exponent] [-L mean-document-length] [-q queries-per-kind] [-R repeat] [-b backend[,backend...]] [-i index-arguments] [-s seed] [-c baseline-results [-r regression-threshold]]"
+
+
+def load_args():
+    """Attempts to parse command line arguments fed into the script when it was called.
+    Notifies the user of the correct format if parsing failed.
+    """
+    output_file = work_dir = baseline_file = None
+    threshold = 0.1
+    settings = {
+        "documents": 2000,
+        "vocabulary": 5000,
+        "exponent": 1.0,
+        "document_length": 100,
+        "queries": 100,
+        "repeat": 3,
+        "backends": [backend for backend in search.backends if backend != "numpy" or search.numpy_backend != None],
+        "build_args": [],
+        "seed": 1,
+    }
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'o:w:n:v:z:L:q:R:b:i:s:c:r:')
+    except getopt.GetoptError, err:
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o == '-o':
+            output_file = a
+        elif o == '-w':
+            work_dir = a
+        elif o == '-n':
+            settings["documents"] = int(a)
+        elif o == '-v':
+            settings["vocabulary"] = int(a)
+        elif o == '-z':
+            settings["exponent"] = float(a)
+        elif o == '-L':
+            settings["document_length"] = int(a)
+        elif o == '-q':
+            settings["queries"] = int(a)
+        elif o == '-R':
+            settings["repeat"] = int(a)
+        elif o == '-b':
+            settings["backends"] = a.split(",")
+        elif o == '-i':
+            settings["build_args"] = a.split()
+        elif o == '-s':
+            settings["seed"] = int(a)
+        elif o == '-c':
+            baseline_file = a
+        elif o == '-r':
+            threshold = float(a)
+        else:
+            assert False, "unhandled option"
+    if output_file == None or any(backend not in search.backends for backend in settings["backends"]) or \
+            min(settings["documents"], settings["vocabulary"], settings["document_length"], settings["queries"],
+                settings["repeat"]) < 1:
+        usage()
+        sys.exit(2)
+    if "numpy" in settings["backends"] and search.numpy_backend == None:
+        print "the numpy backend needs NumPy to be installed"
+        sys.exit(2)
+    return (output_file, work_dir, settings, baseline_file, threshold)
+
+
+def main():
+    output_file, work_dir, settings, baseline_file, threshold = load_args()
+
+    keep_work_dir = work_dir != None
+    if not keep_work_dir:
+        work_dir = tempfile.mkdtemp(prefix="benchmark")
+    try:
+        results = run_benchmark(work_dir, settings)
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir)
+    with open(output_file, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    if baseline_file != None:
+        with open(baseline_file) as baseline_input:
+            baseline = json.load(baseline_input)
+        regressions = compare(results, baseline, threshold)
+        if regressions:
+            print "{0} regressions: {1}".format(len(regressions), ", ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Bitmap postings:
+
+A Bitmap holds a set of docIDs as the bits of a single arbitrary precision integer, bit d being set if docID d is in
+the set. AND, OR and AND NOT between bitmaps are then single bitwise operations on the integers, done a machine word at a
+time, and NOT is a bitwise complement against the bitmap of all docIDs.
+"""
+
+import binascii
+from array import array
+
+# The positions of the set bits of every byte value, to list the docIDs of a bitmap a byte at a time.
+byte_bit_positions = [[bit for bit in range(8) if byte >> bit & 1] for byte in range(256)]
+
+
+def bytes_to_bits(data):
+    """Converts little endian bytes to the integer they store."""
+    if not data:
+        return 0
+    return long(binascii.hexlify(str(data)[::-1]), 16)
+
+def bits_to_bytes(bits):
+    """Converts a non-negative integer to its little endian bytes."""
+    hex_digits = "%x" % bits
+    if len(hex_digits) % 2:
+        hex_digits = "0" + hex_digits
+    return binascii.unhexlify(hex_digits)[::-1]
+
+def from_docIDs(docIDs):
+    """Builds the bitmap of a list of docIDs.
+
+    :param docIDs: A list of docIDs, in any order.
+    :return: A Bitmap.
+    """
+    if not len(docIDs):
+        return Bitmap(0)
+    flags = bytearray(max(docIDs) // 8 + 1)
+    for docID in docIDs:
+        flags[docID >> 3] |= 1 << (docID & 7)
+    return Bitmap(bytes_to_bits(flags))
+
+def from_runs(runs):
+    """Builds the bitmap of runs of consecutive docIDs.
+
+    :param runs: A list of (first docID, run length) tuples.
+    :return: A Bitmap.
+    """
+    bits = 0
+    for start, length in runs:
+        bits |= ((1 << length) - 1) << start
+    return Bitmap(bits)
+
+
+class Bitmap:
+    """A set of docIDs stored as the bits of an integer.
+
+    Supports len(), iteration over its docIDs in ascending order, and `docID in bitmap`, so it can stand in for a sorted
+    postings list wherever the list is only counted, iterated or probed.
+
+    Attributes:
+        bits: The integer whose set bits are the docIDs.
+    """
+
+    bits = 0
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.count = None
+        self.flags = None
+
+    def __len__(self):
+        if self.count is None:
+            self.count = bin(self.bits).count("1")
+        return self.count
+
+    def __contains__(self, docID):
+        if self.flags is None:
+            self.flags = bytearray(bits_to_bytes(self.bits)) if self.bits else bytearray()
+        byte_index = docID >> 3
+        return byte_index < len(self.flags) and (self.flags[byte_index] >> (docID & 7)) & 1 == 1
+
+    def __iter__(self):
+        return iter(self.docIDs())
+
+    def __and__(self, other):
+        return Bitmap(self.bits & other.bits)
+
+    def __or__(self, other):
+        return Bitmap(self.bits | other.bits)
+
+    def and_not(self, other):
+        """Returns the bitmap of docIDs in self but not in other."""
+        return Bitmap(self.bits & ~other.bits)
+
+    def docIDs(self):
+        """Lists the docIDs of the bitmap.
+
+        :return: A sorted array('i') of docIDs.
+        """
+        docIDs = array('i')
+        if not self.bits:
+            return docIDs
+        for byte_index, byte in enumerate(bytearray(bits_to_bytes(self.bits))):
+            if byte:
+                base = byte_index << 3
+                for bit in byte_bit_positions[byte]:
+                    docIDs.append(base + bit)
+        return docIDs
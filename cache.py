@@ -0,0 +1,319 @@
+"""
+Query caches:
+
+A ResultCache keeps the resolved postings of operator subtrees across queries, so subexpressions shared by many
+queries are only resolved once. Subtrees are looked up by a canonical form of their consolidated OpNode (see
+OpNode.canonical_key in search.py), in which the children of AND and OR are sorted, so `a AND b` and `b AND a` share an
+entry.
+
+A PostingsCache keeps the decoded postings of search tokens, so terms that appear in many queries (or several times in
+one) are read and decoded only once. It is attached to a storage.Index, which consults it in read_postings, and can be
+preloaded with the postings of the terms found in the most documents.
+
+Postings resolved or read against candidates (see OpNode.recursive_merge) may be partial and cannot be stored, but a key
+missed more than once is recurring, and is then worth resolving or reading in full so that it can be.
+
+Both caches are bounded by the approximate number of bytes their postings take. Which entries are evicted to make room
+is decided by an eviction policy:
+	lru:		the least recently used entries are evicted first
+	tinylfu:	as lru, but a new entry is only admitted if it has been asked for more often than every entry it would
+				evict, going by a small count-min sketch of recent accesses. A burst of one-off terms then cannot flush
+				frequently used ones out of the cache.
+
+A BatchCache holds the subtrees shared by several queries of a batch (see evaluate_batch in search.py) while the batch
+is evaluated, so each of them is resolved only once.
+
+Cached postings are only valid for the index they were resolved against, so a cache empties itself whenever it is used
+with an index in another state on disk (see storage.Index.version): another index, or the same one after an append,
+compaction, rebuild or delete. Cached postings are shared with every query they
+are served to, and must not be modified.
+"""
+
+import heapq
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from bitmap import Bitmap
+
+MISSED_KEYS = 4096
+
+SKETCH_ROWS = 4
+SKETCH_WIDTH = 4096
+SKETCH_MAX_COUNT = 15
+
+
+def postings_size(postings):
+    """Estimates the number of bytes taken by resolved postings.
+
+    :param postings: An array('i'), list, bitmap.Bitmap or NumPy array of docIDs.
+    :return: The approximate size in bytes.
+    """
+    if isinstance(postings, Bitmap):
+        return sys.getsizeof(postings.bits)
+    if hasattr(postings, "nbytes"): # NumPy arrays
+        return postings.nbytes
+    if hasattr(postings, "itemsize"): # array('i')
+        return len(postings) * postings.itemsize
+    return sys.getsizeof(postings) + len(postings) * sys.getsizeof(0)
+
+
+class LRUPolicy:
+    """Evicts the least recently used entries first, and admits every new entry."""
+
+    def __init__(self):
+        self.order = OrderedDict() # least recently used first
+
+    def record(self, key):
+        """Notes that key was asked for, whether or not it is cached."""
+        pass
+
+    def touch(self, key):
+        """Marks a cached key as most recently used."""
+        self.order[key] = self.order.pop(key)
+
+    def insert(self, key):
+        self.order[key] = None
+
+    def remove(self, key):
+        del self.order[key]
+
+    def victims(self):
+        """Returns an iterator over the cached keys in the order they should be evicted."""
+        return iter(self.order)
+
+    def admit(self, key, victims):
+        """Decides whether a new key should be cached at the cost of evicting the given keys."""
+        return True
+
+
+class TinyLFUPolicy(LRUPolicy):
+    """Evicts the least recently used entries first, but only admits a new entry if it has been asked for more often
+    than every entry it would evict.
+
+    Access frequencies are estimated with a count-min sketch of SKETCH_ROWS rows of SKETCH_WIDTH small counters. Once
+    there have been as many accesses as ten times the width of the sketch, all counters are halved, so that the
+    estimates follow recent accesses.
+    """
+
+    def __init__(self):
+        LRUPolicy.__init__(self)
+        self.counters = array('B', [0]) * (SKETCH_ROWS * SKETCH_WIDTH)
+        self.samples = 0
+
+    def slots(self, key):
+        """Returns the positions of the counters of key, one in every row of the sketch."""
+        return [row * SKETCH_WIDTH + (hash((row, key)) & (SKETCH_WIDTH - 1)) for row in xrange(SKETCH_ROWS)]
+
+    def frequency(self, key):
+        """Estimates how often key was asked for recently."""
+        return min(self.counters[slot] for slot in self.slots(key))
+
+    def record(self, key):
+        for slot in self.slots(key):
+            if self.counters[slot] < SKETCH_MAX_COUNT:
+                self.counters[slot] += 1
+        self.samples += 1
+        if self.samples >= 10 * SKETCH_WIDTH:
+            self.counters = array('B', [count >> 1 for count in self.counters])
+            self.samples = 0
+
+    def admit(self, key, victims):
+        frequency = self.frequency(key)
+        return all(frequency > self.frequency(victim) for victim in victims)
+
+# policy name -> policy class
+policies = {
+    "lru": LRUPolicy,
+    "tinylfu": TinyLFUPolicy,
+}
+
+
+class Cache:
+    """A byte-bounded cache of postings with a pluggable eviction policy, and hit and miss statistics.
+
+    Lookups and insertions hold a lock, so a single cache can be shared by concurrent queries.
+
+    Attributes:
+        capacity: The most bytes of postings to keep.
+        policy: The eviction policy, one of the classes in policies.
+        size: The bytes of postings currently kept.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups that were not.
+        evictions: The number of entries evicted to make room for others.
+    """
+
+    capacity = 0
+    policy = None
+    size = 0
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    def __init__(self, capacity, policy="lru"):
+        """
+        :param capacity: The most bytes of postings to keep.
+        :param policy: The name of the eviction policy, one of policies.
+        """
+        self.capacity = capacity
+        self.policy = policies[policy]()
+        self.entries = {} # key -> (postings, size)
+        self.missed = OrderedDict() # key -> number of misses, of the last MISSED_KEYS keys missed
+        self.index_version = None
+        self.lock = threading.Lock()
+
+    def use_index(self, index):
+        """Empties the cache if its postings were resolved against another index, or another version of the index, than
+        the one given.
+
+        :param index: The storage.Index queries are about to be evaluated against.
+        """
+        version = index.version
+        with self.lock:
+            if version != self.index_version:
+                for key in self.entries:
+                    self.policy.remove(key)
+                self.entries.clear()
+                self.missed.clear()
+                self.size = 0
+                self.index_version = version
+
+    def get(self, key):
+        """Looks up the postings stored under key, and marks them as most recently used.
+
+        :param key: A hashable key.
+        :return: The postings, or None if they are not cached.
+        """
+        with self.lock:
+            self.policy.record(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                self.missed[key] = self.missed.pop(key, 0) + 1
+                if len(self.missed) > MISSED_KEYS:
+                    self.missed.popitem(last=False)
+                return None
+            self.policy.touch(key)
+            self.hits += 1
+            return entry[0]
+
+    def recurring(self, key):
+        """Returns True if key was missed more than once."""
+        return self.missed.get(key, 0) > 1
+
+    def put(self, key, postings):
+        """Stores postings under key, evicting entries chosen by the policy until they fit, if the policy admits them.
+
+        Postings larger than the whole cache are not stored.
+
+        :param key: A hashable key.
+        :param postings: The postings to store.
+        """
+        size = postings_size(postings)
+        if size > self.capacity:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+                self.policy.remove(key)
+            victims = []
+            freed = 0
+            for victim in self.policy.victims():
+                if self.size - freed + size <= self.capacity:
+                    break
+                victims.append(victim)
+                freed += self.entries[victim][1]
+            if not self.policy.admit(key, victims):
+                return
+            for victim in victims:
+                self.size -= self.entries.pop(victim)[1]
+                self.policy.remove(victim)
+                self.evictions += 1
+            self.entries[key] = (postings, size)
+            self.policy.insert(key)
+            self.size += size
+
+    def stats(self):
+        """Describes the use of the cache in one line."""
+        lookups = self.hits + self.misses
+        return "{0} hits, {1} misses ({2:.1%} hit rate), {3} evictions, {4} entries in {5} of {6} bytes".format(
+            self.hits, self.misses, float(self.hits) / lookups if lookups else 0.0, self.evictions, len(self.entries),
+            self.size, self.capacity)
+
+
+class ResultCache(Cache):
+    """A cache of the resolved postings of operator subtrees, keyed by backend and canonical subtree."""
+
+
+class PostingsCache(Cache):
+    """A cache of the decoded postings of search tokens, keyed by their UTF-8 byte strings."""
+
+    def preload(self, index, count):
+        """Reads the postings of the terms found in the most documents into the cache, as far as they fit.
+
+        :param index: The storage.Index the cache is attached to.
+        :param count: The number of terms to preload.
+        """
+        self.use_index(index)
+        frequent_terms = heapq.nlargest(count, index.terms(), key=lambda term: index.document_frequency(term) or 0)
+        for term in frequent_terms:
+            self.put(term, index.decode_postings(term))
+
+
+class BatchCache:
+    """Holds the resolved postings of the subtrees shared by several queries of a batch, for the length of the batch.
+
+    It is used in place of a ResultCache, which it can fall back on, but is not bounded: it only ever holds the subtrees
+    it was told are shared, and is dropped along with the batch.
+
+    Attributes:
+        shared_keys: The set of keys of the subtrees that occur more than once in the batch.
+        result_cache: A ResultCache to look subtrees up in and store them in as well, or None.
+        hits: The number of lookups answered from the batch.
+        misses: The number of lookups that were not.
+    """
+
+    shared_keys = None
+    result_cache = None
+    hits = 0
+    misses = 0
+
+    def __init__(self, shared_keys, result_cache=None):
+        """
+        :param shared_keys: The keys of the subtrees that occur more than once in the batch.
+        :param result_cache: A ResultCache to fall back on, or None.
+        """
+        self.shared_keys = set(shared_keys)
+        self.result_cache = result_cache
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def use_index(self, index):
+        if self.result_cache is not None:
+            self.result_cache.use_index(index)
+
+    def get(self, key):
+        with self.lock:
+            postings = self.entries.get(key)
+            if postings is not None:
+                self.hits += 1
+                return postings
+            self.misses += 1
+        if self.result_cache is not None:
+            return self.result_cache.get(key)
+        return None
+
+    def recurring(self, key):
+        """Returns True if key is shared in the batch, or recurring in the result cache."""
+        return key in self.shared_keys or (self.result_cache is not None and self.result_cache.recurring(key))
+
+    def put(self, key, postings):
+        if key in self.shared_keys:
+            with self.lock:
+                self.entries[key] = postings
+        if self.result_cache is not None:
+            self.result_cache.put(key, postings)
+
+    def stats(self):
+        """Describes the use of the cache in one line."""
+        return "{0} hits, {1} misses, {2} shared subtrees".format(self.hits, self.misses, len(self.shared_keys))
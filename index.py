@@ -1,5 +1,7 @@
 """
 Dictionary format:
+The dictionary is written in the binary format described in storage.py. It holds the same information as the legacy
+JSON format below, which the searcher still reads:
 [
 	[1, 2, 3, 4, 5, 11],
 	{
@@ -15,20 +17,33 @@ Dictionary format:
 All docIDs in a list: 				dictionary[0]
 Pointer to "retrieval": 			dictionary[1]["retrieval"][0]
 Length of postings for "retrieval": dictionary[1]["retrieval"][1]
+
+The postings file format (and the meaning of the pointer and length) is described in storage.py.
 """
 
 import re
 import getopt
 import sys
-import nltk
-import json
-from os import listdir
-from os.path import isfile, join
+import math
+import multiprocessing
+import heapq
+import tempfile
+import analyzer
+import storage
+from os import listdir, remove
+from os.path import isfile, join, abspath
 try:
 	import cPickle as pickle
 except:
 	import pickle
 
+# True to analyze documents in a single pass rather than the default way (see analyzer.py), True to index the positions
+# of terms as well, and True to index term frequencies and document lengths as well. Set from the command line before
+# indexing starts, so that worker processes inherit them.
+single_pass = False
+positional = False
+weighted = False
+
 def load_all_doc_names(docs_dir):
 	"""Takes in the document directory path, and lists names of all non-directory
 	files from the given path. Returns a list of tuples (file_name, file_path) where
@@ -49,23 +64,36 @@ def index_doc(doc_name, postings_list):
 	"""Indexes a single document in the corpus. Makes use of stemming and tokenization.
 
 	:param doc_name: A tuple containing the docID (to be stored as a posting) and doc_path which is the filepath to the document.
-	:param postings_list: The postings list, to be updated (mutated) as part of the indexing process.
+	:param postings_list: The postings list, to be updated (mutated) as part of the indexing process. When indexing
+		positions, its postings are (docID, positions) tuples rather than docIDs, and when indexing only term
+		frequencies, (docID, term frequency) tuples.
+	:return: The estimated number of bytes the postings added take in memory (see POSTING_BYTES).
 	"""
 	docID, doc_path = doc_name
-	doc_file = file(doc_path)
-	doc = doc_file.read()
-	# Tokenize to doc content to sentences, then to words.
-	sentences = nltk.tokenize.sent_tokenize(doc)
-	stemmer = nltk.stem.porter.PorterStemmer()
-	words = set([stemmer.stem(word.lower()) for sentence in sentences for word in nltk.tokenize.word_tokenize(sentence)])
+	# Tokenize to doc content to sentences, then to words, and stem them (see analyzer.py).
+	if positional or weighted:
+		words = analyzer.file_term_positions(doc_path, single_pass)
+	else:
+		words = analyzer.file_terms(doc_path, single_pass)
 	# Append doc to postings list.
 	# No need to sort the list if we call index_doc in sorted docID order.
 	for word in words:
+		if positional:
+			posting = (docID, words[word])
+		elif weighted:
+			posting = (docID, len(words[word]))
+		else:
+			posting = docID
 		if word in postings_list:
-			postings_list[word].append(docID)
+			postings_list[word].append(posting)
 		else:
-			postings_list[word] = [docID]
-	doc_file.close()
+			postings_list[word] = [posting]
+	if positional:
+		position_count = sum(len(positions) for positions in words.itervalues())
+		return len(words) * (POSTING_BYTES + TUPLE_BYTES + LIST_BYTES) + position_count * POSITION_BYTES
+	elif weighted:
+		return len(words) * (POSTING_BYTES + TUPLE_BYTES)
+	return len(words) * POSTING_BYTES
 
 def index_all_docs(docs):
 	"""Calls index_doc on all documents in their order in the list passed as argument. Maintaining this order is important as this
@@ -79,25 +107,212 @@ def index_all_docs(docs):
 		index_doc(doc, postings_list)
 	return postings_list
 
-def write_postings(postings_list, postings_file_name):
+def merge_partial_indexes(partial_indexes):
+	"""Concatenates partial inverted indexes built over contiguous, ascending docID ranges into a single inverted index.
+	As every partial index only holds docIDs greater than those of the partial indexes before it, concatenating each term's
+	postings in order keeps them sorted.
+
+	:param partial_indexes: An iterable of inverted indexes, in ascending order of the docID ranges they were built from
+	:return: The inverted index over all of the given docID ranges
+	"""
+	postings_list = {}
+	for partial_index in partial_indexes:
+		for term, docIDs in partial_index.iteritems():
+			if term in postings_list:
+				postings_list[term].extend(docIDs)
+			else:
+				postings_list[term] = docIDs
+	return postings_list
+
+def index_all_docs_parallel(docs, workers):
+	"""Splits the documents into contiguous docID ranges, indexes the ranges with index_all_docs across a pool of worker
+	processes, and merges the partial indexes in docID order. The result is the same as index_all_docs(docs).
+
+	:param docs: The list of tuples containing the docID and file path to all documents, sorted by docID
+	:param workers: The number of worker processes to use
+	:return: The inverted index constructed from the given documents
+	"""
+	# More ranges than workers, so that a few slow ranges do not leave the other workers idle.
+	range_size = max(1, int(math.ceil(len(docs) / float(workers * 4))))
+	doc_ranges = [docs[start:start + range_size] for start in xrange(0, len(docs), range_size)]
+	pool = multiprocessing.Pool(workers)
+	try:
+		# imap hands back the partial indexes in the order of doc_ranges, keeping the merge in docID order.
+		postings_list = merge_partial_indexes(pool.imap(index_all_docs, doc_ranges))
+	finally:
+		pool.close()
+		pool.join()
+	return postings_list
+
+# Rough in-memory cost of the postings list, in bytes: a docID int object plus its slot in a list for each posting, and
+# a dict slot, the term string and an empty list for each term. Postings with positions or term frequencies also take a
+# (docID, positions or term frequency) tuple, and positions a list holding a position int object and its slot for each
+# position. Only used to decide when to flush a block.
+POSTING_BYTES = 32
+TUPLE_BYTES = 72
+LIST_BYTES = 72
+POSITION_BYTES = 32
+TERM_BYTES = 160
+
+def write_block(postings_list):
+	"""Writes an in-memory inverted index to a temporary file as a sorted block of (term, docIDs) records.
+
+	:param postings_list: The inverted index to be flushed
+	:return: The temporary file object holding the block. It is deleted when closed.
+	"""
+	block_file = tempfile.TemporaryFile()
+	for term in sorted(postings_list, key=storage.utf8):
+		pickle.dump((storage.utf8(term), postings_list[term]), block_file, pickle.HIGHEST_PROTOCOL)
+	return block_file
+
+def read_block(block_file, block_number):
+	"""Reads back the records of a block written by write_block, one at a time.
+
+	:param block_file: The temporary file object holding the block
+	:param block_number: The position of the block in docID order, attached to each record to order equal terms in the merge
+	:return: A generator of (term, block_number, docIDs) tuples, in term order
+	"""
+	block_file.seek(0)
+	while True:
+		try:
+			term, docIDs = pickle.load(block_file)
+		except EOFError:
+			block_file.close()
+			return
+		yield (term, block_number, docIDs)
+
+def merge_blocks(block_files):
+	"""k-way merges sorted blocks into a single stream of terms in sorted order. A term appearing in several blocks has its
+	postings concatenated in block order, which is docID order, so they stay sorted.
+
+	:param block_files: The block files written by write_block, in the order they were written
+	:return: A generator of (term, docIDs) tuples, in term order
+	"""
+	blocks = [read_block(block_file, block_number) for block_number, block_file in enumerate(block_files)]
+	current_term = current_docIDs = None
+	for term, block_number, docIDs in heapq.merge(*blocks):
+		if term == current_term:
+			current_docIDs.extend(docIDs)
+		else:
+			if current_term is not None:
+				yield (current_term, current_docIDs)
+			current_term, current_docIDs = term, docIDs
+	if current_term is not None:
+		yield (current_term, current_docIDs)
+
+def index_all_docs_spimi(docs, memory_budget):
+	"""Single-pass in-memory indexing: indexes documents in docID order like index_all_docs, but flushes the inverted index
+	to a sorted block on disk whenever its estimated size reaches the memory budget, then merges all blocks. Only one
+	block, plus one record per block during the merge, is ever held in memory.
+
+	:param docs: The list of tuples containing the docID and file path to all documents, sorted by docID
+	:param memory_budget: The estimated size in bytes at which the in-memory inverted index is flushed
+	:return: A generator of (term, docIDs) tuples of the inverted index, in term order, to be passed to write_sorted_postings
+	"""
+	block_files = []
+	postings_list = {}
+	postings_bytes = 0
+	for doc in docs:
+		postings_bytes += index_doc(doc, postings_list)
+		if postings_bytes + len(postings_list) * TERM_BYTES >= memory_budget:
+			block_files.append(write_block(postings_list))
+			postings_list = {}
+			postings_bytes = 0
+	if postings_list:
+		block_files.append(write_block(postings_list))
+	return merge_blocks(block_files)
+
+def write_postings(postings_list, postings_file_name, codec=storage.CODEC_ADAPTIVE):
 	"""Given an inverted index, write each term onto disk, while keeping track of the pointer to the start of postings for each term,
 	together with the run length of said postings on the file, which will be used to construct the dictionary.
 
 	:param postings_list: The inverted index to be stored
 	:param postings_file_name: The name of the postings file
-	:return: A dictionary object with term as key and a tuple of (postings pointer, postings run length in the file) as value
+	:param codec: The codec id (see storage.py) used to encode postings. Defaults to picking the smallest container per term.
+	:return: A dictionary object with term as key and a tuple of (postings pointer, postings run length in the file,
+		document frequency) as value
+	"""
+	# Terms are written in sorted order, so the same index always produces the same postings file.
+	sorted_terms = sorted(postings_list, key=storage.utf8)
+	return write_sorted_postings(((term, postings_list[term]) for term in sorted_terms), postings_file_name, codec)
+
+def write_sorted_postings(term_postings, postings_file_name, codec=storage.CODEC_ADAPTIVE):
+	"""Same as write_postings, but takes the inverted index as a stream of (term, docIDs) tuples in sorted term order, so the
+	index never has to be held in memory as a whole.
+
+	:param term_postings: An iterable of (term, docIDs) tuples, sorted by term
+	:param postings_file_name: The name of the postings file
+	:param codec: The codec id (see storage.py) used to encode postings. Defaults to picking the smallest container per term.
+	:return: A dictionary object with term as key and a tuple of (postings pointer, postings run length in the file,
+		document frequency) as value
 	"""
-	postings_file = file(postings_file_name, 'w')
+	postings_file = file(postings_file_name, 'wb')
+	storage.write_postings_header(postings_file, codec)
+	encode = storage.codecs[codec][0]
 	dict_terms = {}
-	for term, docIDs in postings_list.iteritems():
+	for term, docIDs in term_postings:
 		posting_pointer = postings_file.tell()
-		postings_file.write(" ".join([str(docID) for docID in docIDs]))
+		postings_file.write(encode(docIDs))
 		write_length = postings_file.tell() - posting_pointer
-		postings_file.write("\n")
-		dict_terms[term] = (posting_pointer, write_length)
+		if codec == storage.CODEC_TEXT:
+			postings_file.write("\n")
+		dict_terms[term] = (posting_pointer, write_length, len(docIDs))
 	postings_file.close()
 	return dict_terms
 
+def write_sorted_extended_postings(term_postings, postings_file_name, positions_file_name=None, frequencies_file_name=None,
+		codec=storage.CODEC_ADAPTIVE):
+	"""Same as write_sorted_postings, but takes the postings of an index built with positions or term frequencies:
+	(docID, positions) tuples if positions were indexed, and (docID, term frequency) tuples otherwise. The docIDs are
+	written to the postings file, and the positions and term frequencies to the positions and frequencies files (see
+	storage.py), if they are named.
+
+	:param term_postings: An iterable of (term, list of (docID, positions or term frequency) tuples) tuples, sorted by term
+	:param postings_file_name: The name of the postings file
+	:param positions_file_name: The name of the positions file, or None to write no positions
+	:param frequencies_file_name: The name of the frequencies file, or None to write no term frequencies
+	:param codec: The codec id (see storage.py) used to encode the postings (but not the positions or term frequencies)
+	:return: A tuple of (dictionary of the postings addresses as write_sorted_postings returns them, dictionary of the
+		positions addresses in the same form or None, dictionary of the term frequencies addresses in the same form or None,
+		dict of docID -> length of the document in words, summed from the term frequencies, or None)
+	"""
+	positions_file = frequencies_file = None
+	positions_terms = frequencies_terms = document_lengths = None
+	if positions_file_name != None:
+		positions_file = file(positions_file_name, 'wb')
+		storage.write_postings_header(positions_file, storage.CODEC_POSITIONS)
+		positions_terms = {}
+	if frequencies_file_name != None:
+		frequencies_file = file(frequencies_file_name, 'wb')
+		storage.write_postings_header(frequencies_file, storage.CODEC_FREQUENCIES)
+		frequencies_terms = {}
+		document_lengths = {}
+
+	def write_list(extra_file, extra_terms, term, encoded, count):
+		pointer = extra_file.tell()
+		extra_file.write(encoded)
+		extra_terms[term] = (pointer, len(encoded), count)
+
+	def write_extras():
+		for term, postings in term_postings:
+			if positions_file != None:
+				write_list(positions_file, positions_terms, term, storage.positions_encode_postings(postings), len(postings))
+			if frequencies_file != None:
+				if positions_file != None:
+					frequencies = [(docID, len(positions)) for docID, positions in postings]
+				else:
+					frequencies = postings
+				write_list(frequencies_file, frequencies_terms, term, storage.frequencies_encode_postings(frequencies), len(postings))
+				for docID, frequency in frequencies:
+					document_lengths[docID] = document_lengths.get(docID, 0) + frequency
+			yield (term, [docID for docID, extra in postings])
+
+	dict_terms = write_sorted_postings(write_extras(), postings_file_name, codec)
+	for extra_file in (positions_file, frequencies_file):
+		if extra_file != None:
+			extra_file.close()
+	return (dict_terms, positions_terms, frequencies_terms, document_lengths)
+
 def all_doc_IDs(docs):
 	"""Extracts docIDs from a list of tuples of docID and path to the document file.
 
@@ -109,27 +324,181 @@ def all_doc_IDs(docs):
 
 def create_dictionary(docIDs, dict_terms, dict_file_name):
 	"""Combines the list of all document IDs (necessary for computing NOT), and the dictionary itself, to create the dictionary file,
-	and then writes the resulting list to the specified file path as a JSON data structure.
+	and then writes it to the specified file path in the binary dictionary format (see storage.py).
 
 	:param docIDs: The list of all document IDs, sorted
-	:param dict_terms: The dictionary, with term as key and tuple of (postings pointer, postings run length in the file) as value
+	:param dict_terms: The dictionary, with term as key and tuple of (postings pointer, postings run length in the file,
+		document frequency) as value
 	:dict_file_name: The file path of the resultant dictionary file
 	"""
-	dict_file = file(dict_file_name, 'w')
-	json.dump([docIDs, dict_terms], dict_file)
-	dict_file.close()
+	storage.write_dictionary(docIDs, dict_terms, dict_file_name)
+
+def unindexed_docs(docs, dict_file, postings_file):
+	"""Filters out the documents that are already in some segment of an existing index.
+
+	:param docs: The list of tuples containing the docID and file path to all documents, sorted by docID
+	:param dict_file: The file path of the dictionary file of the existing index
+	:param postings_file: The file path of the postings file of the existing index
+	:return: The list of tuples of the documents not in the index yet, still sorted by docID
+	"""
+	index = storage.Index(dict_file, postings_file)
+	# Deleted documents stay in the postings until compaction, so they cannot be indexed again before then.
+	indexed_docIDs = set(index.all_docIDs)
+	indexed_docIDs.update(index.deleted)
+	index.close()
+	return [(docID, doc_path) for docID, doc_path in docs if docID not in indexed_docIDs]
+
+def segment_file_names(dict_file, postings_file, generation):
+	"""Names the dictionary and postings files of a new segment after the files the index is opened with.
+
+	:return: A tuple of (dictionary file path, postings file path) for the segment
+	"""
+	return ("{0}.{1}".format(dict_file, generation), "{0}.{1}".format(postings_file, generation))
+
+def delete_docs(dict_file, docIDs):
+	"""Deletes documents from an index by adding their docIDs to its tombstone file. Searches stop returning them the next
+	time they open the index (a running server keeps the index it loaded), and the next compaction removes them from the
+	postings.
+
+	:param dict_file: The file path of the dictionary file of the index
+	:param docIDs: A list of the docIDs to delete
+	"""
+	storage.write_tombstones(dict_file, list(storage.read_tombstones(dict_file)) + docIDs)
+
+def live_postings(index, deleted):
+	"""Reads every term of an index with its postings merged across segments, leaving out deleted documents.
+
+	:param index: The storage.Index to read
+	:param deleted: A set of the docIDs to leave out
+	:return: A generator of (term, docIDs) tuples in term order, skipping terms left without postings
+	"""
+	for term in index.terms():
+		docIDs = [docID for docID in index.read_postings(term) if docID not in deleted]
+		if docIDs:
+			yield (term, docIDs)
+
+def live_extended_postings(index, deleted):
+	"""Same as live_postings, but for an index with positions or term frequencies in every segment, with postings of
+	(docID, positions) tuples if it has positions, and of (docID, term frequency) tuples otherwise.
+
+	:param index: The storage.Index to read
+	:param deleted: A set of the docIDs to leave out
+	:return: A generator of (term, list of (docID, positions or term frequency) tuples) tuples in term order
+	"""
+	for term, docIDs in live_postings(index, deleted):
+		if index.positional:
+			term_positions = index.read_positions(term)
+			yield (term, [(docID, term_positions.get(docID).tolist()) for docID in docIDs])
+		else:
+			frequencies = {}
+			for segment, parts in index.read_frequency_parts(term):
+				for last, decode, max_frequency in parts:
+					block_docIDs, block_frequencies = decode()
+					frequencies.update(zip(block_docIDs, block_frequencies))
+			yield (term, [(docID, frequencies[docID]) for docID in docIDs])
+
+def create_extra_files(docIDs, positions_terms, frequencies_terms, document_lengths, dict_file, postings_file):
+	"""Writes the positions dictionary, and the frequencies dictionary and document lengths file, of a segment whose
+	postings were written by write_sorted_extended_postings. Those the segment has none of are removed if they were left
+	over from an earlier index, as they would not match its postings.
+
+	:param docIDs: The list of the docIDs of the segment, sorted
+	:param positions_terms: The positions addresses returned by write_sorted_extended_postings, or None
+	:param frequencies_terms: The term frequencies addresses returned by write_sorted_extended_postings, or None
+	:param document_lengths: The document lengths returned by write_sorted_extended_postings, or None
+	:param dict_file: The file path of the dictionary file of the segment
+	:param postings_file: The file path of the postings file of the segment
+	"""
+	positions_dict, positions_file = storage.positions_file_names(dict_file, postings_file)
+	frequencies_dict, frequencies_file, lengths_file = storage.frequencies_file_names(dict_file, postings_file)
+	# The docIDs are already in the dictionary.
+	if positions_terms != None:
+		create_dictionary([], positions_terms, positions_dict)
+	elif isfile(positions_dict):
+		remove(positions_dict)
+	if frequencies_terms != None:
+		create_dictionary([], frequencies_terms, frequencies_dict)
+		storage.write_document_lengths(lengths_file, docIDs, document_lengths)
+	elif isfile(frequencies_dict):
+		remove(frequencies_dict)
+
+def compact_index(dict_file, postings_file):
+	"""Folds all segments of an index into a single new segment without the deleted documents, then points the segment
+	manifest at it. The segment files written by earlier appends and compactions are deleted afterwards, while the
+	dictionary and postings files the index is opened with are left in place. Searchers that opened the index earlier keep
+	reading the old segments through their memory maps, so compaction can run in the background while queries are served.
+
+	:param dict_file: The file path of the dictionary file the index is opened with
+	:param postings_file: The file path of the postings file the index is opened with
+	:return: False if the index already had a single segment and no deleted documents, so nothing was done, True otherwise
+	"""
+	generation, segments = storage.read_segments(dict_file, postings_file)
+	index = storage.Index(dict_file, postings_file)
+	if len(segments) < 2 and not index.deleted:
+		index.close()
+		return False
+	deleted = set(index.deleted)
+	compacted_dict_file, compacted_postings_file = segment_file_names(dict_file, postings_file, generation + 1)
+	if index.positional or index.weighted:
+		# Positions and term frequencies are only kept if every segment has them, as a segment without them would leave gaps.
+		dict_terms, positions_terms, frequencies_terms, document_lengths = write_sorted_extended_postings(
+			live_extended_postings(index, deleted), compacted_postings_file,
+			storage.positions_file_names(compacted_dict_file, compacted_postings_file)[1] if index.positional else None,
+			storage.frequencies_file_names(compacted_dict_file, compacted_postings_file)[1] if index.weighted else None)
+		create_extra_files(index.all_docIDs, positions_terms, frequencies_terms, document_lengths, compacted_dict_file,
+			compacted_postings_file)
+	else:
+		dict_terms = write_sorted_postings(live_postings(index, deleted), compacted_postings_file)
+	create_dictionary(index.all_docIDs, dict_terms, compacted_dict_file)
+	index.close()
+	storage.write_segments(dict_file, generation + 1, [(compacted_dict_file, compacted_postings_file)])
+	# Documents deleted while compaction was running are still in the compacted postings, so keep their tombstones.
+	storage.write_tombstones(dict_file, set(storage.read_tombstones(dict_file)) - deleted)
+	remove_segment_files(dict_file, postings_file, segments)
+	return True
+
+def remove_segment_files(dict_file, postings_file, segments):
+	"""Deletes the files of segments no longer listed in the manifest, leaving the dictionary and postings files the index
+	is opened with (and their positions and frequencies files) in place.
+
+	:param dict_file: The file path of the dictionary file the index is opened with
+	:param postings_file: The file path of the postings file the index is opened with
+	:param segments: A list of (dictionary file, postings file) paths of the segments to delete
+	"""
+	def all_files(segment_dict_file, segment_postings_file):
+		return ((segment_dict_file, segment_postings_file) + storage.positions_file_names(segment_dict_file, segment_postings_file)
+			+ storage.frequencies_file_names(segment_dict_file, segment_postings_file))
+
+	opened_files = all_files(dict_file, postings_file)
+	for segment_dict_file, segment_postings_file in segments:
+		segment_files = all_files(segment_dict_file, segment_postings_file)
+		for segment_file, opened_file in zip(segment_files, opened_files):
+			if abspath(segment_file) != abspath(opened_file) and isfile(segment_file):
+				remove(segment_file)
 
 def usage():
 	"""Prints the proper format for calling this script."""
-	print "usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file"
+	print "usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-j worker-processes | -m memory-budget-in-MB] [-a] [-s] [-P] [-f]"
+	print "       " + sys.argv[0] + " -c -d dictionary-file -p postings-file"
+	print "       " + sys.argv[0] + " -x docID[,docID...] -d dictionary-file -p postings-file"
+	print "  -a  append: index only documents not in the index yet, as a new segment"
+	print "  -s  single pass: analyze documents a line at a time without sentence detection (see analyzer.py)"
+	print "  -P  positional: also store where terms occur in documents, for phrase and NEAR/k queries (every segment needs them)"
+	print "  -f  frequencies: also store term frequencies and document lengths, for ranked queries (every segment needs them)"
+	print "  -c  compact: fold all segments of the index into one, dropping deleted documents"
+	print "  -x  delete: remove the given documents from search results, and from the postings at the next compaction"
 
 def parse_args():
 	"""Attempts to parse command line arguments fed into the script when it was called.
 	Notifies the user of the correct format if parsing failed.
 	"""
 	docs_dir = dict_file = postings_file = None
+	workers = 1
+	memory_budget = None
+	append = compact = single_pass_analysis = positional_index = weighted_index = False
+	deleted_docIDs = None
 	try:
-	    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
+	    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:j:m:acsPfx:')
 	except getopt.GetoptError, err:
 	    usage()
 	    sys.exit(2)
@@ -140,39 +509,129 @@ def parse_args():
 	        dict_file = a
 	    elif o == '-p':
 	        postings_file = a
+	    elif o == '-j':
+	        workers = int(a)
+	    elif o == '-m':
+	        memory_budget = int(float(a) * 1024 * 1024)
+	    elif o == '-a':
+	        append = True
+	    elif o == '-c':
+	        compact = True
+	    elif o == '-s':
+	        single_pass_analysis = True
+	    elif o == '-P':
+	        positional_index = True
+	    elif o == '-f':
+	        weighted_index = True
+	    elif o == '-x':
+	        deleted_docIDs = [int(docID) for docID in a.split(",")]
 	    else:
 	        assert False, "unhandled option"
-	if docs_dir == None or dict_file == None or postings_file == None:
+	if (docs_dir == None and not compact and deleted_docIDs == None) or dict_file == None or postings_file == None:
 	    usage()
 	    sys.exit(2)
-	return (docs_dir, dict_file, postings_file)
+	if workers > 1 and memory_budget != None:
+	    print "-j and -m cannot be used together"
+	    usage()
+	    sys.exit(2)
+	return (docs_dir, dict_file, postings_file, workers, memory_budget, append, compact, deleted_docIDs, single_pass_analysis,
+		positional_index, weighted_index)
 
 def main():
 	"""Constructs the inverted index from all documents in the specified file path, then writes dictionary to the specified dictionary
 	file in the command line arguments, and postings to the specified postings file.
 	"""
-	docs_dir, dict_file, postings_file = parse_args()
+	global single_pass, positional, weighted
+	(docs_dir, dict_file, postings_file, workers, memory_budget, append, compact, deleted_docIDs, single_pass,
+		positional, weighted) = parse_args()
+
+	if deleted_docIDs != None:
+		print "Deleting {0} documents from {1}...".format(len(deleted_docIDs), dict_file),
+		sys.stdout.flush()
+		delete_docs(dict_file, deleted_docIDs)
+		print "DONE"
+		return
+
+	if compact:
+		print "Compacting the segments of {0}...".format(dict_file),
+		sys.stdout.flush()
+		print "DONE" if compact_index(dict_file, postings_file) else "NOTHING TO DO"
+		return
 
 	print "Searching all documents in {0}...".format(docs_dir),
 	sys.stdout.flush()
 	docs = load_all_doc_names(docs_dir)
 	print "DONE"
 
+	segment_dict_file, segment_postings_file = dict_file, postings_file
+	if append and isfile(dict_file):
+		print "Skipping documents already in the index...",
+		sys.stdout.flush()
+		docs = unindexed_docs(docs, dict_file, postings_file)
+		print "DONE ({0} new)".format(len(docs))
+		if not docs:
+			return
+		generation, segments = storage.read_segments(dict_file, postings_file)
+		segment_dict_file, segment_postings_file = segment_file_names(dict_file, postings_file, generation + 1)
+
 	print "Constructing the inverted index...",
 	sys.stdout.flush()
-	postings_list = index_all_docs(docs)
+	if memory_budget != None:
+		term_postings = index_all_docs_spimi(docs, memory_budget)
+	elif workers > 1:
+		postings_list = index_all_docs_parallel(docs, workers)
+	else:
+		postings_list = index_all_docs(docs)
 	print "DONE"
 
-	print "Writing postings to {0}...".format(postings_file),
+	print "Writing postings to {0}...".format(segment_postings_file),
 	sys.stdout.flush()
-	dict_terms = write_postings(postings_list, postings_file)
+	positions_terms = frequencies_terms = document_lengths = None
+	if positional or weighted:
+		if memory_budget == None:
+			term_postings = ((term, postings_list[term]) for term in sorted(postings_list, key=storage.utf8))
+		dict_terms, positions_terms, frequencies_terms, document_lengths = write_sorted_extended_postings(term_postings,
+			segment_postings_file,
+			storage.positions_file_names(segment_dict_file, segment_postings_file)[1] if positional else None,
+			storage.frequencies_file_names(segment_dict_file, segment_postings_file)[1] if weighted else None)
+	elif memory_budget != None:
+		# Blocks are merged as the postings are written
+		dict_terms = write_sorted_postings(term_postings, segment_postings_file)
+	else:
+		dict_terms = write_postings(postings_list, segment_postings_file)
 	print "DONE"
 
-	print "Writing dictionary to {0}...".format(dict_file),
-	sys.stdout.flush()
 	docIDs = all_doc_IDs(docs)
-	create_dictionary(docIDs, dict_terms, dict_file)
+	if positional or weighted:
+		print "Writing the positions and term frequencies dictionaries...",
+		sys.stdout.flush()
+		create_extra_files(docIDs, positions_terms, frequencies_terms, document_lengths, segment_dict_file, segment_postings_file)
+		print "DONE"
+	else:
+		# Only removes those left over from an earlier index.
+		create_extra_files(docIDs, None, None, None, segment_dict_file, segment_postings_file)
+
+	print "Writing dictionary to {0}...".format(segment_dict_file),
+	sys.stdout.flush()
+	create_dictionary(docIDs, dict_terms, segment_dict_file)
 	print "DONE"
 
+	if segment_dict_file != dict_file:
+		print "Adding the segment to {0}...".format(storage.manifest_file_name(dict_file)),
+		sys.stdout.flush()
+		storage.write_segments(dict_file, generation + 1, segments + [(segment_dict_file, segment_postings_file)])
+		print "DONE"
+	else:
+		# A full build replaces the whole index, so the segments appended to or compacted from an earlier one are dropped,
+		# and so are its tombstones, which would hide documents of the new corpus reusing their docIDs.
+		if isfile(storage.manifest_file_name(dict_file)):
+			print "Removing the segments of the earlier index...",
+			sys.stdout.flush()
+			generation, segments = storage.read_segments(dict_file, postings_file)
+			remove(storage.manifest_file_name(dict_file))
+			remove_segment_files(dict_file, postings_file, segments)
+			print "DONE"
+		storage.write_tombstones(dict_file, [])
+
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+NumPy evaluation backend:
+
+Resolves operator nodes with postings held as sorted NumPy int32 arrays, using vectorized sorted-set primitives instead
+of walking the lists in Python:
+	AND:		searchsorted of the shorter array into the longer one, keeping the hits
+	OR:			sort and deduplicate the concatenated arrays
+	NOT:		a mask over all docIDs, cleared at the positions of the operand's docIDs
+	AND NOT:	a mask over the first array, cleared at the positions of the second array's docIDs
+
+Postings lists and bitmaps read from the index are converted on first use, and results are the same as those of the
+list backend in search.py.
+"""
+
+import numpy as np
+import bitmap
+from bitmap import Bitmap
+
+empty = np.zeros(0, dtype=np.int32)
+
+
+def as_array(p):
+    """Converts postings of any kind to a sorted NumPy int32 array.
+
+    :param p: An array('i') or list of docIDs, a bitmap.Bitmap, or a NumPy array.
+    :return: A sorted NumPy int32 array of the docIDs.
+    """
+    if isinstance(p, np.ndarray):
+        return p
+    if isinstance(p, Bitmap):
+        if not p.bits:
+            return empty
+        flags = np.frombuffer(bitmap.bits_to_bytes(p.bits), dtype=np.uint8)
+        # unpackbits gives the most significant bit of each byte first, while bit i of a byte is docID 8 * byte + i.
+        bits = np.unpackbits(flags).reshape(-1, 8)[:, ::-1].ravel()
+        return np.flatnonzero(bits).astype(np.int32)
+    if len(p) == 0:
+        return empty
+    if getattr(p, "typecode", None) == 'i' and p.itemsize == 4:
+        return np.frombuffer(p, dtype=np.int32)
+    return np.asarray(p, dtype=np.int32)
+
+
+universe_cache = (None, None)
+
+def universe_array(all_docIDs):
+    """Returns all docIDs as a NumPy array, converting them only when all_docIDs is not the list last converted.
+
+    :param all_docIDs: The list of all docIDs possible.
+    :return: A sorted NumPy int32 array of all docIDs.
+    """
+    global universe_cache
+    if universe_cache[0] is not all_docIDs:
+        universe_cache = (all_docIDs, as_array(all_docIDs))
+    return universe_cache[1]
+
+
+def positions_in(haystack, needles):
+    """Finds which needles occur in a sorted array, by binary searching all of them at once.
+
+    :param haystack: A sorted NumPy array.
+    :param needles: A sorted NumPy array.
+    :return: A tuple of (positions, found), where found is a boolean mask over needles and positions[found] are the
+        positions of the found needles in haystack.
+    """
+    positions = np.searchsorted(haystack, needles)
+    found = positions < len(haystack)
+    found[found] = haystack[positions[found]] == needles[found]
+    return (positions, found)
+
+
+def np_and(p1, p2):
+    """Evaluates p1 AND p2.
+
+    :param p1: A sorted NumPy array.
+    :param p2: A sorted NumPy array.
+    :return: A sorted NumPy array containing the result of p1 AND p2.
+    """
+    if len(p1) > len(p2):
+        p1, p2 = p2, p1
+    if len(p1) == 0:
+        return empty
+    positions, found = positions_in(p2, p1)
+    return p1[found]
+
+
+def np_multi_and(list_of_arrays):
+    """Evaluates p1 AND p2 AND ... AND pN, shortest operands first.
+
+    :param list_of_arrays: A list of sorted NumPy arrays.
+    :return: A sorted NumPy array containing the result of p1 AND p2 AND ... AND pN.
+    """
+    list_of_arrays = sorted(list_of_arrays, key=len)
+    result = list_of_arrays[0]
+    for p in list_of_arrays[1:]:
+        if len(result) == 0:
+            break
+        result = np_and(result, p)
+    return result
+
+
+def np_multi_or(list_of_arrays):
+    """Evaluates p1 OR p2 OR ... OR pN.
+
+    :param list_of_arrays: A list of sorted NumPy arrays.
+    :return: A sorted NumPy array containing the result of p1 OR p2 OR ... OR pN.
+    """
+    non_empty = [p for p in list_of_arrays if len(p) > 0]
+    if not non_empty:
+        return empty
+    if len(non_empty) == 1:
+        return non_empty[0]
+    return np.unique(np.concatenate(non_empty))
+
+
+def np_and_not(p1, p2):
+    """Evaluates p1 AND NOT p2.
+
+    :param p1: A sorted NumPy array.
+    :param p2: A sorted NumPy array.
+    :return: A sorted NumPy array containing the result of p1 AND NOT p2.
+    """
+    if len(p1) == 0 or len(p2) == 0:
+        return p1
+    positions, found = positions_in(p1, p2)
+    keep = np.ones(len(p1), dtype=bool)
+    keep[positions[found]] = False
+    return p1[keep]
+
+
+def np_not(p, all_p):
+    """Evaluates NOT p.
+
+    :param p: A sorted NumPy array.
+    :param all_p: A sorted NumPy array of every docID.
+    :return: A sorted NumPy array containing the result of NOT p.
+    """
+    return np_and_not(all_p, p)
+
+
+def merge(op, children_postings, all_docIDs):
+    """Resolves an operator node with NumPy. Counterpart of OpNode.merge in search.py.
+
+    :param op: The operator type: "NOT", "AND", "OR" or "AND NOT".
+    :param children_postings: A list of the children's postings, of any kind.
+    :param all_docIDs: The list of all docIDs possible.
+    :return: A sorted NumPy int32 array containing the resulting docIDs after resolving the operator.
+    """
+    children_arrays = [as_array(postings) for postings in children_postings]
+    if op == "NOT":
+        return np_not(children_arrays[0], universe_array(all_docIDs))
+    elif op == "OR":
+        return np_multi_or(children_arrays)
+    elif op == "AND":
+        return np_multi_and(children_arrays)
+    elif op == "AND NOT":
+        return np_and_not(children_arrays[0], children_arrays[1])
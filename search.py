@@ -1,43 +1,107 @@
 import re
-import nltk
 import sys
 import getopt
-import json
-import heapq
 import time
 import math
+import heapq
+import multiprocessing
+from itertools import izip
+from bisect import bisect_left, bisect_right
+import analyzer
+import storage
+import bitmap
+import cache
+from bitmap import Bitmap
+try:
+    import numpy_backend
+except ImportError:
+    numpy_backend = None
 
 show_time = False
+backends = ["list", "numpy", "cursor"]
+# Operators matched against the positions of search tokens, for indexes built with positions.
+positional_ops = ("PHRASE", "NEAR")
+near_pattern = re.compile(r"^NEAR/(\d+)$")
+# Separates the text of a ranked query from its boolean filter.
+filter_pattern = re.compile(r"\bFILTER\b")
+# BM25 parameters: how quickly the score of a term saturates with its frequency, and how much document lengths count.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The most search tokens a wildcard search token expands to. Beyond them, the matching search tokens are left out.
+WILDCARD_EXPANSIONS = 1024
+
+
+class QueryError(Exception):
+    """Raised for a query that cannot be evaluated, because it is malformed or asks for what the index does not store.
+
+    Only the query itself fails: the queries evaluated with it still get their results.
+    """
+
 
 class OpNode:
     """Nodes for tree used to model a search query in Reverse Polish Notation.
 
     A node may represent either a search token or an operator.
 
+    PHRASE and NEAR are positional operators. A PHRASE node matches documents where its children, which are search token
+    nodes, occur one right after the other in order. A NEAR node matches documents where its two children, which are
+    search token, PHRASE or NEAR nodes, occur at most distance positions apart in either order (1 being next to each
+    other), and spans both of them. Both operators need an index built with positions.
+
+    A wildcard search token, such as bank*, becomes an OR node of the search tokens it matches in the dictionary.
+
     Attributes:
         children: A list of OpNode instances. Only operator nodes have children.
         op: A string indicating the node's operator type.
-            Possible values: "NOT", "AND", "OR", "AND NOT", None
+            Possible values: "NOT", "AND", "OR", "AND NOT", "PHRASE", "NEAR", None
         term: A string containing the search token value.
-        postings: An integer list storing the docIDs from the postings list of a search token node.
+        distance: The greatest number of positions between the children of a NEAR node.
+        pattern: The wildcard search token an OR node was expanded from, or None.
+        truncated: True if the wildcard of an OR node matches more search tokens than it was expanded to.
+        postings: An integer list (or array) storing the docIDs from the postings list of a search token node, or None
+                  until it has been read.
+        positions: The storage.TermPositions of a search token node, or None until they are looked up.
+        index: The storage.Index a search token node reads its postings from.
         expected_count: An integer storing the expected number of docIDs after optimizations have been carried out on the tree,
                         based on the expected_count of child nodes.
+        expected_cost: The estimated number of docIDs decoded or compared to resolve the node, set by plan.
+        strategy: A string describing how the planner chose to resolve the node, set by plan.
+        intersections: The strategy of each intersection of an AND, AND NOT or positional node, "gallop" or "merge", in
+                       the order they are done, set by plan. The list backend resolves the node with them.
+        actual_count: The number of docIDs the node resolved to, or None if it was not resolved.
+        actual_partial: True if the node was resolved against candidates or only partly streamed, so actual_count may
+                        leave out other docIDs.
+        cursor: The Cursor streaming the docIDs of the node, once opened by open_cursor.
+        key: The canonical form of the subtree, once computed by canonical_key.
     """
 
     children = None
     op = None
     term = None
-    postings = []
+    distance = None
+    pattern = None
+    truncated = False
+    postings = None
+    positions = None
+    index = None
     expected_count = 0
+    expected_cost = 0
+    strategy = None
+    intersections = None
+    actual_count = None
+    actual_partial = False
+    cursor = None
+    key = None
 
     def __init__(self, children, op, term):
         """Inits OpNode with a list of its child nodes, its operator type, and its search token, where applicable.
 
-        Only operator nodes should have children, and has an operator type: "NOT", "AND", "OR", "AND NOT".HEAD
+        Only operator nodes should have children, and has an operator type: "NOT", "AND", "OR", "AND NOT", "PHRASE", "NEAR".
         Only search token nodes have a search token value, and has an operator type: None.
 
         :param children: A list of OpNode instances. Only operator nodes have children.
-        :param op: A string indicating the node's operator type. Possible values: "NOT", "AND", "OR", "AND NOT", None
+        :param op: A string indicating the node's operator type.
+            Possible values: "NOT", "AND", "OR", "AND NOT", "PHRASE", "NEAR", None
         :param term: A string containing the search token value
         """
 
@@ -52,61 +116,172 @@ class OpNode:
         """
         return self.op != None
 
-    def read_postings_of_term(self, postings_file, dictionary):
+    def look_up_term(self, index):
+        """Looks up own search token in the index, and stores its document frequency as its expected_count. For search token
+        nodes only.
+
+        The postings themselves are only read when the node is resolved, unless the dictionary does not record document
+        frequencies, in which case they are read now to count them.
+
+        :param index: storage.Index giving access to the dictionary and postings lists of every segment.
+        """
+        self.index = index
+        document_frequency = index.document_frequency(self.term)
+        if document_frequency is None:
+            self.read_postings_of_term(index)
+            document_frequency = len(self.postings)
+        self.expected_count = document_frequency
+
+    def read_postings_of_term(self, index, candidates=None):
         """ Gets own postings list from file and stores it in its attribute. For search token nodes only.
 
-        :param postings_file: File object referencing the file containing the complete set of postings lists.
-        :param dictionary: Dictionary that takes search token keys, and returns a tuple of pointer and length.
-            The pointer points to the starting point of the search token's postings list in the file.
-            The length refers to the length of the search token's postings list in bytes.
+        :param index: storage.Index giving access to the dictionary and postings lists of every segment.
+        :param candidates: A sorted list of docIDs, if the postings are only needed where they meet these docIDs.
+            Blocks of the postings that cannot hold any of them are then skipped.
         """
 
-        if self.term in dictionary:
-            term_pointer = dictionary[self.term][0]
-            postings_length = dictionary[self.term][1]
-            postings_file.seek(term_pointer)
-            self.postings = [int(docID) for docID in postings_file.read(postings_length).split()]
+        self.postings = index.read_postings(self.term, candidates)
+
+    def spans(self, docID):
+        """Finds where a search token, PHRASE or NEAR node matches in a document, decoding the positions of its search
+        tokens in that document only.
 
-    def recursive_merge(self, all_docIDs):
+        :param docID: The docID of the document.
+        :return: A sorted list of (first position, last position) tuples of the matches, empty if there is none.
+        """
+        if self.op == None:
+            if self.positions is None:
+                self.positions = self.index.read_positions(self.term)
+            return [(position, position) for position in self.positions.get(docID)]
+        elif self.op == "PHRASE":
+            # The phrase starts wherever its first search token is followed by the others in turn.
+            starts = None
+            for offset, child in enumerate(self.children):
+                child_starts = set(start - offset for start, end in child.spans(docID))
+                starts = child_starts if starts is None else starts & child_starts
+                if not starts:
+                    return []
+            return [(start, start + len(self.children) - 1) for start in sorted(starts)]
+        elif self.op == "NEAR":
+            first_spans = self.children[0].spans(docID)
+            if not first_spans:
+                return []
+            return near_spans(first_spans, self.children[1].spans(docID), self.distance)
+
+    def recursive_merge(self, all_docIDs, backend="list", candidates=None, cache=None):
         """Recursively resolves self and child operator nodes, and returns a list containing the resulting docIDs.
 
         For search token nodes, returns its postings list.
 
+        The children of AND and AND NOT nodes are resolved with the docIDs of the child resolved first as candidates,
+        so the postings of large search tokens are only decoded in the blocks that can still be part of the result.
+        Given candidates, a node may leave out docIDs that are not candidates, but it resolves exactly on the candidates.
+
+        Given a cache, operator nodes are looked up in it before being resolved, and stored in it once resolved in full.
+        Recurring subtrees are resolved in full even if candidates are given, so that they can be stored.
+
         :param all_docIDs: The list of all docIDs possible.
+        :param backend: The evaluation backend resolving operator nodes, one of backends.
+        :param candidates: A sorted list of docIDs, if the result is only needed where it meets these docIDs.
+        :param cache: A cache.ResultCache of resolved subtrees, or None.
         :return: A list containing resulting docIDs after resolving operators, or postings list for search token nodes
         """
-        if self.op != None:
-            children_postings = [child.recursive_merge(all_docIDs) for child in self.children]
-            return self.merge(children_postings, all_docIDs)
-        else:
+        if cache is not None and self.op != None:
+            key = (backend, self.canonical_key())
+            result = cache.get(key)
+            if result is not None:
+                self.strategy = "cached"
+                self.actual_count = len(result)
+                self.actual_partial = False
+                return result
+            if cache.recurring(key):
+                candidates = None
+        result = self.resolve(all_docIDs, backend, candidates, cache)
+        if cache is not None and self.op != None and candidates is None:
+            cache.put(key, result)
+        self.actual_count = len(result)
+        self.actual_partial = candidates is not None
+        return result
+
+    def resolve(self, all_docIDs, backend, candidates, cache):
+        """Resolves the node for recursive_merge, which takes the same parameters."""
+        if self.op == None:
+            if self.postings is None:
+                # Only the blocks meeting the candidates are read if the planner expected that to save decoding.
+                self.read_postings_of_term(self.index, None if self.strategy == "read" else candidates)
             return self.postings
 
+        if self.op == "AND":
+            # The planner put the child expected to be smallest first, as it bounds the result.
+            first_postings = self.children[0].recursive_merge(all_docIDs, backend, candidates, cache)
+            if len(first_postings) == 0:
+                return first_postings
+            children_postings = [first_postings]
+            for child in self.children[1:]:
+                children_postings.append(child.recursive_merge(all_docIDs, backend, candidates_of(first_postings), cache))
+        elif self.op == "AND NOT":
+            first_postings = self.children[0].recursive_merge(all_docIDs, backend, candidates, cache)
+            if len(first_postings) == 0:
+                return first_postings
+            children_postings = [first_postings, self.children[1].recursive_merge(all_docIDs, backend, candidates_of(first_postings), cache)]
+        elif self.op in positional_ops:
+            # Only the documents holding every search token can match, so positions are only decoded for those.
+            children = sorted(self.children, key=lambda child: child.expected_count)
+            children_postings = [children[0].recursive_merge(all_docIDs, backend, candidates, cache)]
+            for child in children[1:]:
+                if len(children_postings[-1]) == 0:
+                    return []
+                children_postings.append(child.recursive_merge(all_docIDs, backend, candidates_of(children_postings[0]), cache))
+            if any(isinstance(postings, Bitmap) for postings in children_postings):
+                docIDs = bitmap_and(children_postings)
+            else:
+                docIDs = op_multi_and(children_postings, self.intersections)
+            return [docID for docID in docIDs if self.spans(docID)]
+        else:
+            children_postings = [child.recursive_merge(all_docIDs, backend, candidates, cache) for child in self.children]
+
+        if backend == "numpy":
+            return numpy_backend.merge(self.op, children_postings, all_docIDs)
+        return self.merge(children_postings, all_docIDs)
+
     def merge(self, children_postings, all_docIDs):
         """Resolves operator nodes, and returns a list containing the resulting docIDs. For operator nodes only.
 
+        Dense postings are stored as bitmaps, and operators with a bitmap among their operands are resolved with bitwise
+        operations instead of walking the lists. Otherwise, AND and AND NOT intersect the lists in the order and with the
+        strategies picked by the planner.
+
         :param children_postings: A list of child search token nodes' postings lists
         :param all_docIDs: The list of all docIDs possible.
-        :return: A list containing the resulting docIDs after resolving the operator.
+        :return: A list (or bitmap) containing the resulting docIDs after resolving the operator.
         """
         if self.op == "NOT":
-            return op_not(children_postings[0], all_docIDs)
+            return bitmap_not(children_postings[0], all_docIDs)
+        if any(isinstance(postings, Bitmap) for postings in children_postings):
+            if self.op == "OR":
+                return bitmap_or(children_postings)
+            elif self.op == "AND":
+                return bitmap_and(children_postings)
+            elif self.op == "AND NOT":
+                return bitmap_and_not(children_postings[0], children_postings[1])
         elif self.op == "OR":
             return op_multi_or(children_postings)
         elif self.op == "AND":
-            return op_multi_and(children_postings)
+            return op_multi_and(children_postings, self.intersections)
         elif self.op == "AND NOT":
-            return op_and_not(children_postings[0], children_postings[1])
+            return op_and_not(children_postings[0], children_postings[1], (self.intersections or [None])[0])
 
     def consolidate_ops(self):
         """Flattens tree structure of operator nodes in children depending on node operator type. The tree might lose itsno longer
         be a binary tree 
 
         AND/OR is transitive, thus children of consecutive AND/OR nodes are recursively consolidated as self's children.
+        The OR nodes of wildcard search tokens are kept whole, so that their search tokens are resolved together.
         Consecutive NOT nodes are merged, where a parent NOT and its child NOT nodes are replaced by its grandchild.
         """
         if self.op == "AND":
             self.children = self.consolidate_ops_recursive("AND")
-        elif self.op == "OR":
+        elif self.op == "OR" and self.pattern is None:
             self.children = self.consolidate_ops_recursive("OR")
         elif self.op == "NOT":
             descendant, effective = self.consolidate_not_recursive(False)
@@ -125,7 +300,7 @@ class OpNode:
         :param required_op: The operator type that is being consolidated. Has to be AND/OR.
         :return: A list of nodes, where children of consecutive AND/OR nodes were recursively consolidated.
         """
-        if self.op != required_op:
+        if self.op != required_op or self.pattern is not None:
             return [self]
         else:
             grouped_children = []
@@ -151,9 +326,14 @@ class OpNode:
         """
         self.op = descendant.op
         self.term = descendant.term
+        self.distance = descendant.distance
+        self.pattern = descendant.pattern
+        self.truncated = descendant.truncated
         self.expected_count = descendant.expected_count
         self.children = descendant.children
         self.postings = descendant.postings
+        self.positions = descendant.positions
+        self.index = descendant.index
 
     def de_morgans(self, children_nots):
         """Applies De Morgan's laws to children nodes, and reduces the number of computationally expensive NOT nodes.
@@ -212,21 +392,194 @@ class OpNode:
         """Calculates the expected size of this node's postings list.
 
         If node is an operator node, returns an expected size based on its operator type and children's expected size.
+        Search tokens are taken to occur independently of each other, so the fraction of all docIDs expected in the result
+        of AND is the product of its children's fractions, and so on.
 
         :param all_docIDs: The list of all docIDs possible.
         :return: An integer storing the expected number of docIDs after this node has been fully resolved.
         """
+        universe = float(max(len(all_docIDs), 1))
         if self.op == None:
-            self.expected_count = len(self.postings)
-        elif self.op == "AND":
+            pass # set from the search token's document frequency by look_up_term
+        elif self.op == "AND" or self.op in positional_ops:
+            # Positions can only rule out more documents, so the estimate of AND is an upper bound for them.
             for child in self.children: child.calculate_expected(all_docIDs)
-            self.expected_count = min([child.expected_count for child in self.children])
+            fraction = 1.0
+            for child in self.children: fraction *= child.expected_count / universe
+            self.expected_count = int(round(universe * fraction))
         elif self.op == "OR":
             for child in self.children: child.calculate_expected(all_docIDs)
-            self.expected_count = sum([child.expected_count for child in self.children])
+            fraction_missed = 1.0
+            for child in self.children: fraction_missed *= 1.0 - child.expected_count / universe
+            self.expected_count = int(round(universe * (1.0 - fraction_missed)))
         elif self.op == "NOT":
             self.children[0].calculate_expected(all_docIDs)
             self.expected_count = len(all_docIDs) - self.children[0].expected_count
+        elif self.op == "AND NOT":
+            for child in self.children: child.calculate_expected(all_docIDs)
+            self.expected_count = int(round(self.children[0].expected_count * (1.0 - self.children[1].expected_count / universe)))
+        return self.expected_count
+
+    def plan(self, all_docIDs):
+        """Planner pass, to be run after consolidate_children. Estimates the size of every node's result from the
+        document frequencies of the search tokens, orders the children of AND nodes smallest first, and picks how every
+        node will be resolved, estimating what that costs. Resolving the node then follows the plan: search tokens read
+        either all of their postings or only the blocks meeting the candidates, and intersections gallop or merge, as
+        picked here. Whether operands are bitmaps is only known once they are read, so bitmap operations are picked then.
+
+        :param all_docIDs: The list of all docIDs possible.
+        """
+        self.calculate_expected(all_docIDs)
+        self.plan_strategy(None)
+
+    def plan_strategy(self, candidate_count):
+        """Picks how this node and its children will be resolved, and estimates the cost of doing so as the number of
+        docIDs decoded or compared. Needs expected_count to be calculated.
+
+        :param candidate_count: The expected number of candidate docIDs the node will be resolved against, or None.
+        :return: The estimated cost of resolving this node.
+        """
+        if self.op == None:
+            block_count = self.expected_count // storage.BLOCK_SIZE
+            if candidate_count is not None and candidate_count < block_count:
+                self.strategy = "read matching blocks"
+                self.expected_cost = candidate_count * storage.BLOCK_SIZE
+            else:
+                self.strategy = "read"
+                self.expected_cost = self.expected_count
+        elif self.op == "AND":
+            # The smallest child bounds the result, and the others are only read where they can meet it.
+            self.children.sort(key=lambda child: child.expected_count)
+            self.expected_cost, self.intersections = plan_intersection(self.children, candidate_count)
+            self.strategy = " then ".join(self.intersections) or "single operand"
+        elif self.op in positional_ops:
+            # Resolved as an AND of the children, which keep their order, then the positions of every document in it
+            # are decoded and matched.
+            self.expected_cost, self.intersections = plan_intersection(
+                sorted(self.children, key=lambda child: child.expected_count), candidate_count)
+            self.expected_cost += self.expected_count * len(self.children)
+            self.strategy = " then ".join(self.intersections + ["match positions"])
+        elif self.op == "AND NOT":
+            self.expected_cost = self.children[0].plan_strategy(candidate_count)
+            self.expected_cost += self.children[1].plan_strategy(self.children[0].expected_count)
+            self.strategy, cost = intersection_strategy(self.children[0].expected_count, self.children[1].expected_count)
+            self.intersections = [self.strategy]
+            self.expected_cost += cost
+        elif self.op == "OR":
+            self.expected_cost = sum([child.plan_strategy(candidate_count) for child in self.children])
+            self.expected_cost += sum([child.expected_count for child in self.children])
+            self.strategy = "union"
+        elif self.op == "NOT":
+            # NOT is only left where it cannot become part of an AND NOT, so it is resolved as a complement.
+            self.expected_cost = self.children[0].plan_strategy(candidate_count) + self.children[0].expected_count
+            self.strategy = "complement"
+        return self.expected_cost
+
+    def explain(self, depth=0):
+        """Describes how the subtree was planned and resolved, one node per line, children indented under their parent.
+
+        :param depth: The depth of this node in the tree.
+        :return: A list of lines.
+        """
+        if self.actual_count is None:
+            actual = "skipped"
+        elif self.actual_partial:
+            actual = "{0} (partial)".format(self.actual_count)
+        else:
+            actual = str(self.actual_count)
+        name = self.op_name() if self.op != None else self.term
+        if self.pattern is not None:
+            name = "{0} {1} ({2} search tokens{3})".format(name, self.pattern, len(self.children),
+                                                           ", truncated" if self.truncated else "")
+        lines = ["{0}{1}  estimated={2} actual={3} cost={4} strategy={5}".format(
+            "  " * depth, name, self.expected_count, actual, int(self.expected_cost), self.strategy)]
+        for child in self.children or []:
+            lines.extend(child.explain(depth + 1))
+        return lines
+
+    def op_name(self):
+        """Returns the operator type as written in queries, with the distance of NEAR nodes."""
+        if self.op == "NEAR":
+            return "NEAR/{0}".format(self.distance)
+        return self.op
+
+    def canonical_key(self):
+        """Returns a hashable canonical form of the subtree, equal for subtrees that always resolve to the same docIDs
+        because they only differ in the order of the children of AND, OR and NEAR nodes.
+
+        :return: The search token for search token nodes, or a tuple of the operator type and the children's keys.
+        """
+        if self.key is None:
+            if self.op == None:
+                self.key = self.term
+            else:
+                children_keys = [child.canonical_key() for child in self.children]
+                if self.op in ("AND", "OR", "NEAR"):
+                    children_keys.sort()
+                self.key = (self.op_name(),) + tuple(children_keys)
+        return self.key
+
+    def nodes(self):
+        """Returns a generator of the nodes of the subtree, self first."""
+        yield self
+        for child in self.children or []:
+            for node in child.nodes():
+                yield node
+
+    def open_cursor(self, all_docIDs):
+        """Recursively opens cursors streaming the docIDs of self and its children, without resolving anything yet.
+
+        Postings are decoded a part at a time as the cursors reach them, so the memory used grows with the depth of the
+        tree rather than with the size of intermediate results, and parts of postings lists skipped over by AND and
+        AND NOT are never decoded. Needs the tree to be planned, so that AND is led by its smallest child.
+
+        :param all_docIDs: The list of all docIDs possible.
+        :return: A Cursor.
+        """
+        if self.op == None:
+            if self.postings is not None:
+                self.cursor = list_cursor(self.postings)
+            else:
+                segment_cursors = [PostingsCursor(parts) for parts in self.index.read_postings_parts(self.term)]
+                if len(segment_cursors) == 1:
+                    self.cursor = segment_cursors[0]
+                else:
+                    self.cursor = OrCursor(segment_cursors)
+        elif self.op == "AND":
+            self.cursor = AndCursor([child.open_cursor(all_docIDs) for child in self.children])
+        elif self.op == "OR" and self.pattern is not None:
+            # A wildcard's search tokens are many and mostly short, so their union is taken at once rather than merged a
+            # docID at a time through the heap of an OrCursor.
+            for child in self.children:
+                if child.postings is None:
+                    child.read_postings_of_term(child.index)
+            self.cursor = list_cursor(self.merge([child.postings for child in self.children], all_docIDs))
+        elif self.op == "OR":
+            self.cursor = OrCursor([child.open_cursor(all_docIDs) for child in self.children])
+        elif self.op == "AND NOT":
+            self.cursor = AndNotCursor(self.children[0].open_cursor(all_docIDs), self.children[1].open_cursor(all_docIDs))
+        elif self.op == "NOT":
+            self.cursor = AndNotCursor(list_cursor(all_docIDs), self.children[0].open_cursor(all_docIDs))
+        elif self.op in positional_ops:
+            for child in self.children:
+                child.open_cursor(all_docIDs)
+            children = sorted(self.children, key=lambda child: child.expected_count)
+            self.cursor = FilterCursor(AndCursor([child.cursor for child in children]), self.spans)
+        return self.cursor
+
+    def count_streamed(self, exhausted):
+        """Records the number of docIDs the cursors of self and its children moved to as their actual counts.
+
+        :param exhausted: True if the cursor of self was streamed to its end.
+        """
+        self.actual_count = self.cursor.count
+        self.actual_partial = not exhausted
+        for child in self.children or []:
+            if child.cursor is None:
+                # Read in full by a wildcard's union instead of streamed.
+                child.actual_count = len(child.postings)
+            else:
+                child.count_streamed(False)
 
 
 class OpTree:
@@ -240,27 +593,160 @@ class OpTree:
     root = None
     op_list = ["NOT", "AND", "OR"]
 
-    def __init__(self, rpn_stack, postings_file, dictionary):
+    def __init__(self, rpn_stack, index):
         """Constructs the OpTree as a binary tree.
-        Loads postings into search-token OpNodes immediately.
+        Looks search tokens up in the index immediately, while their postings are read when the tree is resolved.
+
+        :param rpn_stack: A list of search tokens and operators in Reverse Polish Notation.
+        :param index: storage.Index to read the postings of search tokens from.
+        :raises QueryError: If an operator is missing an operand, or the query has phrases or NEAR/k but the index has no
+            positions, or NEAR/k has an operand other than a search token, phrase or NEAR/k.
         """
         node_stack = []
         for token in rpn_stack:
-            if token in self.op_list:
+            if (isinstance(token, tuple) or near_pattern.match(token)) and not index.positional:
+                raise QueryError("phrase and NEAR/k queries need an index built with positions (index.py -P)")
+            if isinstance(token, tuple):
+                # A phrase, as a tuple of its search tokens.
+                children = []
+                for term in token:
+                    term_node = OpNode(None, None, term)
+                    term_node.look_up_term(index)
+                    children.append(term_node)
+                node_stack.append(OpNode(children, "PHRASE", None))
+            elif near_pattern.match(token):
+                right_child = pop_operand(node_stack, token)
+                left_child = pop_operand(node_stack, token)
+                for child in (left_child, right_child):
+                    if child.op not in (None,) + positional_ops:
+                        # Only search tokens and phrases have positions.
+                        raise QueryError("NEAR/k only applies to search tokens, phrases and NEAR/k, not to {0}".format(
+                            child.op_name()))
+                near_node = OpNode([left_child, right_child], "NEAR", None)
+                near_node.distance = int(near_pattern.match(token).group(1))
+                node_stack.append(near_node)
+            elif token in self.op_list:
                 if token != "NOT":
-                    right_child = node_stack.pop()
-                    left_child = node_stack.pop()
+                    right_child = pop_operand(node_stack, token)
+                    left_child = pop_operand(node_stack, token)
                     node_stack.append(OpNode([left_child, right_child], token, None))
                 else:
                     # For a NOT, only child is always on the left
-                    only_child = node_stack.pop()
+                    only_child = pop_operand(node_stack, token)
                     node_stack.append(OpNode([only_child], token, None))
+            elif "*" in token:
+                node_stack.append(wildcard_node(token, index))
             else:
                 token_node = OpNode(None, None, token)
-                token_node.read_postings_of_term(postings_file, dictionary)
+                token_node.look_up_term(index)
                 node_stack.append(token_node)
         self.root = node_stack.pop()
 
+
+def pop_operand(node_stack, op):
+    """Pops the node of an operand of an operator off the node stack of OpTree.
+
+    :param node_stack: The list of nodes not yet taken as operands.
+    :param op: The operator, for the error message.
+    :return: The node on top of the stack.
+    :raises QueryError: If the stack is empty, as the operator is missing an operand.
+    """
+    if not node_stack:
+        raise QueryError("malformed query: {0} is missing an operand".format(op))
+    return node_stack.pop()
+
+
+def wildcard_node(pattern, index):
+    """Expands a wildcard search token into the search tokens it matches in the index, up to WILDCARD_EXPANSIONS of them.
+
+    :param pattern: The wildcard search token, in which * stands for any number of characters.
+    :param index: storage.Index to look the search tokens up in.
+    :return: An OR node of the matching search tokens' nodes, or a search token node if only one matches. If none do, a
+        search token node of the pattern itself, which has no postings.
+    """
+    terms, truncated = index.expand_wildcard(pattern, WILDCARD_EXPANSIONS)
+    term_nodes = []
+    for term in terms or [pattern]:
+        term_node = OpNode(None, None, term)
+        term_node.look_up_term(index)
+        term_nodes.append(term_node)
+    if len(term_nodes) == 1:
+        return term_nodes[0]
+    node = OpNode(term_nodes, "OR", None)
+    node.pattern = pattern
+    node.truncated = truncated
+    return node
+
+def intersection_strategy(count1, count2):
+    """Picks how op_and and op_and_not will intersect two postings lists of the given sizes, mirroring their choice.
+
+    :param count1: The (expected) length of the first postings list.
+    :param count2: The (expected) length of the second postings list.
+    :return: A tuple of ("gallop" or "merge", the estimated number of docIDs compared).
+    """
+    shorter = min(count1, count2)
+    longer = max(count1, count2)
+    if longer >= GALLOP_RATIO * shorter:
+        return ("gallop", shorter * (1 + math.log(longer / float(max(shorter, 1)) + 1, 2)))
+    return ("merge", shorter + longer)
+
+
+def plan_intersection(children, candidate_count):
+    """Plans the children of an AND, or of a positional operator, for intersecting them in the given order: the first is
+    resolved against the candidates, and each of the others against the docIDs of the first.
+
+    :param children: A list of OpNode instances, in the order they will be intersected.
+    :param candidate_count: The expected number of candidate docIDs the operator will be resolved against, or None.
+    :return: A tuple of (the estimated cost of resolving and intersecting the children, list of the strategy of each
+        intersection).
+    """
+    cost = children[0].plan_strategy(candidate_count)
+    result_count = children[0].expected_count
+    strategies = []
+    for child in children[1:]:
+        cost += child.plan_strategy(children[0].expected_count)
+        strategy, intersection_cost = intersection_strategy(result_count, child.expected_count)
+        strategies.append(strategy)
+        cost += intersection_cost
+        result_count = min(result_count, child.expected_count)
+    return (cost, strategies)
+
+
+def near_spans(spans1, spans2, distance):
+    """Pairs up the matches of the two operands of NEAR that are at most distance positions apart, in either order.
+
+    Only the matches of the second operand starting close enough to a match of the first are compared with it, by
+    binary search over their starts.
+
+    :param spans1: A sorted list of (first position, last position) tuples of the matches of the first operand.
+    :param spans2: The same for the second operand.
+    :param distance: The greatest number of positions from the end of one match to the start of the other.
+    :return: A sorted list of the (first position, last position) tuples spanning each pair.
+    """
+    if not spans2:
+        return []
+    starts2 = [start for start, end in spans2]
+    longest2 = max(end - start for start, end in spans2)
+    matches = set()
+    for start1, end1 in spans1:
+        for i in xrange(bisect_left(starts2, start1 - distance - longest2), bisect_right(starts2, end1 + distance)):
+            start2, end2 = spans2[i]
+            # The matches must not overlap, and then one of these is the gap between them.
+            if 1 <= max(start2 - end1, start1 - end2) <= distance:
+                matches.add((min(start1, start2), max(end1, end2)))
+    return sorted(matches)
+
+
+def candidates_of(postings):
+    """Returns resolved postings as candidates for resolving other nodes against, or None if they are a bitmap. Bitmaps
+    hold dense postings, against which skipping blocks would save little.
+
+    :param postings: A list or bitmap of docIDs.
+    :return: The postings, or None.
+    """
+    return None if isinstance(postings, Bitmap) else postings
+
+
 def precedence(op):
     """Given operator type, returns the precedence order of operator.
 
@@ -269,6 +755,8 @@ def precedence(op):
     :param op: Operator type in string.
     :return: An integer reflecting the precedence order of the operator. Higher precedence = higher integer value.
     """
+    if near_pattern.match(op):
+        return 3
     return {
         "OR": 0,
         "AND": 1,
@@ -280,19 +768,41 @@ def precedence(op):
 def shunting_yard(query):
     """Returns a list of search tokens and operators in Reverse Polish Notation.
 
+    Words in double quotes make up a phrase, which takes the place of a search token as a tuple of its search tokens (or
+    is just its search token, if it has only one). NEAR/k binds tighter than any other operator. Wildcard search tokens
+    are lowercased but not stemmed, as the search tokens they match are stems already. Inside quotes, * is taken as a
+    character of the word rather than a wildcard.
+
     :param query: A string containing the search query.
-    :return: A list of search tokens and operators in Reverse Polish Notation.
+    :return: A list of search tokens, phrases and operators in Reverse Polish Notation.
+    :raises QueryError: If the parentheses of the query are unbalanced.
     """
-    query_tokens = nltk.word_tokenize(query)
-    stemmer = nltk.stem.PorterStemmer()
+    query_tokens = analyzer.tokenize_query(query)
     rpn_stack = []
     op_stack = []
     op_list = ["NOT", "AND", "OR"]
+    phrase = None
+    if query_tokens.count('"') % 2:
+        query_tokens.append('"') # a phrase left open ends with the query
 
     for token in query_tokens:
-        if token not in op_list and token not in ["(", ")"]:
-            rpn_stack.append(stemmer.stem(token))
-        elif token in op_list:
+        if token == '"':
+            if phrase is None:
+                phrase = []
+            else:
+                if len(phrase) > 1:
+                    rpn_stack.append(tuple(phrase))
+                else:
+                    rpn_stack.extend(phrase)
+                phrase = None
+        elif phrase is not None:
+            # Inside quotes, operators and parentheses are words of the phrase.
+            phrase.append(analyzer.stem(token))
+        elif "*" in token:
+            rpn_stack.append(token.lower())
+        elif token not in op_list and token not in ["(", ")"] and not near_pattern.match(token):
+            rpn_stack.append(analyzer.stem(token))
+        elif token in op_list or near_pattern.match(token):
             while op_stack and precedence(token) <= precedence(op_stack[-1]):
                 rpn_stack.append(op_stack.pop())
             op_stack.append(token)
@@ -301,122 +811,161 @@ def shunting_yard(query):
         elif token == ")":
             while op_stack and op_stack[-1] != "(":
                 rpn_stack.append(op_stack.pop())
+            if not op_stack:
+                raise QueryError("malformed query: unbalanced parentheses")
             op_stack.pop()
 
     while op_stack:
+        if op_stack[-1] == "(":
+            raise QueryError("malformed query: unbalanced parentheses")
         rpn_stack.append(op_stack.pop())
 
     return rpn_stack
 
 
-def get_skip_flags(len1, len2):
-    """Given lengths of the first and second postings lists, return respective skip distances and boolean skip flags list .
-
-    :param len1: Int length of first postings list
-    :param len2: Int length of second postings list
-    :return:
-        skip1: Int, skip distance for first postings list.
-        skip2: Int, skip distance for second postings list.
-        flags1: Boolean list, determines whether skipping is allowed at a certain index of the first postings list.
-        flags2: Boolean list, determines whether skipping is allowed at a certain index of the second postings list.
-    """
-    skip1 = int(math.sqrt(len1))
-    skip2 = int(math.sqrt(len2))
-    flags1 = [False] * len1
-    flags2 = [False] * len2
-    a = 0
-    b = 0
-    while a < len1:
-        flags1[a] = True
-        a += skip1
-    while b < len2:
-        flags2[b] = True
-        b += skip2
-    return (skip1, skip2, flags1, flags2)
-
-
-def op_and(p1, p2):
+# Length ratio from which intersections gallop through the longer list instead of walking both lists in step.
+GALLOP_RATIO = 4
+
+
+def gallop(p, target, lo):
+    """Finds the first position at or after lo whose docID is not less than target, by exponential then binary search.
+
+    The cost grows with the log of the distance skipped rather than with the distance itself.
+
+    :param p: A sorted postings list.
+    :param target: The docID to search for.
+    :param lo: The position to start searching from.
+    :return: The first position i >= lo such that p[i] >= target, or len(p) if there is none.
+    """
+    n = len(p)
+    bound = 1
+    while lo + bound < n and p[lo + bound] < target:
+        bound <<= 1
+    return bisect_left(p, target, lo + (bound >> 1), min(lo + bound + 1, n))
+
+
+def op_and(p1, p2, strategy=None):
     """Evaluates p1 AND p2 and returns result as list.
 
+    When one list is much longer than the other, each docID of the shorter list is galloped to in the longer one.
+    Otherwise both lists are walked in step.
+
     :param p1: A list containing the first postings list.
     :param p2: A list containing the second postings list.
+    :param strategy: "gallop" or "merge", as picked by the planner (see intersection_strategy), or None to pick by the
+        lengths of the lists.
     :return: A list containing the result of p1 AND p2.
     """
+    if len(p1) > len(p2):
+        p1, p2 = p2, p1
     result = []
+    len1 = len(p1)
+    len2 = len(p2)
+
+    if strategy == "gallop" or strategy is None and len2 >= GALLOP_RATIO * len1:
+        j = 0
+        for docID in p1:
+            j = gallop(p2, docID, j)
+            if j == len2:
+                break
+            if p2[j] == docID:
+                result.append(docID)
+                j += 1
+        return result
+
     i = 0
     j = 0
-    skip_dist1, skip_dist2, can_skip1, can_skip2 = get_skip_flags(len(p1), len(p2))
-
-    while i < len(p1) and j < len(p2):
-        if p1[i] == p2[j]:
-            result.append(p1[i])
+    while i < len1 and j < len2:
+        docID1 = p1[i]
+        docID2 = p2[j]
+        if docID1 == docID2:
+            result.append(docID1)
             i += 1
             j += 1
-        elif p1[i] < p2[j]:
-            if can_skip1[i]:
-                lookahead = i + skip_dist1
-                if lookahead < len(p1) and p1[lookahead] <= p2[j]:
-                    i += skip_dist1
-                else:
-                    i += 1
-            else:
-                i += 1
+        elif docID1 < docID2:
+            i += 1
         else:
-            if can_skip2[j]:
-                lookahead = j + skip_dist2
-                if lookahead < len(p2) and p2[lookahead] <= p1[i]:
-                    j += skip_dist2
-                else:
-                    j += 1
-            else:
-                j += 1
-                
+            j += 1
+
     return result
 
 
-def op_multi_and(list_of_postings_lists):
+def op_multi_and(list_of_postings_lists, strategies=None):
     """Evaluates p1 AND p2 AND ... AND pN and returns result as list.
 
+    Small versus small: the shortest list is intersected with the next shortest, and each intermediate result (never
+    longer than the shortest list) with the next, stopping early once the result is empty. Given the strategies picked
+    by the planner, the lists are intersected in the order given instead, which the planner put smallest first by
+    expected length.
+
     :param list_of_postings_lists: A list of postings lists.
+    :param strategies: A list of the strategy of each intersection, as taken by op_and, or None to pick them by the
+        lengths of the lists.
     :return: A list containing the result of p1 AND p2 AND ... AND pN.
     """
-    list_of_postings_lists.sort(key=len)
+    if strategies is None:
+        list_of_postings_lists.sort(key=len)
+        strategies = [None] * (len(list_of_postings_lists) - 1)
     result = list_of_postings_lists[0]
 
-    for p in list_of_postings_lists[1:]:
-        result = op_and(result, p)
+    for p, strategy in zip(list_of_postings_lists[1:], strategies):
+        if not result:
+            break
+        result = op_and(result, p, strategy)
 
     return result
 
 
-def op_and_not(p1, p2):
+def op_and_not(p1, p2, strategy=None):
     """Evaluates p1 AND NOT p2 and returns result as list.
 
+    When p1 is much longer than p2, each docID of p2 is galloped to in p1 and the runs of p1 between them are copied
+    whole. When p2 is much longer, each docID of p1 is galloped to in p2. Otherwise both lists are walked in step.
+
     :param p1: A list containing the first postings list.
     :param p2: A list containing the second postings list.
+    :param strategy: "gallop" or "merge", as picked by the planner (see intersection_strategy), or None to pick by the
+        lengths of the lists. Either way, the longer list is the one galloped through.
     :return: A list containing the result of p1 AND NOT p2.
     """
     result = []
+    len1 = len(p1)
+    len2 = len(p2)
+    if strategy is None:
+        strategy = "gallop" if max(len1, len2) >= GALLOP_RATIO * min(len1, len2) else "merge"
+
+    if strategy == "gallop" and len1 >= len2:
+        i = 0
+        for docID in p2:
+            found = gallop(p1, docID, i)
+            result.extend(p1[i:found])
+            if found == len1:
+                return result
+            i = found + 1 if p1[found] == docID else found
+        result.extend(p1[i:])
+        return result
+
+    if strategy == "gallop":
+        j = 0
+        for docID in p1:
+            j = gallop(p2, docID, j)
+            if j == len2 or p2[j] != docID:
+                result.append(docID)
+        return result
+
     i = 0
     j = 0
-    skip_dist1, skip_dist2, can_skip1, can_skip2 = get_skip_flags(len(p1), len(p2))
-
-    while i < len(p1) and j < len(p2):
-        if p1[i] == p2[j]:
+    while i < len1 and j < len2:
+        docID1 = p1[i]
+        docID2 = p2[j]
+        if docID1 == docID2:
             i += 1
             j += 1
-        elif p1[i] < p2[j]:
-            result.append(p1[i])
+        elif docID1 < docID2:
+            result.append(docID1)
             i += 1
         else:
-            if can_skip2[j]:
-                lookahead = j + skip_dist2
-                if lookahead < len(p2) and p2[lookahead] <= p1[i]:
-                    j += skip_dist2
-                else:
-                    j += 1
-            else:
-                j += 1
+            j += 1
 
     result.extend(p1[i:])
 
@@ -426,52 +975,466 @@ def op_and_not(p1, p2):
 def op_multi_or(list_of_postings_lists):
     """Evaluates p1 OR p2 OR ... OR pN and returns result as list.
 
+    The union is taken by a set and sorted once, so apart from collecting the operands every docID is only handled in C,
+    which beats a k-way merge or pairwise merges walking the lists in Python at every input size.
+
     :param list_of_postings_lists: A list of postings lists.
     :return: A list containing the result of p1 OR p2 OR ... OR pN.
     """
-    heap = []
-    results = []
-    for postings in list_of_postings_lists:
-        for docID in postings:
-            heapq.heappush(heap, docID)
-
-    while heap:
-        smallest = heapq.heappop(heap)
-        if results:
-            if results[-1] != smallest: results.append(smallest)
-        else:
-            results.append(smallest)
+    non_empty = [postings for postings in list_of_postings_lists if len(postings) > 0]
+    if not non_empty:
+        return []
+    if len(non_empty) == 1:
+        return non_empty[0]
+    return sorted(set().union(*non_empty))
+
+
+universe_cache = (None, None)
+
+def universe_bitmap(all_docIDs):
+    """Returns the bitmap of all docIDs, building it only when all_docIDs is not the list it was last built from.
+
+    :param all_docIDs: The list of all docIDs possible.
+    :return: A Bitmap of all_docIDs.
+    """
+    global universe_cache
+    if universe_cache[0] is not all_docIDs:
+        universe_cache = (all_docIDs, bitmap.from_docIDs(all_docIDs))
+    return universe_cache[1]
 
-    return results
 
+def as_bitmap(p):
+    """Returns p as a bitmap, converting it if it is a postings list."""
+    return p if isinstance(p, Bitmap) else bitmap.from_docIDs(p)
 
-def op_not(p, all_p):
-    """Evaluates NOT p and returns result as list.
 
-    :param p: A list containing the postings list.
+def bitmap_not(p, all_p):
+    """Evaluates NOT p as the complement of p's bitmap against the bitmap of all docIDs.
+
+    :param p: A list or bitmap containing the postings list.
     :param all_p: A list containing the postings list that includes every docID.
-    :return: A list containing the result of NOT p.
+    :return: A bitmap containing the result of NOT p.
     """
-    result = []
-    i = 0
-    j = 0
+    return universe_bitmap(all_p).and_not(as_bitmap(p))
+
+
+def bitmap_or(list_of_postings_lists):
+    """Evaluates p1 OR p2 OR ... OR pN, where some of the operands are bitmaps.
+
+    :param list_of_postings_lists: A list of postings lists and bitmaps.
+    :return: A bitmap containing the result of p1 OR p2 OR ... OR pN.
+    """
+    result = Bitmap(0)
+    for p in list_of_postings_lists:
+        result = result | as_bitmap(p)
+    return result
 
-    while i < len(p) and j < len(all_p):
-        if p[i] == all_p[j]:
-            i += 1
-            j += 1
-        else:
-            result.append(all_p[j])
-            j += 1
 
-    result.extend(all_p[j:])
+def bitmap_and(list_of_postings_lists):
+    """Evaluates p1 AND p2 AND ... AND pN, where some of the operands are bitmaps.
 
+    The bitmaps are intersected bitwise. If there are also postings lists, those are intersected as lists, and the
+    (usually much shorter) result is probed against the bitmap instead of converting the lists to bitmaps.
+
+    :param list_of_postings_lists: A list of postings lists and bitmaps.
+    :return: A list or bitmap containing the result of p1 AND p2 AND ... AND pN.
+    """
+    bitmaps = [p for p in list_of_postings_lists if isinstance(p, Bitmap)]
+    lists = [p for p in list_of_postings_lists if not isinstance(p, Bitmap)]
+    result = bitmaps[0]
+    for b in bitmaps[1:]:
+        result = result & b
+    if lists:
+        result = [docID for docID in op_multi_and(lists) if docID in result]
     return result
 
 
+def bitmap_and_not(p1, p2):
+    """Evaluates p1 AND NOT p2, where at least one of the operands is a bitmap.
+
+    :param p1: A list or bitmap containing the first postings list.
+    :param p2: A list or bitmap containing the second postings list.
+    :return: A list (if p1 is a list) or bitmap containing the result of p1 AND NOT p2.
+    """
+    if isinstance(p1, Bitmap):
+        return p1.and_not(as_bitmap(p2))
+    if isinstance(p2, Bitmap):
+        return [docID for docID in p1 if docID not in p2]
+    return op_and_not(p1, p2)
+
+
+class Cursor:
+    """Streams the docIDs of a postings list or of a resolved node in ascending order, one at a time.
+
+    Cursors start before their first docID. next() moves to the following docID, and skip_to(target) moves to the first
+    docID not less than target, so operator cursors can skip the parts of their operands that cannot be in the result.
+    Both return the docID moved to, or None once the cursor is exhausted. A cursor never moves backwards.
+
+    Attributes:
+        docID: The current docID: -1 before the first one, and None once exhausted.
+        count: The number of docIDs the cursor has moved to so far.
+    """
+
+    docID = -1
+    count = 0
+
+    def next(self):
+        raise NotImplementedError
+
+    def skip_to(self, target):
+        raise NotImplementedError
+
+    def found(self, docID):
+        """Moves the cursor to docID, and returns it."""
+        self.docID = docID
+        if docID is not None:
+            self.count += 1
+        return docID
+
+    def take(self, limit=None):
+        """Streams the remaining docIDs into a list.
+
+        :param limit: The most docIDs to take, or None to take all of them.
+        :return: A sorted list of docIDs.
+        """
+        docIDs = []
+        while limit is None or len(docIDs) < limit:
+            docID = self.next()
+            if docID is None:
+                break
+            docIDs.append(docID)
+        return docIDs
+
+
+class PostingsCursor(Cursor):
+    """Cursor over a postings list split into parts that are decoded only once the cursor reaches them. Parts whose last
+    docID is known to be less than a target skipped to are never decoded.
+    """
+
+    def __init__(self, parts):
+        """
+        :param parts: A list of (last docID of the part or None if it is not known, function decoding the part) tuples,
+            as returned by storage.Index.read_postings_parts for one segment.
+        """
+        self.parts = parts
+        self.part = 0
+        self.docIDs = ()
+        self.position = 0
+
+    def load_part(self):
+        """Decodes the next part, and returns False if there is none."""
+        if self.part == len(self.parts):
+            return False
+        docIDs = self.parts[self.part][1]()
+        self.part += 1
+        self.docIDs = docIDs.docIDs() if isinstance(docIDs, Bitmap) else docIDs
+        self.position = 0
+        return True
+
+    def next(self):
+        if self.docID is None:
+            return None
+        if self.docID >= 0:
+            self.position += 1
+        while self.position >= len(self.docIDs):
+            if not self.load_part():
+                return self.found(None)
+        return self.found(self.docIDs[self.position])
+
+    def skip_to(self, target):
+        if self.docID is None or self.docID >= target:
+            return self.docID
+        while len(self.docIDs) == 0 or self.docIDs[-1] < target:
+            while self.part < len(self.parts) and self.parts[self.part][0] is not None and self.parts[self.part][0] < target:
+                self.part += 1
+            if not self.load_part():
+                return self.found(None)
+        self.position = gallop(self.docIDs, target, self.position)
+        return self.found(self.docIDs[self.position])
+
+
+def list_cursor(docIDs):
+    """Returns a cursor over an already decoded postings list or bitmap."""
+    return PostingsCursor([(None, lambda: docIDs)])
+
+
+class AndCursor(Cursor):
+    """Cursor over p1 AND p2 AND ... AND pN. The first operand leads, and the others are skipped to its docIDs."""
+
+    def __init__(self, children):
+        """
+        :param children: A list of cursors, best ordered by ascending expected length.
+        """
+        self.children = children
+
+    def next(self):
+        if self.docID is None:
+            return None
+        return self.align(self.children[0].next())
+
+    def skip_to(self, target):
+        if self.docID is None or self.docID >= target:
+            return self.docID
+        return self.align(self.children[0].skip_to(target))
+
+    def align(self, target):
+        """Skips every operand to target, and then to any larger docID an operand skipped to, until they all agree."""
+        agreed = 1
+        i = 1 % len(self.children)
+        while target is not None and agreed < len(self.children):
+            docID = self.children[i].skip_to(target)
+            if docID == target:
+                agreed += 1
+            else:
+                target = docID
+                agreed = 1
+            i = (i + 1) % len(self.children)
+        return self.found(target)
+
+
+class OrCursor(Cursor):
+    """Cursor over p1 OR p2 OR ... OR pN, merging the operands through a heap of their current docIDs."""
+
+    def __init__(self, children):
+        """
+        :param children: A list of cursors.
+        """
+        self.children = children
+        self.heap = [(-1, i) for i in xrange(len(children))]
+
+    def advance(self, step, bound):
+        """Moves every operand whose current docID is below bound with step, and returns the smallest current docID."""
+        heap = self.heap
+        while heap and heap[0][0] < bound:
+            docID = step(self.children[heap[0][1]])
+            if docID is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (docID, heap[0][1]))
+        return self.found(heap[0][0] if heap else None)
+
+    def next(self):
+        if self.docID is None:
+            return None
+        return self.advance(lambda child: child.next(), self.docID + 1)
+
+    def skip_to(self, target):
+        if self.docID is None or self.docID >= target:
+            return self.docID
+        return self.advance(lambda child: child.skip_to(target), target)
+
+
+class AndNotCursor(Cursor):
+    """Cursor over p1 AND NOT p2. The excluded operand is only skipped to the docIDs of the included one."""
+
+    def __init__(self, include, exclude):
+        """
+        :param include: The cursor of p1.
+        :param exclude: The cursor of p2.
+        """
+        self.include = include
+        self.exclude = exclude
+
+    def exclude_from(self, docID):
+        """Moves the included operand past the docIDs in the excluded one, from docID on."""
+        while docID is not None and self.exclude.skip_to(docID) == docID:
+            docID = self.include.next()
+        return self.found(docID)
+
+    def next(self):
+        if self.docID is None:
+            return None
+        return self.exclude_from(self.include.next())
+
+    def skip_to(self, target):
+        if self.docID is None or self.docID >= target:
+            return self.docID
+        return self.exclude_from(self.include.skip_to(target))
+
+
+class FilterCursor(Cursor):
+    """Cursor over the docIDs of another cursor that pass a test, such as the documents a phrase occurs in."""
+
+    def __init__(self, cursor, test):
+        """
+        :param cursor: The cursor of the docIDs to test.
+        :param test: A function of a docID, returning a true value for the docIDs to keep.
+        """
+        self.cursor = cursor
+        self.test = test
+
+    def keep_from(self, docID):
+        """Moves the tested cursor past the docIDs failing the test, from docID on."""
+        while docID is not None and not self.test(docID):
+            docID = self.cursor.next()
+        return self.found(docID)
+
+    def next(self):
+        if self.docID is None:
+            return None
+        return self.keep_from(self.cursor.next())
+
+    def skip_to(self, target):
+        if self.docID is None or self.docID >= target:
+            return self.docID
+        return self.keep_from(self.cursor.skip_to(target))
+
+
+class FrequencyCursor(PostingsCursor):
+    """Cursor over the docIDs of a search token in one segment, along with its term frequency in each of them, for
+    ranked retrieval. Blocks are decoded only once the cursor reaches them, so blocks skipped over are never decoded.
+
+    The score the search token can add to the documents of a block is bounded, without decoding the block, by the
+    block's highest term frequency in the shortest document of the segment (see bm25).
+
+    Attributes:
+        weight: The weight of the search token in the query: its idf, times the number of times it is in the query.
+        block_bounds: The highest score the search token can add to any document of each block.
+        bound: The highest score the search token can add to any document of the segment.
+        decoded: The number of blocks decoded so far.
+    """
+
+    weight = 0.0
+    bound = 0.0
+    decoded = 0
+
+    def __init__(self, parts, weight, shortest_length, average_length):
+        """
+        :param parts: A list of blocks of the search token's term frequencies, as returned by
+            storage.Index.read_frequency_parts for one segment.
+        :param weight: The weight of the search token in the query.
+        :param shortest_length: The length in words of the shortest document of the segment.
+        :param average_length: The average length in words of the documents of the index.
+        """
+        PostingsCursor.__init__(self, parts)
+        self.weight = weight
+        self.lasts = [last for last, decode, max_frequency in parts]
+        self.block_bounds = [weight * bm25(max_frequency, shortest_length, average_length)
+                             for last, decode, max_frequency in parts]
+        self.bound = max(self.block_bounds or [0.0])
+        self.frequencies = ()
+
+    def load_part(self):
+        """Decodes the next block, and returns False if there is none."""
+        if self.part == len(self.parts):
+            return False
+        self.docIDs, self.frequencies = self.parts[self.part][1]()
+        self.part += 1
+        self.position = 0
+        self.decoded += 1
+        return True
+
+    def frequency(self):
+        """Returns the term frequency of the search token in the current document."""
+        return self.frequencies[self.position]
+
+    def block_of(self, target):
+        """Finds the block that the first docID not less than target is in, without decoding it or moving the cursor.
+
+        :param target: A docID not less than the current one.
+        :return: A tuple of (the last docID of the block, the block's bound), or None if no docID is left from target.
+        """
+        block = bisect_left(self.lasts, target, max(self.part - 1, 0))
+        if block == len(self.lasts):
+            return None
+        return (self.lasts[block], self.block_bounds[block])
+
+
+def bm25(frequency, length, average_length):
+    """Scores a search token in a document by BM25, before weighting it by the search token's idf.
+
+    The score grows with the term frequency, but less and less, and shrinks as the document gets longer. It can therefore
+    be bounded over many documents by the score of their highest term frequency in their shortest length.
+
+    :param frequency: The number of times the search token occurs in the document.
+    :param length: The length of the document in words.
+    :param average_length: The average length of the documents in words.
+    :return: The score.
+    """
+    return frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+
+
+def wand(cursors, top_k, index, accepted=None, next_accepted=None):
+    """Finds the documents with the best BM25 scores, by the block-max WAND algorithm.
+
+    Cursors are kept in docID order. The pivot is the first cursor at which the score bounds of the cursors up to it add
+    up to more than the score of the top_k-th best document found so far, as no document before the pivot's can do
+    better. The bounds of the blocks that the pivot's document falls in, in the cursors up to the pivot (and those
+    already at its document), are then added up too. If they are not more than the score to beat, no document up to the
+    end of the first of those blocks can do better, nor any before the next cursor's document, so all cursors skip past
+    them. Otherwise, if all cursors up to the pivot are at its document, it is scored, and if not they skip to it. Either
+    way, cursors skip past blocks they never decode.
+
+    :param cursors: A list of FrequencyCursor instances, one for every search token and segment that has it.
+    :param top_k: The number of documents to find.
+    :param index: The storage.Index the cursors read from, for the lengths of the documents.
+    :param accepted: A function of a docID, returning True for the documents that may be returned, or None to accept all.
+    :param next_accepted: A function of a docID, returning the first docID not less than it that may be accepted, or None
+        if there is none. None if all are accepted.
+    :return: A tuple of (list of (score, docID) tuples of the top_k best documents, best first and by ascending docID
+        among equal scores, the number of documents scored, the number of times the block bounds skipped the pivot).
+    """
+    average_length = index.document_length_stats()[0]
+    top = [] # a heap of (score, -docID), the worst document first
+    threshold = 0.0
+    scored = block_skips = 0
+    cursors = [cursor for cursor in cursors if cursor.next() is not None]
+    while cursors:
+        cursors.sort(key=lambda cursor: cursor.docID)
+        bound = 0.0
+        for pivot, cursor in enumerate(cursors):
+            bound += cursor.bound
+            if bound > threshold:
+                break
+        else:
+            break
+        pivot_docID = cursors[pivot].docID
+        while pivot + 1 < len(cursors) and cursors[pivot + 1].docID == pivot_docID:
+            pivot += 1
+        block_bound = 0.0
+        block_end = None
+        for cursor in cursors[:pivot + 1]:
+            block = cursor.block_of(pivot_docID)
+            if block is not None:
+                block_bound += block[1]
+                block_end = block[0] if block_end is None else min(block_end, block[0])
+        if block_bound <= threshold:
+            # The pivot's block in the cursor it is from always holds it, so block_end is not None.
+            target = block_end + 1
+            if pivot + 1 < len(cursors):
+                target = min(target, cursors[pivot + 1].docID)
+            block_skips += 1
+        elif cursors[0].docID == pivot_docID:
+            if accepted is None or accepted(pivot_docID):
+                length = index.document_length(pivot_docID)
+                score = sum([cursor.weight * bm25(cursor.frequency(), length, average_length)
+                             for cursor in cursors if cursor.docID == pivot_docID])
+                scored += 1
+                # Documents come in docID order, so one scoring the same as the worst of the top does not replace it.
+                if len(top) < top_k:
+                    heapq.heappush(top, (score, -pivot_docID))
+                elif score > threshold:
+                    heapq.heapreplace(top, (score, -pivot_docID))
+                if len(top) == top_k:
+                    threshold = top[0][0]
+            target = pivot_docID + 1
+        else:
+            target = pivot_docID
+        if next_accepted is not None:
+            target = next_accepted(target)
+            if target is None:
+                break
+        for cursor in cursors:
+            if cursor.docID < target:
+                cursor.skip_to(target)
+        cursors = [cursor for cursor in cursors if cursor.docID is not None]
+    ranked = sorted(top, reverse=True)
+    return ([(score, -negative_docID) for score, negative_docID in ranked], scored, block_skips)
+
+
 def usage():
     """Prints the proper format for calling this script."""
-    print "usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results"
+    print "usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-b list|numpy|cursor] [-n limit] [-c result-cache-MB] [-t postings-cache-MB [-k preloaded-terms]] [-l lru|tinylfu] [-B | -r top-k] [-j worker-processes] [-e]"
 
 
 def load_args():
@@ -479,9 +1442,17 @@ def load_args():
     Notifies the user of the correct format if parsing failed.
     """
     dictionary_file = postings_file = queries_file = output_file = None
+    backend = "list"
+    explain = False
+    limit = None
+    cache_size = postings_cache_size = preload = 0
+    cache_policy = "lru"
+    batch = False
+    workers = 1
+    ranked = None
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:b:n:c:t:k:l:Br:j:e')
     except getopt.GetoptError, err:
         usage()
         sys.exit(2)
@@ -494,46 +1465,426 @@ def load_args():
             queries_file = a
         elif o == '-o':
             output_file = a
+        elif o == '-b':
+            backend = a
+        elif o == '-n':
+            limit = int(a)
+        elif o == '-c':
+            cache_size = int(float(a) * 1024 * 1024)
+        elif o == '-t':
+            postings_cache_size = int(float(a) * 1024 * 1024)
+        elif o == '-k':
+            preload = int(a)
+        elif o == '-l':
+            cache_policy = a
+        elif o == '-B':
+            batch = True
+        elif o == '-r':
+            ranked = int(a)
+        elif o == '-j':
+            workers = int(a)
+        elif o == '-e':
+            explain = True
         else:
             assert False, "unhandled option"
-    if dictionary_file == None or postings_file == None or queries_file == None or output_file == None:
+    if dictionary_file == None or postings_file == None or queries_file == None or output_file == None or backend not in backends or cache_policy not in cache.policies:
         usage()
         sys.exit(2)
-    return (dictionary_file, postings_file, queries_file, output_file)
+    if ranked is not None and (batch or ranked < 1):
+        usage()
+        sys.exit(2)
+    if backend == "numpy" and numpy_backend == None:
+        print "the numpy backend needs NumPy to be installed"
+        sys.exit(2)
+    return (dictionary_file, postings_file, queries_file, output_file, backend, explain, limit, cache_size,
+            postings_cache_size, preload, cache_policy, batch, workers, ranked)
+
+
+def load_index(dictionary_file, postings_file):
+    """Opens the index (every segment of it), ready for evaluating any number of queries.
+
+    :param dictionary_file: The file path of the dictionary file.
+    :param postings_file: The file path of the postings file.
+    :return: A storage.Index.
+    """
+    return storage.Index(dictionary_file, postings_file)
+
+
+def build_tree(query, index):
+    """Parses a single query, and builds, optimizes and plans its OpTree.
+
+    :param query: A string containing the search query.
+    :param index: storage.Index to evaluate the query against.
+    :return: The OpTree, or None if the query has no search tokens.
+    """
+    rpn_stack = shunting_yard(query)
+    if not rpn_stack:
+        return None
+    tree = OpTree(rpn_stack, index)
+    tree.root.consolidate_ops()
+    tree.root.consolidate_children()
+    tree.root.plan(index.all_docIDs)
+    return tree
+
+
+def resolve_tree(tree, index, backend="list", plans=None, limit=None, result_cache=None):
+    """Resolves a planned OpTree, and removes deleted docIDs from the result.
+
+    The cursor backend streams the result through cursors instead of resolving every node in full, and stops as soon as
+    limit docIDs are found.
+
+    :param tree: The OpTree, as built by build_tree.
+    :param index: storage.Index to evaluate the query against.
+    :param backend: The evaluation backend resolving operator nodes, one of backends.
+    :param plans: If given, a list that the lines explaining how the query was planned and resolved are appended to.
+    :param limit: The most docIDs to return (the smallest ones), or None to return all of them.
+    :param result_cache: A cache.ResultCache that resolved subtrees are shared across queries through, or None. It is not
+        used by the cursor backend.
+    :return: A list containing the resulting docIDs.
+    """
+    if backend == "cursor":
+        cursor = tree.root.open_cursor(index.all_docIDs)
+        if index.deleted:
+            cursor = AndNotCursor(cursor, list_cursor(index.deleted))
+        results = cursor.take(limit)
+        tree.root.count_streamed(limit is None or len(results) < limit)
+        if plans is not None:
+            plans.extend(tree.root.explain())
+        return results
+    if result_cache is not None:
+        result_cache.use_index(index)
+    results = tree.root.recursive_merge(index.all_docIDs, backend, None, result_cache)
+    if plans is not None:
+        plans.extend(tree.root.explain())
+    if backend == "numpy":
+        if index.deleted:
+            results = numpy_backend.np_and_not(numpy_backend.as_array(results), numpy_backend.as_array(index.deleted))
+        return numpy_backend.as_array(results).tolist()[:limit]
+    if index.deleted:
+        # NOT already excludes deleted docIDs through all_docIDs, so they can only come from search tokens' postings.
+        results = bitmap_and_not(results, index.deleted)
+    if isinstance(results, Bitmap):
+        results = results.docIDs()
+    if limit is not None:
+        results = results[:limit]
+    return results
+
+
+def evaluate_query(query, index, backend="list", plans=None, limit=None, result_cache=None):
+    """Parses a single query, builds and optimizes its OpTree, plans and resolves it.
 
+    :param query: A string containing the search query.
+    :param index: storage.Index to evaluate the query against.
+    :param backend: The evaluation backend resolving operator nodes, one of backends.
+    :param plans: If given, a list that the lines explaining how the query was planned and resolved are appended to.
+    :param limit: The most docIDs to return (the smallest ones), or None to return all of them.
+    :param result_cache: A cache.ResultCache that resolved subtrees are shared across queries through, or None.
+    :return: A list containing the resulting docIDs, or None if the query has no search tokens.
+    """
+    tree = build_tree(query, index)
+    if tree is None:
+        return None
+    return resolve_tree(tree, index, backend, plans, limit, result_cache)
+
+
+def query_term_counts(text):
+    """Finds the search tokens of the text of a ranked query, leaving out operators, parentheses and quotes.
+
+    :param text: A string containing the text of the query.
+    :return: A dict of search token -> the number of times it is in the text.
+    """
+    term_counts = {}
+    for token in analyzer.tokenize_query(text):
+        if token in ["NOT", "AND", "OR", "(", ")", '"'] or near_pattern.match(token):
+            continue
+        term = analyzer.stem(token)
+        term_counts[term] = term_counts.get(term, 0) + 1
+    return term_counts
+
+
+def evaluate_ranked(query, index, top_k, backend="list", plans=None, result_cache=None):
+    """Ranks the documents by their BM25 score for a query, and returns the best of them, found by block-max WAND (see
+    wand).
+
+    A ranked query is free text, optionally followed by FILTER and a boolean query. Every search token of the text adds to
+    the score of the documents it is in. Given a boolean query, it is resolved first (with the given backend, like any
+    other query), and only the documents matching it are ranked: cursors skip straight to them.
+
+    :param query: A string containing the ranked query.
+    :param index: storage.Index to evaluate the query against. It must have term frequencies.
+    :param top_k: The number of documents to return.
+    :param backend: The evaluation backend resolving the operator nodes of the boolean filter, one of backends.
+    :param plans: If given, a list that the lines explaining how the query was ranked (and its filter planned and
+        resolved) are appended to.
+    :param result_cache: A cache.ResultCache that resolved subtrees of boolean filters are shared across queries through,
+        or None.
+    :return: A list containing the docIDs of the top_k best documents, best first, or None if the query text has no
+        search tokens.
+    :raises QueryError: If the index has no term frequencies, or the filter cannot be evaluated.
+    """
+    if not index.weighted:
+        raise QueryError("ranked queries need an index built with term frequencies (index.py -f)")
+    text, filter_query = (filter_pattern.split(query, 1) + [""])[:2]
+    term_counts = query_term_counts(text)
+    if not term_counts:
+        return None
+
+    accepted = next_accepted = None
+    filter_plans = []
+    tree = build_tree(filter_query, index) if filter_query.strip() else None
+    if tree is not None:
+        allowed = resolve_tree(tree, index, backend, filter_plans, None, result_cache)
+
+        def accepted(docID):
+            i = bisect_left(allowed, docID)
+            return i < len(allowed) and allowed[i] == docID
+
+        def next_accepted(docID):
+            i = bisect_left(allowed, docID)
+            return allowed[i] if i < len(allowed) else None
+    elif index.deleted:
+        deleted = set(index.deleted)
+        accepted = lambda docID: docID not in deleted
+
+    # Document frequencies count deleted documents until the index is compacted, and so does the number of documents.
+    universe = sum([len(docIDs) for docIDs in index.segment_docIDs])
+    term_parts = [(term, count, index.read_frequency_parts(term)) for term, count in sorted(term_counts.iteritems())]
+    average_length, shortest_lengths = index.document_length_stats()
+    cursors = []
+    term_lines = []
+    for term, count, segment_parts in term_parts:
+        document_frequency = index.document_frequency(term)
+        if document_frequency is None:
+            document_frequency = len(index.read_postings(term))
+        weight = count * math.log(1 + (universe - document_frequency + 0.5) / (document_frequency + 0.5))
+        term_cursors = []
+        for segment, parts in segment_parts:
+            term_cursors.append(FrequencyCursor(parts, weight, shortest_lengths[segment], average_length))
+        cursors.extend(term_cursors)
+        term_lines.append((term, document_frequency, weight, term_cursors))
+
+    ranked, scored, block_skips = wand(cursors, top_k, index, accepted, next_accepted) if top_k > 0 else ([], 0, 0)
+    if plans is not None:
+        plans.append("RANKED  top={0} scored={1} block skips={2}".format(top_k, scored, block_skips))
+        for term, document_frequency, weight, term_cursors in term_lines:
+            plans.append("  {0}  df={1} weight={2:.3f} bound={3:.3f} blocks decoded={4} of {5}".format(
+                term, document_frequency, weight, max([cursor.bound for cursor in term_cursors] or [0.0]),
+                sum([cursor.decoded for cursor in term_cursors]), sum([len(cursor.parts) for cursor in term_cursors])))
+        if tree is not None:
+            plans.append("  FILTER")
+            plans.extend("    " + line for line in filter_plans)
+    return [docID for score, docID in ranked]
+
+
+def evaluate_batch(queries, index, backend="list", plans=None, limit=None, result_cache=None):
+    """Evaluates many queries together, sharing the work they have in common.
+
+    All queries are parsed first. The postings of every search token in the batch are then read once, in the order they
+    are stored in, and the subtrees that occur in more than one query (by canonical form, see OpNode.canonical_key) are
+    resolved once and shared for the length of the batch.
+
+    :param queries: A list of strings containing the search queries.
+    :param index: storage.Index to evaluate the queries against.
+    :param backend: The evaluation backend resolving operator nodes, one of backends.
+    :param plans: If given, a list that the list of lines explaining each query is appended to, in the order of queries.
+    :param limit: The most docIDs to return for each query, or None to return all of them.
+    :param result_cache: A cache.ResultCache that resolved subtrees are also shared across batches through, or None.
+    :return: A list of the results of the queries, in the order of queries, each as returned by evaluate_query, or the
+        QueryError of a query that could not be evaluated.
+    """
+    trees = []
+    for query in queries:
+        try:
+            trees.append(build_tree(query, index))
+        except QueryError, err:
+            trees.append(err)
+    nodes = [node for tree in trees if isinstance(tree, OpTree) for node in tree.root.nodes()]
+
+    term_nodes = [node for node in nodes if node.op == None and node.postings is None]
+    term_postings = index.read_postings_batch([node.term for node in term_nodes])
+    for node in term_nodes:
+        node.postings = term_postings[node.term]
+
+    key_counts = {}
+    for node in nodes:
+        if node.op != None:
+            key = (backend, node.canonical_key())
+            key_counts[key] = key_counts.get(key, 0) + 1
+    batch_cache = cache.BatchCache([key for key, count in key_counts.iteritems() if count > 1], result_cache)
 
-def process_queries(dictionary_file, postings_file, queries_file, output_file):
-    # load dictionary
+    results = []
+    for tree in trees:
+        query_plans = [] if plans is not None else None
+        if not isinstance(tree, OpTree):
+            results.append(tree)
+        else:
+            results.append(resolve_tree(tree, index, backend, query_plans, limit, batch_cache))
+        if plans is not None:
+            plans.append(query_plans)
+    return results
+
+
+def open_searcher(dictionary_file, postings_file, cache_size=0, postings_cache_size=0, preload=0, cache_policy="lru"):
+    """Opens the index, with the caches asked for.
+
+    :param dictionary_file: The file path of the dictionary file.
+    :param postings_file: The file path of the postings file.
+    :param cache_size: The most bytes of resolved subtrees to keep across queries, or 0 to keep none.
+    :param postings_cache_size: The most bytes of decoded postings to keep across queries, or 0 to keep none.
+    :param preload: The number of most frequent terms to read into the postings cache now.
+    :param cache_policy: The eviction policy of both caches, one of cache.policies.
+    :return: A tuple of (storage.Index, cache.ResultCache or None).
+    """
+    index = load_index(dictionary_file, postings_file)
+    result_cache = cache.ResultCache(cache_size, cache_policy) if cache_size > 0 else None
+    if postings_cache_size > 0:
+        index.use_postings_cache(cache.PostingsCache(postings_cache_size, cache_policy))
+        index.postings_cache.preload(index, preload)
+    return (index, result_cache)
+
+
+def evaluate_queries(queries, index, backend="list", explain=False, limit=None, result_cache=None, batch=False, ranked=None):
+    """Evaluates queries one after the other, or all together as a batch with evaluate_batch, or ranks documents for
+    them one after the other with evaluate_ranked.
+
+    :param queries: A list (or, if not a batch, any iterable) of strings containing the search queries.
+    :param index: storage.Index to evaluate the queries against.
+    :param backend: The evaluation backend resolving operator nodes, one of backends.
+    :param explain: True to explain how every query was planned and resolved.
+    :param limit: The most docIDs to return for each query, or None to return all of them.
+    :param result_cache: A cache.ResultCache that resolved subtrees are shared across queries through, or None.
+    :param batch: True to evaluate the queries as a batch.
+    :param ranked: The number of best documents to return for each query, ranked by BM25, or None to return the matching
+        documents in docID order. Ranked queries are not evaluated as a batch, and limit does not apply to them.
+    :return: An iterable of (results, plans) tuples in the order of queries, where results are as returned by
+        evaluate_query (or evaluate_ranked), or the QueryError of a query that could not be evaluated, and plans is the
+        list of lines explaining the query, or None if not explaining.
+    """
+    if ranked is not None:
+        def rank_each():
+            for query in queries:
+                plans = [] if explain else None
+                try:
+                    results = evaluate_ranked(query, index, ranked, backend, plans, result_cache)
+                except QueryError, err:
+                    results = err
+                yield (results, plans)
+        return rank_each()
+    if batch:
+        batch_plans = [] if explain else None
+        batch_results = evaluate_batch(queries, index, backend, batch_plans, limit, result_cache)
+        return zip(batch_results, batch_plans if explain else [None] * len(batch_results))
+
+    def evaluate_each():
+        for query in queries:
+            plans = [] if explain else None
+            try:
+                results = evaluate_query(query, index, backend, plans, limit, result_cache)
+            except QueryError, err:
+                results = err
+            yield (results, plans)
+    return evaluate_each()
+
+
+# The index, result cache and evaluation settings of a worker process of evaluate_queries_parallel.
+worker_searcher = None
+
+def start_worker(searcher_args, evaluation_args):
+    """Opens the index in a worker process. The dictionary and postings files are memory mapped read-only, so all workers
+    share their pages through the page cache rather than each reading its own copy.
+
+    :param searcher_args: A tuple of the arguments of open_searcher.
+    :param evaluation_args: A tuple of the backend, explain, limit, batch and ranked arguments of evaluate_queries.
+    """
+    global worker_searcher
+    index, result_cache = open_searcher(*searcher_args)
+    worker_searcher = (index, result_cache, evaluation_args)
+
+def evaluate_in_worker(queries):
+    """Evaluates a chunk of queries in a worker process, started by start_worker.
+
+    :param queries: A list of strings containing the search queries.
+    :return: A list of (results, plans) tuples, as returned by evaluate_queries.
+    """
+    index, result_cache, (backend, explain, limit, batch, ranked) = worker_searcher
+    return list(evaluate_queries(queries, index, backend, explain, limit, result_cache, batch, ranked))
+
+def evaluate_queries_parallel(queries, workers, searcher_args, evaluation_args):
+    """Splits the queries into contiguous chunks, and evaluates the chunks across a pool of worker processes that each
+    open the index. The results are the same as those of evaluate_queries, and in the same order.
+
+    :param queries: A list of strings containing the search queries.
+    :param workers: The number of worker processes to use.
+    :param searcher_args: A tuple of the arguments of open_searcher.
+    :param evaluation_args: A tuple of the backend, explain, limit, batch and ranked arguments of evaluate_queries.
+    :return: A list of (results, plans) tuples, as returned by evaluate_queries.
+    """
+    # More chunks than workers, so that a few slow chunks do not leave the other workers idle.
+    chunk_size = max(1, int(math.ceil(len(queries) / float(workers * 4))))
+    chunks = [queries[start:start + chunk_size] for start in xrange(0, len(queries), chunk_size)]
+    # Loaded before the workers are forked, so that they do not each have to import NLTK.
+    analyzer.load_nltk()
+    pool = multiprocessing.Pool(workers, start_worker, (searcher_args, evaluation_args))
+    try:
+        # imap hands back the chunks' results in the order of chunks, keeping them in the order of queries.
+        evaluated = [evaluated_query for evaluated_chunk in pool.imap(evaluate_in_worker, chunks)
+                     for evaluated_query in evaluated_chunk]
+    finally:
+        pool.close()
+        pool.join()
+    return evaluated
+
+
+def process_queries(dictionary_file, postings_file, queries_file, output_file, backend="list", explain=False, limit=None,
+                    cache_size=0, postings_cache_size=0, preload=0, cache_policy="lru", batch=False, workers=1, ranked=None):
     begin = time.time() * 1000.0
-    with open(dictionary_file) as dict_file:
-        all_docIDs, dictionary = json.load(dict_file)
+    searcher_args = (dictionary_file, postings_file, cache_size, postings_cache_size, preload, cache_policy)
+    index = result_cache = None
 
     # open queries
-    postings = file(postings_file)
     output = file(output_file, 'w')
-    with open(queries_file) as queries:
-        for query in queries:
-            rpn_stack = shunting_yard(query)
-            if rpn_stack:
-                tree = OpTree(rpn_stack, postings, dictionary)
-                tree.root.consolidate_ops()
-                tree.root.consolidate_children()
-                tree.root.calculate_expected(all_docIDs)
-                result_IDs = [str(result_ID) for result_ID in tree.root.recursive_merge(all_docIDs)]
-                result_IDs.append("\n")
-                output.write(" ".join(result_IDs))
+    with open(queries_file) as queries_input:
+        queries = queries_input.readlines()
+    if workers > 1:
+        evaluated = evaluate_queries_parallel(queries, workers, searcher_args, (backend, explain, limit, batch, ranked))
+    else:
+        # load dictionary
+        index, result_cache = open_searcher(*searcher_args)
+        evaluated = evaluate_queries(queries, index, backend, explain, limit, result_cache, batch, ranked)
+    for query, (results, plans) in izip(queries, evaluated):
+        if explain:
+            print query.strip()
+            if isinstance(results, QueryError):
+                print "  (error: {0})".format(results)
             else:
-                output.write("\n")
-    postings.close()
+                print "\n".join(plans or ["  (no search tokens)"])
+        if isinstance(results, QueryError):
+            # The query is answered by an empty line, so the lines of the output stay in step with the queries.
+            sys.stderr.write("error in query: {0}\t{1}\n".format(results, query.strip()))
+            output.write("\n")
+        elif results is not None:
+            result_IDs = [str(result_ID) for result_ID in results]
+            result_IDs.append("\n")
+            output.write(" ".join(result_IDs))
+        else:
+            output.write("\n")
     output.close()
+    if index is not None:
+        index.close()
+        if result_cache is not None:
+            sys.stderr.write("result cache: " + result_cache.stats() + "\n")
+        if index.postings_cache is not None:
+            sys.stderr.write("postings cache: " + index.postings_cache.stats() + "\n")
     after = time.time() * 1000.0
     if show_time: print after-begin
 
 
 def main():
-    dictionary_file, postings_file, queries_file, output_file = load_args()
+    (dictionary_file, postings_file, queries_file, output_file, backend, explain, limit, cache_size, postings_cache_size,
+     preload, cache_policy, batch, workers, ranked) = load_args()
 
-    process_queries(dictionary_file, postings_file, queries_file, output_file)
+    process_queries(dictionary_file, postings_file, queries_file, output_file, backend, explain, limit, cache_size,
+                    postings_cache_size, preload, cache_policy, batch, workers, ranked)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+Query server protocol:
+
+Clients send one boolean query per line, in the same syntax as the lines of a queries file, and receive one line per
+query containing the matching docIDs separated by spaces (an empty line if nothing matches). A query that cannot be
+evaluated, such as a malformed one, is answered by a single line starting with "ERROR " followed by the reason, and the
+connection goes on with the next query. A connection may send any number of queries. Any other failure is a bug of the
+server: it is logged with its traceback on standard error, and the connection is closed.
+
+The index is loaded once when the server starts, so every query only pays for its own evaluation. Subtrees resolved
+for one query can also be kept in a result cache shared by all connections (-c), for later queries to reuse, and decoded
+postings in a postings cache (-t), optionally preloaded with the most frequent terms (-k). The time taken by each query
+is reported on standard error.
+"""
+
+import os
+import sys
+import getopt
+import time
+import traceback
+import SocketServer
+import search
+import cache
+
+
+class QueryHandler(SocketServer.StreamRequestHandler):
+    """Answers the queries sent over a single client connection, one line at a time."""
+
+    def handle(self):
+        for query in iter(self.rfile.readline, ""):
+            begin = time.time() * 1000.0
+            try:
+                results = self.server.evaluate(query)
+            except search.QueryError, err:
+                self.wfile.write("ERROR " + " ".join(str(err).split()) + "\n")
+                self.wfile.flush()
+                self.server.report_error(query, err)
+                continue
+            except Exception:
+                self.server.report_failure(query)
+                raise
+            after = time.time() * 1000.0
+            self.wfile.write(" ".join([str(result_ID) for result_ID in results or []]) + "\n")
+            self.wfile.flush()
+            self.server.report(query, results, after - begin)
+
+
+class QueryServerMixIn:
+    """Holds the loaded index for the server, and evaluates and reports queries against it.
+
+    The postings and dictionary are read through read-only memory maps, so concurrent connections can share them.
+    """
+
+    result_cache = None
+
+    def load(self, dictionary_file, postings_file, cache_size=0, postings_cache_size=0, preload=0, cache_policy="lru"):
+        """Loads the index that queries are evaluated against.
+
+        :param dictionary_file: The file path of the dictionary file.
+        :param postings_file: The file path of the postings file.
+        :param cache_size: The most bytes of resolved subtrees to keep across queries, or 0 to keep none.
+        :param postings_cache_size: The most bytes of decoded postings to keep across queries, or 0 to keep none.
+        :param preload: The number of most frequent terms to read into the postings cache now.
+        :param cache_policy: The eviction policy of both caches, one of cache.policies.
+        """
+        self.index = search.load_index(dictionary_file, postings_file)
+        if cache_size > 0:
+            self.result_cache = cache.ResultCache(cache_size, cache_policy)
+        if postings_cache_size > 0:
+            self.index.use_postings_cache(cache.PostingsCache(postings_cache_size, cache_policy))
+            self.index.postings_cache.preload(self.index, preload)
+
+    def evaluate(self, query):
+        """Evaluates a single query against the loaded index.
+
+        :param query: A string containing the search query.
+        :return: A list containing the resulting docIDs, or None if the query has no search tokens.
+        """
+        return search.evaluate_query(query, self.index, result_cache=self.result_cache)
+
+    def report(self, query, results, latency):
+        """Reports the latency of a single query on standard error.
+
+        :param query: A string containing the search query.
+        :param results: The result of the query, as returned by evaluate.
+        :param latency: The time taken to evaluate the query, in milliseconds.
+        """
+        sys.stderr.write("{0:.3f} ms\t{1} results\t{2}\n".format(latency, len(results or []), query.strip()))
+
+    def report_error(self, query, error):
+        """Reports a query that could not be evaluated on standard error.
+
+        :param query: A string containing the search query.
+        :param error: The exception raised by evaluate.
+        """
+        sys.stderr.write("error: {0}\t{1}\n".format(error, query.strip()))
+
+    def report_failure(self, query):
+        """Reports a query whose evaluation raised an unexpected exception on standard error, with its traceback. Called
+        while the exception is being handled.
+
+        :param query: A string containing the search query.
+        """
+        sys.stderr.write("failure in query: {0}\n{1}".format(query.strip(), traceback.format_exc()))
+
+    def handle_error(self, request, client_address):
+        """Reports that a connection was closed after an unexpected exception, already reported by report_failure."""
+        sys.stderr.write("closed the connection of {0} after a failure\n".format(client_address))
+
+
+class TCPQueryServer(QueryServerMixIn, SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class UnixQueryServer(QueryServerMixIn, SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def usage():
+    """Prints the proper format for calling this script."""
+    print "usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-a host:port | -u unix-socket-path] [-c result-cache-MB] [-t postings-cache-MB [-k preloaded-terms]] [-l lru|tinylfu]"
+
+
+def load_args():
+    """Attempts to parse command line arguments fed into the script when it was called.
+    Notifies the user of the correct format if parsing failed.
+    """
+    dictionary_file = postings_file = socket_path = None
+    address = ("127.0.0.1", 8377)
+    cache_size = postings_cache_size = preload = 0
+    cache_policy = "lru"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:a:u:c:t:k:l:')
+    except getopt.GetoptError, err:
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-a':
+            host, port = a.rsplit(":", 1)
+            address = (host, int(port))
+        elif o == '-u':
+            socket_path = a
+        elif o == '-c':
+            cache_size = int(float(a) * 1024 * 1024)
+        elif o == '-t':
+            postings_cache_size = int(float(a) * 1024 * 1024)
+        elif o == '-k':
+            preload = int(a)
+        elif o == '-l':
+            cache_policy = a
+        else:
+            assert False, "unhandled option"
+    if dictionary_file == None or postings_file == None or cache_policy not in cache.policies:
+        usage()
+        sys.exit(2)
+    return (dictionary_file, postings_file, address, socket_path, cache_size, postings_cache_size, preload, cache_policy)
+
+
+def main():
+    (dictionary_file, postings_file, address, socket_path, cache_size, postings_cache_size, preload,
+     cache_policy) = load_args()
+
+    if socket_path != None:
+        server = UnixQueryServer(socket_path, QueryHandler)
+    else:
+        server = TCPQueryServer(address, QueryHandler)
+    server.load(dictionary_file, postings_file, cache_size, postings_cache_size, preload, cache_policy)
+    print "Serving queries on {0}".format(socket_path or "{0}:{1}".format(*address))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.index.close()
+        if server.result_cache is not None:
+            sys.stderr.write("result cache: " + server.result_cache.stats() + "\n")
+        if server.index.postings_cache is not None:
+            sys.stderr.write("postings cache: " + server.index.postings_cache.stats() + "\n")
+        if socket_path != None:
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1243 @@
+"""
+Dictionary file format:
+
+Binary (current), all integers little endian:
+	header:		"BRID" magic (4 bytes), format version (1 byte), document count D (4 bytes), term count T (4 bytes)
+	docIDs:		D signed 4 byte docIDs, sorted
+	offsets:	T + 1 unsigned 4 byte offsets of each term into the term text, relative to its start
+	entries:	T (pointer: 8 bytes, length: 4 bytes, document frequency: 4 bytes) postings addresses, in the same order
+				as the terms (version 1 has no document frequency)
+	terms:		the UTF-8 terms, sorted bytewise and concatenated
+
+	The file is memory mapped, and terms are looked up by binary search over the offsets, so nothing but the docIDs
+	is read at load time. The terms starting with a given prefix are next to each other, and are found the same way to
+	expand wildcard search tokens.
+
+JSON (legacy): [all docIDs, {term: [pointer, length]}], as described in index.py.
+
+Segments:
+
+An index may be made of several segments, each a dictionary file and postings file pair covering its own disjoint set
+of docIDs. They are listed oldest first in a JSON manifest next to the dictionary file the index is opened with
+(<dictionary file>.segments):
+	{"generation": 3, "segments": [["dictionary.txt", "postings.txt"], ["dictionary.txt.3", "postings.txt.3"]]}
+with paths relative to the manifest. Without a manifest, the index is the single segment named on the command line.
+
+Deleted documents:
+
+docIDs deleted from an index are recorded in a tombstone file next to the dictionary file (<dictionary file>.deleted),
+as sorted signed 4 byte little endian docIDs. They are filtered out of query results until compaction drops them from
+the postings for good.
+
+Postings file format:
+
+Binary (current):
+	header:	"BRIP" magic (4 bytes), format version (1 byte), codec id (1 byte)
+	body:	every term's postings list, encoded with the codec named in the header, back to back
+
+Text (legacy, no header):
+	every term's postings list as ASCII decimal docIDs separated by spaces, one list per line
+
+In both formats the dictionary addresses a postings list by (pointer, length) in bytes, where pointer is the
+absolute offset of the list in the postings file and length is the number of bytes it occupies.
+
+Codecs:
+	CODEC_TEXT:		the legacy text format above
+	CODEC_VBYTE:	docID gaps (the first docID is stored as a gap from 0), each gap written as a variable byte code:
+					7 bits of payload per byte, most significant group first, and the high bit set on the last byte
+	CODEC_ADAPTIVE:	every postings list starts with a container type byte, followed by the list in that container.
+					The indexer picks whichever container is smallest for each list:
+		CONTAINER_ARRAY:	as CODEC_VBYTE
+		CONTAINER_BITMAP:	a variable byte code of b, then a little endian bitset in which bit i stands for docID 8b + i
+		CONTAINER_RUNS:		runs of consecutive docIDs, as variable byte codes of the gap from the end of the previous run
+							(0 for the first run) to the start of the run, then the run length minus 1
+		CONTAINER_BLOCKS:	used instead of CONTAINER_ARRAY for lists longer than BLOCK_SIZE. A block index, then the
+							docID gaps as in CONTAINER_ARRAY. The block index is made of variable byte codes of the
+							number of blocks, then for every BLOCK_SIZE postings the gap from the previous block's last
+							docID (0 for the first block) to the block's last docID, and the block's length in bytes.
+							Blocks can be decoded on their own, so a list read only to be intersected with a few
+							candidate docIDs needs only the blocks that can hold them decoded.
+					Bitmap and run containers are decoded into bitmap.Bitmap, array and block containers into array('i').
+	CODEC_POSITIONS:	the postings of a positions file (see below). Decoding them gives the docIDs alone.
+	CODEC_FREQUENCIES:	the postings of a frequencies file (see below). Decoding them gives the docIDs alone.
+
+Positions:
+
+An index built with positions (index.py -P) has, next to the dictionary and postings file of every segment, a
+positions dictionary (<dictionary file>.positions) and a positions file (<postings file>.positions). The positions
+dictionary is a binary dictionary without docIDs, addressing each term's list in the positions file, which is a binary
+postings file with codec CODEC_POSITIONS. A term's list holds the positions (word offsets from the start of the
+document, counting from 0) at which the term occurs in each document of its postings:
+	index:		as the block index of CONTAINER_BLOCKS, with a block per document: variable byte codes of the number of
+				documents, then for every document the gap from the previous docID (0 for the first) and the length in
+				bytes of its positions
+	positions:	for every document, its positions as variable byte coded gaps, the first from 0
+Only the index has to be decoded to find the positions of a document, so they are decoded just for the documents asked
+for.
+
+Term frequencies:
+
+An index built with term frequencies (index.py -f), for ranked retrieval, likewise has a frequencies dictionary
+(<dictionary file>.frequencies) and a frequencies file (<postings file>.frequencies) next to every segment, and a
+document lengths file (<dictionary file>.lengths). A term's list in the frequencies file holds the number of times the
+term occurs in each document of its postings, in blocks of BLOCK_SIZE documents:
+	index:		variable byte codes of the number of blocks, then for every block the gap from the previous block's last
+				docID (0 for the first block) to the block's last docID, the block's length in bytes, and the largest term
+				frequency in the block
+	blocks:		for every document, the docID gap (from the previous block's last docID for the first) and the term
+				frequency, as variable byte codes
+The lengths file holds the length in words of every document of the segment, as signed 4 byte little endian integers in
+the order of the docIDs of the dictionary.
+"""
+
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from functools import partial
+from itertools import chain
+import bitmap
+from bitmap import Bitmap
+from array import array
+from bisect import bisect_left
+
+POSTINGS_MAGIC = "BRIP"
+POSTINGS_VERSION = 1
+
+CODEC_TEXT = 0
+CODEC_VBYTE = 1
+CODEC_ADAPTIVE = 2
+CODEC_POSITIONS = 3
+CODEC_FREQUENCIES = 4
+
+CONTAINER_ARRAY = 0
+CONTAINER_BITMAP = 1
+CONTAINER_RUNS = 2
+CONTAINER_BLOCKS = 3
+
+BLOCK_SIZE = 128
+
+DICTIONARY_MAGIC = "BRID"
+DICTIONARY_VERSION = 2
+
+postings_header = struct.Struct("<4sBB")
+dictionary_header = struct.Struct("<4sBII")
+dictionary_offset = struct.Struct("<I")
+dictionary_entries = {
+    1: struct.Struct("<QI"),
+    2: struct.Struct("<QII"),
+}
+
+def vb_encode_numbers(numbers):
+    """Encodes non-negative integers as variable byte codes.
+
+    :param numbers: A list of non-negative integers.
+    :return: A string containing the encoded integers.
+    """
+    encoded = bytearray()
+    for number in numbers:
+        code = [128 | (number & 127)]
+        number >>= 7
+        while number:
+            code.append(number & 127)
+            number >>= 7
+        code.reverse()
+        encoded.extend(code)
+    return str(encoded)
+
+def vb_decode_numbers(data):
+    """Decodes variable byte codes back into integers.
+
+    :param data: A string or buffer containing the encoded integers.
+    :return: A list of integers.
+    """
+    numbers = []
+    number = 0
+    for byte in bytearray(data):
+        if byte < 128:
+            number = (number << 7) | byte
+        else:
+            numbers.append((number << 7) | (byte & 127))
+            number = 0
+    return numbers
+
+def vb_encode_postings(docIDs):
+    """Encodes a sorted postings list as variable byte coded docID gaps.
+
+    :param docIDs: A sorted list of docIDs.
+    :return: A string containing the encoded postings.
+    """
+    return vb_encode_numbers([docID - previous for previous, docID in zip(chain([0], docIDs), docIDs)])
+
+def vb_decode_prefix(data, offset, count):
+    """Decodes a given number of variable byte codes from part of the data.
+
+    :param data: A string or buffer containing the encoded integers.
+    :param offset: The position of the first code in the data.
+    :param count: The number of codes to decode.
+    :return: A tuple of (list of integers, position just past the last code decoded).
+    """
+    numbers = []
+    number = 0
+    position = offset
+    # No code of a docID or a byte length is longer than 5 bytes.
+    for byte in bytearray(buffer(data, offset, 5 * count)):
+        position += 1
+        if byte < 128:
+            number = (number << 7) | byte
+        else:
+            numbers.append((number << 7) | (byte & 127))
+            number = 0
+            if len(numbers) == count:
+                break
+    return (numbers, position)
+
+def vb_decode_postings(data, previous=0):
+    """Decodes variable byte coded docID gaps back into a sorted postings list.
+
+    :param data: A string or buffer containing the encoded postings.
+    :param previous: The docID the first gap is taken from.
+    :return: An array('i') of docIDs.
+    """
+    docIDs = array('i')
+    number = 0
+    for byte in bytearray(data):
+        if byte < 128:
+            number = (number << 7) | byte
+        else:
+            previous += (number << 7) | (byte & 127)
+            docIDs.append(previous)
+            number = 0
+    return docIDs
+
+def text_encode_postings(docIDs):
+    """Encodes a postings list in the legacy text format (without the trailing newline).
+
+    :param docIDs: A sorted list of docIDs.
+    :return: A string of space separated docIDs.
+    """
+    return " ".join([str(docID) for docID in docIDs])
+
+def text_decode_postings(data):
+    """Decodes a postings list stored in the legacy text format.
+
+    :param data: A string or buffer of space separated docIDs.
+    :return: An array('i') of docIDs.
+    """
+    return array('i', [int(docID) for docID in str(data).split()])
+
+def docID_runs(docIDs):
+    """Splits a sorted postings list into runs of consecutive docIDs.
+
+    :param docIDs: A sorted list of docIDs.
+    :return: A list of (first docID, run length) tuples.
+    """
+    runs = []
+    for docID in docIDs:
+        if runs and runs[-1][0] + runs[-1][1] == docID:
+            runs[-1][1] += 1
+        else:
+            runs.append([docID, 1])
+    return [(start, length) for start, length in runs]
+
+def blocked_vb_encode_postings(docIDs):
+    """Encodes a sorted postings list as a block index followed by variable byte coded docID gaps.
+
+    :param docIDs: A sorted list of docIDs.
+    :return: A string containing the encoded block index and postings.
+    """
+    block_index = [(len(docIDs) + BLOCK_SIZE - 1) // BLOCK_SIZE]
+    blocks = []
+    previous = 0
+    for start in xrange(0, len(docIDs), BLOCK_SIZE):
+        block = docIDs[start:start + BLOCK_SIZE]
+        blocks.append(vb_encode_numbers([docID - gap_from for gap_from, docID in zip(chain([previous], block), block)]))
+        block_index.extend([block[-1] - previous, len(blocks[-1])])
+        previous = block[-1]
+    return vb_encode_numbers(block_index) + "".join(blocks)
+
+def read_block_index(data, offset):
+    """Reads the block index of a list encoded by blocked_vb_encode_postings.
+
+    :param data: A string or buffer containing the encoded postings.
+    :param offset: The position of the block index in the data.
+    :return: A tuple of (list of (last docID, byte length) tuples of every block, position of the first block).
+    """
+    (block_count,), offset = vb_decode_prefix(data, offset, 1)
+    numbers, offset = vb_decode_prefix(data, offset, 2 * block_count)
+    blocks = []
+    last = 0
+    for i in xrange(0, len(numbers), 2):
+        last += numbers[i]
+        blocks.append((last, numbers[i + 1]))
+    return (blocks, offset)
+
+def adaptive_encode_postings(docIDs):
+    """Encodes a sorted postings list in whichever of the array (or block), bitmap and run containers takes the fewest bytes.
+
+    :param docIDs: A sorted list of docIDs.
+    :return: A string containing the container type byte and the encoded postings.
+    """
+    if len(docIDs) > BLOCK_SIZE:
+        encoded = blocked_vb_encode_postings(docIDs)
+        container = CONTAINER_BLOCKS
+    else:
+        encoded = vb_encode_postings(docIDs)
+        container = CONTAINER_ARRAY
+    if docIDs:
+        bitmap_base = docIDs[0] >> 3
+        bitmap_length = (docIDs[-1] >> 3) - bitmap_base + 1
+        if bitmap_length + len(vb_encode_numbers([bitmap_base])) < len(encoded):
+            flags = bytearray(bitmap_length)
+            for docID in docIDs:
+                flags[(docID >> 3) - bitmap_base] |= 1 << (docID & 7)
+            encoded = vb_encode_numbers([bitmap_base]) + str(flags)
+            container = CONTAINER_BITMAP
+        runs = docID_runs(docIDs)
+        if 2 * len(runs) < len(encoded): # each run takes at least two bytes
+            run_numbers = []
+            previous_end = 0
+            for start, length in runs:
+                run_numbers.extend([start - previous_end, length - 1])
+                previous_end = start + length
+            encoded_runs = vb_encode_numbers(run_numbers)
+            if len(encoded_runs) < len(encoded):
+                encoded = encoded_runs
+                container = CONTAINER_RUNS
+    return chr(container) + encoded
+
+def adaptive_decode_postings(data):
+    """Decodes a postings list encoded by adaptive_encode_postings.
+
+    :param data: A string or buffer containing the container type byte and the encoded postings.
+    :return: An array('i') of docIDs for array containers, or a bitmap.Bitmap for bitmap and run containers.
+    """
+    if len(data) == 0:
+        return array('i')
+    container = ord(data[0])
+    if container == CONTAINER_ARRAY:
+        return vb_decode_postings(buffer(data, 1))
+    elif container == CONTAINER_BITMAP:
+        flags = bytearray(buffer(data, 1))
+        base_length = 1
+        while flags[base_length - 1] < 128:
+            base_length += 1
+        bitmap_base, = vb_decode_numbers(flags[:base_length])
+        return Bitmap(bitmap.bytes_to_bits(flags[base_length:]) << (bitmap_base << 3))
+    elif container == CONTAINER_RUNS:
+        run_numbers = vb_decode_numbers(buffer(data, 1))
+        runs = []
+        previous_end = 0
+        for i in xrange(0, len(run_numbers), 2):
+            start = previous_end + run_numbers[i]
+            previous_end = start + run_numbers[i + 1] + 1
+            runs.append((start, previous_end - start))
+        return bitmap.from_runs(runs)
+    elif container == CONTAINER_BLOCKS:
+        blocks, offset = read_block_index(data, 1)
+        return vb_decode_postings(buffer(data, offset))
+    raise ValueError("unknown postings container type {0}".format(container))
+
+def adaptive_decode_matching(data, candidates):
+    """Decodes the part of a postings list encoded by adaptive_encode_postings that can hold any of the candidate docIDs.
+
+    Only block containers can be partly decoded: the blocks whose docID range holds no candidate are skipped.
+
+    :param data: A string or buffer containing the container type byte and the encoded postings.
+    :param candidates: A sorted list of docIDs.
+    :return: As adaptive_decode_postings, but possibly without docIDs that are not candidates.
+    """
+    if len(data) == 0 or ord(data[0]) != CONTAINER_BLOCKS:
+        return adaptive_decode_postings(data)
+    blocks, offset = read_block_index(data, 1)
+    if len(candidates) >= len(blocks): # most blocks would have to be decoded anyway
+        return vb_decode_postings(buffer(data, offset))
+    docIDs = array('i')
+    previous = 0
+    candidate = 0
+    for last, length in blocks:
+        candidate = bisect_left(candidates, previous + 1, candidate)
+        if candidate == len(candidates):
+            break
+        if candidates[candidate] <= last:
+            docIDs.extend(vb_decode_postings(buffer(data, offset, length), previous))
+        previous = last
+        offset += length
+    return docIDs
+
+def adaptive_decode_parts(data):
+    """Splits a postings list encoded by adaptive_encode_postings into parts that can be decoded on their own.
+
+    Block containers are split into their blocks, and any other container is a single part.
+
+    :param data: A string or buffer containing the container type byte and the encoded postings.
+    :return: A list of (last docID of the part or None if it is not known, function decoding the part) tuples, in
+        ascending docID order. The functions return what adaptive_decode_postings would for the part.
+    """
+    if len(data) == 0 or ord(data[0]) != CONTAINER_BLOCKS:
+        return [(None, partial(adaptive_decode_postings, data))]
+    blocks, offset = read_block_index(data, 1)
+    parts = []
+    previous = 0
+    for last, length in blocks:
+        parts.append((last, partial(vb_decode_postings, buffer(data, offset, length), previous)))
+        previous = last
+        offset += length
+    return parts
+
+def positions_encode_postings(postings):
+    """Encodes the positions of a term in the documents it occurs in.
+
+    :param postings: A list of (docID, sorted list of positions) tuples, sorted by docID.
+    :return: A string containing the encoded index and positions.
+    """
+    index = [len(postings)]
+    encoded_positions = []
+    previous = 0
+    for docID, positions in postings:
+        encoded_positions.append(vb_encode_postings(positions))
+        index.extend([docID - previous, len(encoded_positions[-1])])
+        previous = docID
+    return vb_encode_numbers(index) + "".join(encoded_positions)
+
+def positions_decode_postings(data):
+    """Decodes the docIDs of a list encoded by positions_encode_postings, leaving out the positions.
+
+    :param data: A string or buffer containing the encoded index and positions.
+    :return: An array('i') of docIDs.
+    """
+    documents, offset = read_block_index(data, 0)
+    return array('i', [docID for docID, length in documents])
+
+def frequencies_encode_postings(postings):
+    """Encodes the term frequencies of a term in the documents it occurs in.
+
+    :param postings: A list of (docID, term frequency) tuples, sorted by docID.
+    :return: A string containing the encoded block index and blocks.
+    """
+    block_index = [(len(postings) + BLOCK_SIZE - 1) // BLOCK_SIZE]
+    blocks = []
+    previous = 0
+    for start in xrange(0, len(postings), BLOCK_SIZE):
+        block = postings[start:start + BLOCK_SIZE]
+        numbers = []
+        gap_from = previous
+        for docID, frequency in block:
+            numbers.extend([docID - gap_from, frequency])
+            gap_from = docID
+        blocks.append(vb_encode_numbers(numbers))
+        block_index.extend([block[-1][0] - previous, len(blocks[-1]), max(frequency for docID, frequency in block)])
+        previous = block[-1][0]
+    return vb_encode_numbers(block_index) + "".join(blocks)
+
+def read_frequencies_block_index(data):
+    """Reads the block index of a list encoded by frequencies_encode_postings.
+
+    :param data: A string or buffer containing the encoded list.
+    :return: A tuple of (list of (last docID, byte length, largest term frequency) tuples of every block, position of the
+        first block).
+    """
+    (block_count,), offset = vb_decode_prefix(data, 0, 1)
+    numbers, offset = vb_decode_prefix(data, offset, 3 * block_count)
+    blocks = []
+    last = 0
+    for i in xrange(0, len(numbers), 3):
+        last += numbers[i]
+        blocks.append((last, numbers[i + 1], numbers[i + 2]))
+    return (blocks, offset)
+
+def frequencies_decode_block(data, previous=0):
+    """Decodes a single block of a list encoded by frequencies_encode_postings.
+
+    :param data: A string or buffer containing the block.
+    :param previous: The docID the first gap is taken from.
+    :return: A tuple of (array('i') of docIDs, array('i') of the term frequencies in the same order).
+    """
+    numbers = vb_decode_numbers(data)
+    docIDs = array('i')
+    frequencies = array('i')
+    for i in xrange(0, len(numbers), 2):
+        previous += numbers[i]
+        docIDs.append(previous)
+        frequencies.append(numbers[i + 1])
+    return (docIDs, frequencies)
+
+def frequencies_decode_postings(data):
+    """Decodes the docIDs of a list encoded by frequencies_encode_postings, leaving out the term frequencies.
+
+    :param data: A string or buffer containing the encoded list.
+    :return: An array('i') of docIDs.
+    """
+    blocks, offset = read_frequencies_block_index(data)
+    return frequencies_decode_block(buffer(data, offset))[0]
+
+def frequencies_decode_parts(data):
+    """Splits a list encoded by frequencies_encode_postings into its blocks, without decoding any of them.
+
+    :param data: A string or buffer containing the encoded list.
+    :return: A list of (last docID of the block, function decoding the block as frequencies_decode_block does, largest
+        term frequency in the block) tuples, in ascending docID order.
+    """
+    blocks, offset = read_frequencies_block_index(data)
+    parts = []
+    previous = 0
+    for last, length, max_frequency in blocks:
+        parts.append((last, partial(frequencies_decode_block, buffer(data, offset, length), previous), max_frequency))
+        previous = last
+        offset += length
+    return parts
+
+# codec id -> (encoder, decoder)
+codecs = {
+    CODEC_TEXT: (text_encode_postings, text_decode_postings),
+    CODEC_VBYTE: (vb_encode_postings, vb_decode_postings),
+    CODEC_ADAPTIVE: (adaptive_encode_postings, adaptive_decode_postings),
+    CODEC_POSITIONS: (positions_encode_postings, positions_decode_postings),
+    CODEC_FREQUENCIES: (frequencies_encode_postings, frequencies_decode_postings),
+}
+
+def write_postings_header(postings_file, codec):
+    """Writes the binary postings header. Text postings have no header, so nothing is written for CODEC_TEXT.
+
+    :param postings_file: File object of the postings file, opened in binary mode and positioned at its start.
+    :param codec: The codec id the postings will be encoded with.
+    """
+    if codec != CODEC_TEXT:
+        postings_file.write(postings_header.pack(POSTINGS_MAGIC, POSTINGS_VERSION, codec))
+
+def read_postings_header(postings_file):
+    """Reads the header at the start of a postings file to find out how its postings are encoded.
+
+    Files that do not start with the magic are taken to be legacy text postings.
+
+    :param postings_file: File object of the postings file, opened in binary mode.
+    :return: The codec id of the postings in the file.
+    """
+    postings_file.seek(0)
+    header = postings_file.read(postings_header.size)
+    if len(header) == postings_header.size:
+        magic, version, codec = postings_header.unpack(header)
+        if magic == POSTINGS_MAGIC:
+            if version != POSTINGS_VERSION or codec not in codecs:
+                raise ValueError("unsupported postings format version {0} codec {1}".format(version, codec))
+            return codec
+    return CODEC_TEXT
+
+
+class PostingsFile:
+    """Read access to a postings file of any supported format.
+
+    The file is memory mapped read-only, and postings are decoded straight from buffer slices of the mapping, so
+    reading a postings list needs no seek() or read() calls and keeps no file position. A single PostingsFile can
+    therefore be shared by any number of concurrent queries.
+
+    Attributes:
+        codec: The codec id of the postings, read from the file header.
+    """
+
+    codec = CODEC_TEXT
+    postings_map = None
+
+    def __init__(self, postings_file_name):
+        """Opens and maps the postings file, and detects its format.
+
+        :param postings_file_name: The file path of the postings file.
+        """
+        self.postings_file = open(postings_file_name, 'rb')
+        self.codec = read_postings_header(self.postings_file)
+        self.decode = codecs[self.codec][1]
+        self.postings_file.seek(0, 2)
+        if self.postings_file.tell() > 0: # an empty file cannot be mapped, but then it holds no postings either
+            self.postings_map = mmap.mmap(self.postings_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def view(self, pointer, length):
+        """Returns a zero-copy view of the bytes of a single postings list.
+
+        :param pointer: The offset of the postings list in the file, as stored in the dictionary.
+        :param length: The length of the postings list in bytes, as stored in the dictionary.
+        :return: A read-only buffer over the mapped file.
+        """
+        return buffer(self.postings_map, pointer, length)
+
+    def read(self, pointer, length):
+        """Decodes a single postings list.
+
+        :param pointer: The offset of the postings list in the file, as stored in the dictionary.
+        :param length: The length of the postings list in bytes, as stored in the dictionary.
+        :return: An array('i') of docIDs, or a bitmap.Bitmap.
+        """
+        return self.decode(self.view(pointer, length))
+
+    def read_matching(self, pointer, length, candidates):
+        """Decodes the part of a single postings list that can hold any of the candidate docIDs.
+
+        :param pointer: The offset of the postings list in the file, as stored in the dictionary.
+        :param length: The length of the postings list in bytes, as stored in the dictionary.
+        :param candidates: A sorted list of docIDs.
+        :return: As read, but possibly without docIDs that are not candidates.
+        """
+        if self.codec == CODEC_ADAPTIVE:
+            return adaptive_decode_matching(self.view(pointer, length), candidates)
+        return self.read(pointer, length)
+
+    def read_parts(self, pointer, length):
+        """Splits a single postings list into parts that can be decoded on their own, without decoding any of them.
+
+        :param pointer: The offset of the postings list in the file, as stored in the dictionary.
+        :param length: The length of the postings list in bytes, as stored in the dictionary.
+        :return: A list of (last docID of the part or None if it is not known, function decoding the part) tuples.
+        """
+        if self.codec == CODEC_ADAPTIVE:
+            return adaptive_decode_parts(self.view(pointer, length))
+        return [(None, partial(self.read, pointer, length))]
+
+    def close(self):
+        if self.postings_map is not None:
+            self.postings_map.close()
+        self.postings_file.close()
+
+
+class TermPositions:
+    """The positions of a term in the documents of every segment, decoded a document at a time as they are asked for.
+
+    The index of a segment's list is only decoded the first time a document is looked up in it.
+    """
+
+    def __init__(self, lists):
+        """
+        :param lists: A list of buffers holding the term's list in the positions file of each segment that has it.
+        """
+        self.lists = lists
+        self.indexes = None
+
+    def get(self, docID):
+        """Decodes the positions of the term in a document.
+
+        :param docID: The docID of the document.
+        :return: A sorted array('i') of positions, empty if the term does not occur in the document.
+        """
+        if self.indexes is None:
+            self.indexes = []
+            for data in self.lists:
+                documents, offset = read_block_index(data, 0)
+                docIDs = array('i')
+                offsets = array('i')
+                for document, length in documents:
+                    docIDs.append(document)
+                    offsets.append(offset)
+                    offset += length
+                offsets.append(offset)
+                self.indexes.append((docIDs, offsets))
+        for data, (docIDs, offsets) in zip(self.lists, self.indexes):
+            i = bisect_left(docIDs, docID)
+            if i < len(docIDs) and docIDs[i] == docID:
+                return vb_decode_postings(buffer(data, offsets[i], offsets[i + 1] - offsets[i]))
+        return array('i')
+
+
+def utf8(term):
+    """Returns the UTF-8 byte string of a term, which may be given as either unicode or a byte string."""
+    return term.encode("utf-8") if isinstance(term, unicode) else term
+
+def little_endian_array(typecode, values):
+    """Returns the raw bytes of an array of values, in little endian byte order."""
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tostring()
+
+def write_dictionary(docIDs, dict_terms, dict_file_name):
+    """Writes the binary dictionary file.
+
+    :param docIDs: The list of all document IDs, sorted
+    :param dict_terms: The dictionary, with term as key and tuple of (postings pointer, postings run length in the file,
+        document frequency) as value
+    :param dict_file_name: The file path of the resultant dictionary file
+    """
+    terms = sorted(dict_terms.iteritems(), key=lambda item: utf8(item[0]))
+    term_text = []
+    offsets = [0]
+    for term, address in terms:
+        term_text.append(utf8(term))
+        offsets.append(offsets[-1] + len(term_text[-1]))
+
+    dict_file = open(dict_file_name, 'wb')
+    dict_file.write(dictionary_header.pack(DICTIONARY_MAGIC, DICTIONARY_VERSION, len(docIDs), len(terms)))
+    dict_file.write(little_endian_array('i', docIDs))
+    dict_file.write(little_endian_array('I', offsets))
+    dictionary_entry = dictionary_entries[DICTIONARY_VERSION]
+    for term, address in terms:
+        dict_file.write(dictionary_entry.pack(*address))
+    dict_file.write("".join(term_text))
+    dict_file.close()
+
+def load_dictionary(dict_file_name):
+    """Loads a dictionary file of either format.
+
+    :param dict_file_name: The file path of the dictionary file
+    :return: A tuple of (all docIDs, dictionary), where the dictionary maps a term to its (pointer, length) postings address,
+        followed by its document frequency if the dictionary file records it.
+    """
+    dict_file = open(dict_file_name, 'rb')
+    header = dict_file.read(dictionary_header.size)
+    if len(header) == dictionary_header.size and header[:len(DICTIONARY_MAGIC)] == DICTIONARY_MAGIC:
+        dictionary = Dictionary(dict_file)
+        return (dictionary.docIDs, dictionary)
+    dict_file.seek(0)
+    all_docIDs, dictionary = json.load(dict_file)
+    dict_file.close()
+    return (all_docIDs, dictionary)
+
+
+class Dictionary:
+    """Read-only, memory mapped view of a binary dictionary file.
+
+    Behaves like the mapping of the legacy JSON dictionary: supports `term in dictionary` and `dictionary[term]`, which
+    returns the (pointer, length) address of the term's postings, followed by the term's document frequency from version 2.
+
+    Attributes:
+        docIDs: An array('i') of all docIDs, sorted.
+        term_count: The number of terms in the dictionary.
+    """
+
+    docIDs = None
+    term_count = 0
+
+    def __init__(self, dict_file):
+        """Maps the dictionary file and locates its tables.
+
+        :param dict_file: File object of the dictionary file, opened in binary mode.
+        """
+        self.dict_file = dict_file
+        self.dictionary_map = mmap.mmap(dict_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, doc_count, self.term_count = dictionary_header.unpack_from(self.dictionary_map, 0)
+        if version not in dictionary_entries:
+            raise ValueError("unsupported dictionary format version {0}".format(version))
+        self.dictionary_entry = dictionary_entries[version]
+
+        docIDs_start = dictionary_header.size
+        self.offsets_start = docIDs_start + 4 * doc_count
+        self.entries_start = self.offsets_start + 4 * (self.term_count + 1)
+        self.terms_start = self.entries_start + self.dictionary_entry.size * self.term_count
+
+        self.docIDs = array('i')
+        self.docIDs.fromstring(self.dictionary_map[docIDs_start:self.offsets_start])
+        if sys.byteorder == "big":
+            self.docIDs.byteswap()
+
+    def term_at(self, i):
+        """Returns the i-th term in sorted order, as a UTF-8 byte string."""
+        start, = dictionary_offset.unpack_from(self.dictionary_map, self.offsets_start + 4 * i)
+        end, = dictionary_offset.unpack_from(self.dictionary_map, self.offsets_start + 4 * (i + 1))
+        return self.dictionary_map[self.terms_start + start:self.terms_start + end]
+
+    def entry_at(self, i):
+        """Returns the (pointer, length[, document frequency]) postings address of the i-th term in sorted order."""
+        return self.dictionary_entry.unpack_from(self.dictionary_map, self.entries_start + self.dictionary_entry.size * i)
+
+    def bisect(self, term):
+        """Binary searches for the position of a term.
+
+        :param term: A UTF-8 byte string.
+        :return: The position of the first term not less than the given term. May be term_count.
+        """
+        lo = 0
+        hi = self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_at(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefixed(self, prefix):
+        """Returns a generator of the terms starting with a prefix, as UTF-8 byte strings in sorted order.
+
+        :param prefix: A UTF-8 byte string.
+        """
+        for i in xrange(self.bisect(prefix), self.term_count):
+            term = self.term_at(i)
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def find(self, term):
+        """Returns the position of a term, or -1 if the term is not in the dictionary."""
+        term = utf8(term)
+        i = self.bisect(term)
+        if i < self.term_count and self.term_at(i) == term:
+            return i
+        return -1
+
+    def __contains__(self, term):
+        return self.find(term) >= 0
+
+    def __getitem__(self, term):
+        i = self.find(term)
+        if i < 0:
+            raise KeyError(term)
+        return self.entry_at(i)
+
+    def __len__(self):
+        return self.term_count
+
+    def __iter__(self):
+        for i in xrange(self.term_count):
+            yield self.term_at(i)
+
+    def close(self):
+        self.dictionary_map.close()
+        self.dict_file.close()
+
+
+def positions_file_names(dict_file_name, postings_file_name):
+    """Returns the file paths of the positions dictionary and positions file of a segment, as a tuple."""
+    return (dict_file_name + ".positions", postings_file_name + ".positions")
+
+def frequencies_file_names(dict_file_name, postings_file_name):
+    """Returns the file paths of the frequencies dictionary, frequencies file and document lengths file of a segment, as a
+    tuple."""
+    return (dict_file_name + ".frequencies", postings_file_name + ".frequencies", dict_file_name + ".lengths")
+
+def write_document_lengths(lengths_file_name, docIDs, lengths):
+    """Writes the document lengths file of a segment.
+
+    :param lengths_file_name: The file path of the document lengths file
+    :param docIDs: The sorted list of the docIDs of the segment, as in its dictionary
+    :param lengths: A dict of docID -> length of the document in words. Documents missing from it have no words.
+    """
+    with open(lengths_file_name, 'wb') as lengths_file:
+        lengths_file.write(little_endian_array('i', [lengths.get(docID, 0) for docID in docIDs]))
+
+def read_document_lengths(lengths_file_name):
+    """Reads the document lengths file of a segment.
+
+    :param lengths_file_name: The file path of the document lengths file
+    :return: An array('i') of the lengths of the documents, in the order of the docIDs of the segment's dictionary.
+    """
+    lengths = array('i')
+    with open(lengths_file_name, 'rb') as lengths_file:
+        lengths.fromstring(lengths_file.read())
+    if sys.byteorder == "big":
+        lengths.byteswap()
+    return lengths
+
+def manifest_file_name(dict_file_name):
+    """Returns the file path of the segment manifest of the index with the given dictionary file."""
+    return dict_file_name + ".segments"
+
+def read_segments(dict_file_name, postings_file_name):
+    """Lists the segments of an index.
+
+    :param dict_file_name: The file path of the dictionary file the index is opened with
+    :param postings_file_name: The file path of the postings file the index is opened with
+    :return: A tuple of (generation, segments), where segments is a list of (dictionary file, postings file) paths, oldest
+        first, and generation is the number of the last segment written to the manifest (0 without a manifest).
+    """
+    manifest_name = manifest_file_name(dict_file_name)
+    if not os.path.exists(manifest_name):
+        return (0, [(dict_file_name, postings_file_name)])
+    with open(manifest_name) as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest_dir = os.path.dirname(manifest_name)
+    segments = [(os.path.join(manifest_dir, segment_dict), os.path.join(manifest_dir, segment_postings))
+                for segment_dict, segment_postings in manifest["segments"]]
+    return (manifest["generation"], segments)
+
+def write_segments(dict_file_name, generation, segments):
+    """Replaces the segment manifest of an index. The new manifest is written to a temporary file and renamed into place,
+    so searchers opening the index see either the old or the new set of segments, never a partial one.
+
+    :param dict_file_name: The file path of the dictionary file the index is opened with
+    :param generation: The number of the last segment written
+    :param segments: A list of (dictionary file, postings file) paths, oldest first
+    """
+    manifest_name = manifest_file_name(dict_file_name)
+    manifest_dir = os.path.dirname(manifest_name)
+    manifest = {
+        "generation": generation,
+        "segments": [[os.path.relpath(segment_dict, manifest_dir or "."), os.path.relpath(segment_postings, manifest_dir or ".")]
+                     for segment_dict, segment_postings in segments],
+    }
+    with open(manifest_name + ".tmp", 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.rename(manifest_name + ".tmp", manifest_name)
+
+def tombstone_file_name(dict_file_name):
+    """Returns the file path of the tombstone file of the index with the given dictionary file."""
+    return dict_file_name + ".deleted"
+
+def read_tombstones(dict_file_name):
+    """Reads the docIDs deleted from an index.
+
+    :param dict_file_name: The file path of the dictionary file the index is opened with
+    :return: A sorted array('i') of deleted docIDs, empty if there is no tombstone file.
+    """
+    deleted = array('i')
+    tombstone_name = tombstone_file_name(dict_file_name)
+    if os.path.exists(tombstone_name):
+        with open(tombstone_name, 'rb') as tombstone_file:
+            deleted.fromstring(tombstone_file.read())
+        if sys.byteorder == "big":
+            deleted.byteswap()
+    return deleted
+
+def write_tombstones(dict_file_name, deleted):
+    """Replaces the tombstone file of an index, through a temporary file renamed into place. An empty set of deleted
+    docIDs removes the tombstone file.
+
+    :param dict_file_name: The file path of the dictionary file the index is opened with
+    :param deleted: An iterable of deleted docIDs
+    """
+    tombstone_name = tombstone_file_name(dict_file_name)
+    deleted = sorted(set(deleted))
+    if not deleted:
+        if os.path.exists(tombstone_name):
+            os.remove(tombstone_name)
+        return
+    with open(tombstone_name + ".tmp", 'wb') as tombstone_file:
+        tombstone_file.write(little_endian_array('i', deleted))
+    os.rename(tombstone_name + ".tmp", tombstone_name)
+
+def index_version(dict_file_name, generation, segment_files, deleted):
+    """Identifies the state of an index on disk, so that anything kept from it can tell when it changed. Appends and
+    compactions change the generation of the manifest, full builds rewrite the segment files, and deletes the tombstones.
+
+    :param dict_file_name: The file path of the dictionary file the index is opened with
+    :param generation: The generation of the segment manifest
+    :param segment_files: A list of (dictionary file, postings file) paths of the segments
+    :param deleted: The deleted docIDs, as read from the tombstone file
+    :return: A hashable version, equal for two openings of the index only if nothing was changed in between.
+    """
+    def file_state(file_name):
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    segment_states = tuple((os.path.abspath(segment_dict), file_state(segment_dict), file_state(segment_postings))
+                           for segment_dict, segment_postings in segment_files)
+    return (generation, segment_states, len(deleted), file_state(tombstone_file_name(dict_file_name)))
+
+def merge_docIDs(lists_of_docIDs):
+    """Merges sorted docID lists from different segments into one sorted list.
+
+    :param lists_of_docIDs: A list of sorted docID lists or arrays, or bitmaps
+    :return: A sorted array('i') of the docIDs in any of the lists (or the only list itself), or a bitmap if any of them is one
+    """
+    lists_of_docIDs = [docIDs for docIDs in lists_of_docIDs if len(docIDs) > 0]
+    if not lists_of_docIDs:
+        return array('i')
+    if len(lists_of_docIDs) == 1:
+        return lists_of_docIDs[0]
+    if any(isinstance(docIDs, Bitmap) for docIDs in lists_of_docIDs):
+        return reduce(lambda merged, docIDs: merged | docIDs,
+                      [docIDs if isinstance(docIDs, Bitmap) else bitmap.from_docIDs(docIDs) for docIDs in lists_of_docIDs])
+    if all(previous[-1] < following[0] for previous, following in zip(lists_of_docIDs, lists_of_docIDs[1:])):
+        # Segments are usually appended with ever larger docIDs, so their lists can just be concatenated.
+        return array('i', chain(*lists_of_docIDs))
+    return array('i', sorted(set(chain(*lists_of_docIDs))))
+
+
+class Index:
+    """Read access to all segments of an index as if they were one.
+
+    Attributes:
+        all_docIDs: A sorted list or array of the docIDs of all segments, without deleted docIDs.
+        deleted: A sorted array('i') of the docIDs deleted from the index but still in the postings of some segment.
+        generation: The generation of the segment manifest the index was opened with.
+        version: The state of the index on disk when it was opened, as returned by index_version.
+        segments: A list of (dictionary, PostingsFile) tuples, one per segment.
+        segment_docIDs: A list of the sorted docIDs of every segment, deleted docIDs included.
+        positions: A list with, for every segment, a (positions dictionary, PostingsFile of positions) tuple, or None if
+            the segment was built without positions.
+        positional: True if every segment has positions, so that phrase and proximity queries can be answered.
+        frequencies: A list with, for every segment, a (frequencies dictionary, PostingsFile of term frequencies, array('i')
+            of document lengths in the order of the segment's docIDs) tuple, or None if the segment was built without
+            term frequencies.
+        weighted: True if every segment has term frequencies and document lengths, so that queries can be ranked.
+        postings_cache: A cache.PostingsCache that read_postings keeps decoded postings in, or None.
+    """
+
+    all_docIDs = None
+    deleted = None
+    generation = 0
+    version = None
+    segments = None
+    segment_docIDs = None
+    positions = None
+    positional = False
+    frequencies = None
+    weighted = False
+    length_stats = None
+    postings_cache = None
+
+    def __init__(self, dict_file_name, postings_file_name):
+        """Opens every segment of an index.
+
+        :param dict_file_name: The file path of the dictionary file.
+        :param postings_file_name: The file path of the postings file.
+        """
+        self.generation, segment_files = read_segments(dict_file_name, postings_file_name)
+        self.segments = []
+        self.positions = []
+        self.frequencies = []
+        self.segment_docIDs = []
+        for segment_dict, segment_postings in segment_files:
+            docIDs, dictionary = load_dictionary(segment_dict)
+            self.segments.append((dictionary, PostingsFile(segment_postings)))
+            self.segment_docIDs.append(docIDs)
+            positions_dict, positions_postings = positions_file_names(segment_dict, segment_postings)
+            if os.path.exists(positions_dict) and os.path.exists(positions_postings):
+                self.positions.append((load_dictionary(positions_dict)[1], PostingsFile(positions_postings)))
+            else:
+                self.positions.append(None)
+            frequencies_dict, frequencies_postings, lengths = frequencies_file_names(segment_dict, segment_postings)
+            if os.path.exists(frequencies_dict) and os.path.exists(frequencies_postings) and os.path.exists(lengths):
+                self.frequencies.append((load_dictionary(frequencies_dict)[1], PostingsFile(frequencies_postings),
+                                         read_document_lengths(lengths)))
+            else:
+                self.frequencies.append(None)
+        self.positional = all(positions is not None for positions in self.positions)
+        self.weighted = all(frequencies is not None for frequencies in self.frequencies)
+        self.all_docIDs = merge_docIDs(self.segment_docIDs)
+        self.deleted = read_tombstones(dict_file_name)
+        self.version = index_version(dict_file_name, self.generation, segment_files, self.deleted)
+        if self.deleted:
+            # Removing deleted docIDs from the universe once here keeps them out of every NOT.
+            deleted = set(self.deleted)
+            self.all_docIDs = array('i', [docID for docID in self.all_docIDs if docID not in deleted])
+
+    def __contains__(self, term):
+        for dictionary, postings in self.segments:
+            if term in dictionary:
+                return True
+        return False
+
+    def document_frequency(self, term):
+        """Returns the number of documents a term appears in, if every segment's dictionary records it.
+
+        :param term: The search token.
+        :return: The document frequency summed over all segments, or None if some dictionary does not record it.
+        """
+        frequency = 0
+        for dictionary, postings in self.segments:
+            try:
+                entry = dictionary[term]
+            except KeyError:
+                continue
+            if len(entry) < 3:
+                return None
+            frequency += entry[2]
+        return frequency
+
+    def use_postings_cache(self, postings_cache):
+        """Attaches a cache that decoded postings are kept in and served from.
+
+        :param postings_cache: A cache.PostingsCache, or None to stop caching.
+        """
+        if postings_cache is not None:
+            postings_cache.use_index(self)
+        self.postings_cache = postings_cache
+
+    def read_postings(self, term, candidates=None):
+        """Reads the postings of a term, from the postings cache if it holds them, and else by decoding them.
+
+        Postings decoded in full are stored in the postings cache. Terms missed in the cache more than once are decoded
+        in full even if candidates are given, so that they can be.
+
+        :param term: The search token.
+        :param candidates: A sorted list of docIDs, if the postings are only needed where they meet these docIDs. Parts of
+            the postings that cannot hold any candidate may then be left undecoded.
+        :return: As decode_postings.
+        """
+        postings_cache = self.postings_cache
+        if postings_cache is None:
+            return self.decode_postings(term, candidates)
+        key = utf8(term)
+        postings = postings_cache.get(key)
+        if postings is not None:
+            return postings
+        if postings_cache.recurring(key):
+            candidates = None
+        postings = self.decode_postings(term, candidates)
+        if candidates is None:
+            postings_cache.put(key, postings)
+        return postings
+
+    def read_postings_batch(self, terms):
+        """Reads the postings of many terms, each once, in the order they are stored in: segment by segment, and by
+        pointer within a segment. The postings files are then read front to back rather than at random.
+
+        :param terms: An iterable of search tokens.
+        :return: A dict of search token -> postings, as returned by read_postings.
+        """
+        def location(term):
+            for segment_number, (dictionary, postings) in enumerate(self.segments):
+                try:
+                    return (segment_number, dictionary[term][0])
+                except KeyError:
+                    continue
+            return (len(self.segments), 0)
+
+        return dict((term, self.read_postings(term)) for term in sorted(set(terms), key=location))
+
+    def decode_postings(self, term, candidates=None):
+        """Reads and decodes the postings of a term from every segment that has it.
+
+        :param term: The search token.
+        :param candidates: A sorted list of docIDs, if the postings are only needed where they meet these docIDs. Parts of
+            the postings that cannot hold any candidate may then be left undecoded.
+        :return: A sorted array('i') of docIDs, which is empty if the term is in no segment, or a bitmap.Bitmap.
+            If candidates were given, docIDs that are not candidates may be missing.
+        """
+        segment_postings = []
+        for dictionary, postings in self.segments:
+            try:
+                entry = dictionary[term]
+            except KeyError:
+                continue
+            if candidates is None:
+                segment_postings.append(postings.read(entry[0], entry[1]))
+            else:
+                segment_postings.append(postings.read_matching(entry[0], entry[1], candidates))
+        return merge_docIDs(segment_postings)
+
+    def read_postings_parts(self, term):
+        """Splits the postings of a term into parts that can be decoded on their own, for decoding them only as needed.
+
+        :param term: The search token.
+        :return: A list with, for every segment that has the term, the list of parts of its postings, as returned by
+            PostingsFile.read_parts. Postings held by the postings cache, or stored in it now because the term is
+            recurring (see read_postings), are a single part.
+        """
+        if self.postings_cache is not None:
+            key = utf8(term)
+            postings = self.postings_cache.get(key)
+            if postings is None and self.postings_cache.recurring(key):
+                postings = self.decode_postings(term)
+                self.postings_cache.put(key, postings)
+            if postings is not None:
+                return [[(None, lambda: postings)]]
+        segment_parts = []
+        for dictionary, postings in self.segments:
+            try:
+                entry = dictionary[term]
+            except KeyError:
+                continue
+            segment_parts.append(postings.read_parts(entry[0], entry[1]))
+        return segment_parts
+
+    def read_positions(self, term):
+        """Looks up the positions of a term in every segment, without decoding any of them yet.
+
+        :param term: The search token.
+        :return: A TermPositions.
+        """
+        if not self.positional:
+            raise ValueError("the index has no positions for phrase or proximity queries, it must be built with -P")
+        lists = []
+        for dictionary, positions in self.positions:
+            try:
+                entry = dictionary[term]
+            except KeyError:
+                continue
+            lists.append(positions.view(entry[0], entry[1]))
+        return TermPositions(lists)
+
+    def read_frequency_parts(self, term):
+        """Splits the term frequencies of a term into blocks that can be decoded on their own, without decoding any yet.
+
+        :param term: The search token.
+        :return: A list with, for every segment that has the term, a tuple of (the number of the segment in segments, the
+            list of its blocks, as returned by frequencies_decode_parts).
+        """
+        if not self.weighted:
+            raise ValueError("the index has no term frequencies for ranked queries, it must be built with -f")
+        segment_parts = []
+        for segment, (dictionary, frequencies, lengths) in enumerate(self.frequencies):
+            try:
+                entry = dictionary[term]
+            except KeyError:
+                continue
+            segment_parts.append((segment, frequencies_decode_parts(frequencies.view(entry[0], entry[1]))))
+        return segment_parts
+
+    def document_length(self, docID):
+        """Returns the length in words of a document, which must be in the index."""
+        for docIDs, (dictionary, frequencies, lengths) in zip(self.segment_docIDs, self.frequencies):
+            i = bisect_left(docIDs, docID)
+            if i < len(docIDs) and docIDs[i] == docID:
+                return lengths[i]
+        raise KeyError(docID)
+
+    def document_length_stats(self):
+        """Returns a tuple of the average length in words of the documents not deleted, and a list of the shortest length
+        of the documents not deleted in every segment (0 for a segment without any)."""
+        if self.length_stats is None:
+            deleted = set(self.deleted)
+            total = count = 0
+            shortest = []
+            for docIDs, (dictionary, frequencies, segment_lengths) in zip(self.segment_docIDs, self.frequencies):
+                lengths = [length for docID, length in zip(docIDs, segment_lengths) if docID not in deleted]
+                total += sum(lengths)
+                count += len(lengths)
+                shortest.append(min(lengths or [0]))
+            self.length_stats = (float(total) / max(count, 1), shortest)
+        return self.length_stats
+
+    def expand_wildcard(self, pattern, limit):
+        """Finds the terms of all segments matching a wildcard pattern, in which * stands for any number of characters.
+
+        Only the terms starting with the characters before the first * are looked at, found by binary search in binary
+        dictionaries, so the longer that prefix the fewer terms are compared. A pattern starting with * is compared with
+        every term.
+
+        :param pattern: The pattern, as unicode or a UTF-8 byte string.
+        :param limit: The most terms to return.
+        :return: A tuple of (list of the first limit matching terms as UTF-8 byte strings, in sorted order and without
+            repeats, True if more terms match).
+        """
+        pattern = utf8(pattern)
+        prefix = pattern.split("*", 1)[0]
+        matcher = re.compile(".*".join(re.escape(part) for part in pattern.split("*")) + r"\Z", re.DOTALL)
+        segment_terms = []
+        for dictionary, postings in self.segments:
+            if isinstance(dictionary, Dictionary):
+                segment_terms.append(dictionary.prefixed(prefix))
+            else:
+                segment_terms.append(iter(sorted(term for term in (utf8(term) for term in dictionary)
+                                                 if term.startswith(prefix))))
+        matches = []
+        for term in heapq.merge(*segment_terms):
+            if (not matches or term != matches[-1]) and matcher.match(term):
+                if len(matches) == limit:
+                    return (matches, True)
+                matches.append(term)
+        return (matches, False)
+
+    def terms(self):
+        """Returns a generator of the terms of all segments as UTF-8 byte strings, in sorted order and without repeats."""
+        segment_terms = []
+        for dictionary, postings in self.segments:
+            if isinstance(dictionary, Dictionary):
+                segment_terms.append(iter(dictionary))
+            else:
+                segment_terms.append(iter(sorted(utf8(term) for term in dictionary)))
+        previous = None
+        for term in heapq.merge(*segment_terms):
+            if term != previous:
+                yield term
+                previous = term
+
+    def close(self):
+        extra_files = filter(None, self.positions) + [frequencies[:2] for frequencies in self.frequencies if frequencies]
+        for dictionary, postings in self.segments + extra_files:
+            if isinstance(dictionary, Dictionary):
+                dictionary.close()
+            postings.close()
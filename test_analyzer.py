@@ -0,0 +1,130 @@
+"""
+Tests of text analysis: query tokenization against NLTK's, and the analysis of documents into terms and positions.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import nltk
+import analyzer
+
+
+def punkt_available():
+    try:
+        nltk.data.find("tokenizers/punkt")
+        return True
+    except LookupError:
+        return False
+
+
+class QueryTokenizerTest(unittest.TestCase):
+
+    def random_query(self, rnd, pieces):
+        return "".join(rnd.choice(pieces) + rnd.choice(["", " ", "  ", "\t"]) for i in xrange(rnd.randint(1, 10)))
+
+    def assertSameTokens(self, query):
+        # Queries without sentence-ending punctuation are a single sentence, which word_tokenize splits without Punkt.
+        self.assertEqual(analyzer.tokenize_query(query), nltk.word_tokenize(query, preserve_line=True), query)
+
+    def test_simple_queries(self):
+        # Split with a regular expression, without NLTK.
+        pieces = ["bill", "Gates", "AND", "OR", "NOT", "(", ")", "1999", "x2"]
+        rnd = random.Random(1)
+        for i in xrange(500):
+            self.assertSameTokens(self.random_query(rnd, pieces))
+
+    @unittest.skipUnless(punkt_available(), "NLTK's Punkt data is not installed")
+    def test_other_characters(self):
+        # Split by NLTK, as its tokenizer splits words such as "cannot" and treats punctuation in more involved ways.
+        pieces = ["bill", "AND", "(", ")", "cannot", "Wanna", "don't", "U.S", "co-op", "$5", "a,b", "it's", "'quoted'", "&"]
+        rnd = random.Random(2)
+        for i in xrange(200):
+            self.assertSameTokens(self.random_query(rnd, pieces))
+
+    @unittest.skipUnless(punkt_available(), "NLTK's Punkt data is not installed")
+    def test_sentence_punctuation(self):
+        for query in ["bill. AND gates", "what? OR (who!)", "end AND NOT U.S."]:
+            self.assertEqual(analyzer.tokenize_query(query), nltk.word_tokenize(query), query)
+
+    def test_positional_and_wildcard_tokens(self):
+        self.assertEqual(analyzer.tokenize_query('"bill gates" NEAR/3 bank* AND (ban*k OR x)'),
+                         ['"', "bill", "gates", '"', "NEAR/3", "bank*", "AND", "(", "ban*k", "OR", "x", ")"])
+        self.assertEqual(analyzer.tokenize_query("NEARBY NEAR/12 near"), ["NEARBY", "NEAR/12", "near"])
+
+
+
+class CountingStemmer:
+    """Wraps a stemmer, counting the words it is asked to stem."""
+
+    def __init__(self, stemmer):
+        self.stemmer = stemmer
+        self.words = []
+
+    def stem(self, word):
+        self.words.append(word)
+        return self.stemmer.stem(word)
+
+
+class DocumentAnalyzerTest(unittest.TestCase):
+
+    def setUp(self):
+        analyzer.load_nltk()
+        self.stemmer = analyzer.stemmer
+        self.stem_cache_size = analyzer.STEM_CACHE_SIZE
+        analyzer.stemmer = CountingStemmer(self.stemmer)
+        analyzer.stem_cache.clear()
+        self.directory = tempfile.mkdtemp(prefix="test")
+
+    def tearDown(self):
+        analyzer.stemmer = self.stemmer
+        analyzer.STEM_CACHE_SIZE = self.stem_cache_size
+        analyzer.stem_cache.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        doc_path = os.path.join(self.directory, "doc")
+        with open(doc_path, 'w') as doc_file:
+            doc_file.write(text)
+        return doc_path
+
+    def test_stems_memoized(self):
+        words = ["banks", "banking", "banks", "loans", "banking", "banks"]
+        self.assertEqual([analyzer.stem(word) for word in words], [self.stemmer.stem(word) for word in words])
+        self.assertEqual(analyzer.stemmer.words, ["banks", "banking", "loans"])
+        analyzer.STEM_CACHE_SIZE = 2
+        # The full cache is emptied rather than growing past its size.
+        self.assertEqual(analyzer.stem("lending"), "lend")
+        self.assertEqual(analyzer.stem_cache, {"lending": "lend"})
+
+    def test_single_pass(self):
+        doc_path = self.write("The Banks lend money. Bankers' loans grow!\nA banker's (small) loan, lent?  Money\n")
+        expected = set()
+        for sentence in ["The Banks lend money.", "Bankers' loans grow!", "A banker's (small) loan, lent?", "Money"]:
+            expected.update(self.stemmer.stem(word.lower()) for word in nltk.tokenize.TreebankWordTokenizer().tokenize(sentence))
+        terms = analyzer.file_terms(doc_path, True)
+        self.assertEqual(terms, expected)
+        # Every distinct word is stemmed once.
+        self.assertEqual(sorted(analyzer.stemmer.words), sorted(set(analyzer.stemmer.words)))
+        positions = analyzer.file_term_positions(doc_path, True)
+        self.assertEqual(set(positions), terms)
+        self.assertEqual(positions["bank"], [1])
+        self.assertEqual(positions["money"], [3, len(sum(positions.values(), [])) - 1])
+
+    def test_word_positions(self):
+        self.assertEqual(analyzer.word_positions(["Loans", "lend", "loan", ",", "Lending"]),
+                         {"loan": [0, 2], "lend": [1, 4], ",": [3]})
+
+    @unittest.skipUnless(punkt_available(), "NLTK's Punkt data is not installed")
+    def test_default_analysis(self):
+        doc_path = self.write("Mr. Smith banks at the U.S. bank. He lends money!\n")
+        expected = set()
+        for sentence in nltk.tokenize.sent_tokenize(open(doc_path).read()):
+            expected.update(self.stemmer.stem(word.lower()) for word in nltk.tokenize.word_tokenize(sentence))
+        self.assertEqual(analyzer.file_terms(doc_path), expected)
+        self.assertEqual(set(analyzer.file_term_positions(doc_path)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
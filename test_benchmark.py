@@ -0,0 +1,115 @@
+"""
+Tests of the query benchmark: its synthetic corpus and queries, its latency statistics and its comparison of runs.
+"""
+
+import os
+import sys
+import json
+import random
+import unittest
+from StringIO import StringIO
+import testutil
+import benchmark
+import search
+
+
+def quietly(function, *args):
+    """Calls a function with its standard output captured, and returns (its return value, the output)."""
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        return (function(*args), sys.stdout.getvalue())
+    finally:
+        sys.stdout = stdout
+
+
+class StatisticsTest(unittest.TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile(values, 1), 100)
+        self.assertEqual(benchmark.percentile(values, 0), 1)
+        self.assertEqual(benchmark.percentile([7], 0.95), 7)
+
+    def test_latency_summary(self):
+        summary = benchmark.latency_summary([4.0, 1.0, 3.0, 2.0])
+        self.assertEqual(summary, {"p50": 2.0, "p95": 4.0, "p99": 4.0, "mean": 2.5})
+
+
+class GeneratorTest(unittest.TestCase):
+
+    def test_zipf_sampler(self):
+        vocabulary = benchmark.make_vocabulary(50, random.Random(1))
+        self.assertEqual(len(set(vocabulary)), 50)
+        draw = benchmark.zipf_sampler(vocabulary, 1.0, random.Random(2))
+        counts = dict((word, 0) for word in vocabulary)
+        for i in xrange(20000):
+            counts[draw()] += 1
+        # The word of rank 1 about twice as often as that of rank 2, and ten times as often as that of rank 10.
+        self.assertAlmostEqual(counts[vocabulary[0]] / float(counts[vocabulary[1]]), 2, delta=0.3)
+        self.assertAlmostEqual(counts[vocabulary[0]] / float(counts[vocabulary[9]]), 10, delta=3)
+
+    def test_queries(self):
+        vocabulary = benchmark.make_vocabulary(400, random.Random(1))
+        queries = benchmark.generate_queries(vocabulary, 20, random.Random(3))
+        self.assertEqual([kind for kind, query in queries[:3]], benchmark.QUERY_KINDS)
+        self.assertEqual(len(queries), 60)
+        rare_words = set(vocabulary[200:])
+        for kind, query in queries:
+            rpn = search.shunting_yard(query)
+            if kind == "selective":
+                self.assertTrue(set(token for token in rpn if token != "AND") <= rare_words)
+            elif kind == "hot":
+                self.assertTrue(set(token for token in rpn if token != "OR") <= set(vocabulary[:6]))
+        self.assertEqual(benchmark.generate_queries(vocabulary, 20, random.Random(3)), queries)
+
+
+class BenchmarkRunTest(testutil.IndexTestCase):
+
+    def settings(self, **changes):
+        settings = {
+            "documents": 200, "vocabulary": 300, "exponent": 1.0, "document_length": 30, "queries": 5, "repeat": 1,
+            "backends": ["list", "cursor"], "build_args": ["-s"], "seed": 1,
+        }
+        settings.update(changes)
+        return settings
+
+    def test_run_and_compare(self):
+        results, output = quietly(benchmark.run_benchmark, self.directory, self.settings())
+        results = json.loads(json.dumps(results))
+        self.assertEqual(sorted(results["backends"]), ["cursor", "list"])
+        self.assertEqual(len(os.listdir(self.path("corpus"))), 200)
+        self.assertTrue(results["index_load_ms"] >= 0)
+        for measured in results["backends"].values():
+            self.assertEqual(measured["queries"], 15)
+            self.assertEqual(sorted(measured["kinds"]), sorted(benchmark.QUERY_KINDS))
+            self.assertTrue(measured["latency_ms"]["p50"] <= measured["latency_ms"]["p99"])
+
+        regressions, output = quietly(benchmark.compare, results, results, 0.1)
+        self.assertEqual(regressions, [])
+        self.assertFalse("other settings" in output)
+
+        # Twice as slow, and a larger index.
+        slower = json.loads(json.dumps(results))
+        slower["build"]["index_bytes"] = results["build"]["index_bytes"] * 2
+        slower["backends"]["list"]["throughput_qps"] = results["backends"]["list"]["throughput_qps"] / 2
+        slower["settings"]["seed"] = 2
+        regressions, output = quietly(benchmark.compare, slower, results, 0.1)
+        self.assertEqual(regressions, ["index bytes", "list throughput qps"])
+        self.assertTrue("other settings" in output)
+        self.assertEqual(output.count("REGRESSION"), 2)
+
+    def test_same_seed_same_corpus(self):
+        contents = []
+        for name in ("first", "second"):
+            os.makedirs(self.path(name))
+            benchmark.generate_corpus(self.path(name), 20, benchmark.make_vocabulary(50, random.Random(1)), 1.0, 10,
+                                      random.Random(4))
+            contents.append([open(self.path(name, str(docID))).read() for docID in xrange(1, 21)])
+        self.assertEqual(contents[0], contents[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
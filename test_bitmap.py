@@ -0,0 +1,84 @@
+"""
+Tests of bitmap postings, and of the boolean operators between bitmaps and postings lists.
+"""
+
+import random
+import unittest
+import bitmap
+import search
+from bitmap import Bitmap
+
+
+def random_docIDs(rnd, universe=3000):
+    return sorted(rnd.sample(xrange(1, universe), rnd.choice([0, 1, 10, 300, universe // 2])))
+
+
+class BitmapTest(unittest.TestCase):
+
+    def test_bytes_round_trip(self):
+        for bits in [0, 1, 255, 256, 2 ** 64 - 1, 2 ** 100 + 3]:
+            self.assertEqual(bitmap.bytes_to_bits(bitmap.bits_to_bytes(bits)), bits)
+        self.assertEqual(bitmap.bits_to_bytes(0x0102), "\x02\x01")
+        self.assertEqual(bitmap.bytes_to_bits(buffer("\x02\x01")), 0x0102)
+        self.assertEqual(bitmap.bytes_to_bits(""), 0)
+
+    def test_docIDs_round_trip(self):
+        rnd = random.Random(1)
+        for i in xrange(50):
+            docIDs = random_docIDs(rnd)
+            b = bitmap.from_docIDs(docIDs)
+            self.assertEqual(list(b.docIDs()), docIDs)
+            self.assertEqual(list(b), docIDs)
+            self.assertEqual(len(b), len(docIDs))
+            for docID in docIDs[:20]:
+                self.assertTrue(docID in b)
+            for docID in [0, 4000, 10 ** 6] + [docID + 1 for docID in docIDs[:20] if docID + 1 not in docIDs]:
+                self.assertFalse(docID in b)
+        self.assertEqual(list(bitmap.from_docIDs([9, 3, 3])), [3, 9])
+
+    def test_from_runs(self):
+        self.assertEqual(list(bitmap.from_runs([(3, 4), (20, 1), (64, 3)])), [3, 4, 5, 6, 20, 64, 65, 66])
+        self.assertEqual(len(bitmap.from_runs([])), 0)
+
+    def test_operators(self):
+        rnd = random.Random(2)
+        for i in xrange(50):
+            p1 = random_docIDs(rnd)
+            p2 = random_docIDs(rnd)
+            b1 = bitmap.from_docIDs(p1)
+            b2 = bitmap.from_docIDs(p2)
+            self.assertEqual(list(b1 & b2), sorted(set(p1) & set(p2)))
+            self.assertEqual(list(b1 | b2), sorted(set(p1) | set(p2)))
+            self.assertEqual(list(b1.and_not(b2)), sorted(set(p1) - set(p2)))
+
+
+class BitmapOperatorTest(unittest.TestCase):
+    """The search operators taking any mix of postings lists and bitmaps."""
+
+    def operands(self, rnd):
+        """Makes up postings lists, each at random either as a list or a bitmap."""
+        lists = [random_docIDs(rnd) for i in xrange(rnd.randint(1, 4))]
+        return (lists, [bitmap.from_docIDs(p) if rnd.random() < 0.5 else p for p in lists])
+
+    def test_mixed_operands(self):
+        rnd = random.Random(3)
+        all_docIDs = range(1, 3000)
+        for i in xrange(100):
+            lists, operands = self.operands(rnd)
+            if not any(isinstance(p, Bitmap) for p in operands):
+                operands[0] = bitmap.from_docIDs(operands[0])
+            self.assertEqual(list(search.bitmap_or(operands)), sorted(set().union(*lists)))
+            self.assertEqual(list(search.bitmap_and(operands)), sorted(set(lists[0]).intersection(*lists)))
+            self.assertEqual(list(search.bitmap_not(operands[0], all_docIDs)), sorted(set(all_docIDs) - set(lists[0])))
+            if len(operands) > 1:
+                self.assertEqual(list(search.bitmap_and_not(operands[0], operands[1])),
+                                 sorted(set(lists[0]) - set(lists[1])))
+
+    def test_universe_follows_all_docIDs(self):
+        self.assertEqual(list(search.bitmap_not([2], [1, 2, 3])), [1, 3])
+        # A different list of all docIDs, as after loading another index, is not answered from the previous universe.
+        self.assertEqual(list(search.bitmap_not([2], [2, 5])), [5])
+
+
+if __name__ == "__main__":
+    unittest.main()
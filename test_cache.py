@@ -0,0 +1,213 @@
+"""
+Tests of the byte-bounded caches and their eviction policies, and of query results served through them.
+"""
+
+import random
+import unittest
+from array import array
+import testutil
+import search
+import cache
+
+
+class FakeIndex:
+    """Stands in for a storage.Index, of which caches only look at the version."""
+
+    def __init__(self, version=0):
+        self.version = version
+
+
+def postings_of_size(count):
+    """Returns postings whose size, as estimated by cache.postings_size, is count * 4 bytes."""
+    return array('i', range(count))
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.ResultCache(100)
+        self.cache.use_index(FakeIndex())
+
+    def test_evicts_least_recently_used(self):
+        for key in "abc":
+            self.cache.put(key, postings_of_size(10))
+        self.assertEqual(self.cache.size, 120 - 40)
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(list(self.cache.get("b")), range(10))
+        self.cache.put("d", postings_of_size(6))
+        self.assertEqual(self.cache.get("c"), None)
+        self.assertTrue(self.cache.get("b") is not None and self.cache.get("d") is not None)
+        self.assertEqual(self.cache.size, 64)
+        self.assertEqual(self.cache.evictions, 2)
+
+    def test_replace_and_oversized(self):
+        self.cache.put("a", postings_of_size(10))
+        self.cache.put("a", postings_of_size(20))
+        self.assertEqual(self.cache.size, 80)
+        self.cache.put("b", postings_of_size(26))
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(len(self.cache.get("a")), 20)
+
+    def test_stats_and_recurring(self):
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertFalse(self.cache.recurring("a"))
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertTrue(self.cache.recurring("a"))
+        self.cache.put("a", [])
+        self.cache.get("a")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+        self.assertTrue(self.cache.stats().startswith("1 hits, 2 misses (33.3% hit rate)"))
+
+    def test_emptied_for_another_index(self):
+        index = FakeIndex()
+        self.cache.use_index(index)
+        self.cache.put("a", postings_of_size(1))
+        self.cache.use_index(index)
+        self.assertTrue(self.cache.get("a") is not None)
+        self.cache.use_index(FakeIndex())
+        self.assertTrue(self.cache.get("a") is not None)
+        index.version += 1
+        self.cache.use_index(index)
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(self.cache.size, 0)
+
+
+class TinyLFUCacheTest(unittest.TestCase):
+
+    def test_one_off_keys_not_admitted(self):
+        postings_cache = cache.PostingsCache(100, "tinylfu")
+        postings_cache.use_index(FakeIndex())
+        for key in "ab":
+            for i in xrange(3):
+                postings_cache.get(key)
+            postings_cache.put(key, postings_of_size(12))
+        # A burst of keys asked for once each does not flush the frequently asked for ones out of the cache.
+        for i in xrange(50):
+            key = "one-off {0}".format(i)
+            postings_cache.get(key)
+            postings_cache.put(key, postings_of_size(12))
+        self.assertTrue(postings_cache.get("a") is not None and postings_cache.get("b") is not None)
+        self.assertEqual(postings_cache.evictions, 0)
+        # A key asked for more often than the least recently used one it would evict is admitted.
+        for i in xrange(6):
+            postings_cache.get("c")
+        postings_cache.put("c", postings_of_size(12))
+        self.assertTrue(postings_cache.get("c") is not None)
+        self.assertEqual(postings_cache.get("a"), None)
+
+    def test_sketch_ages(self):
+        policy = cache.TinyLFUPolicy()
+        for i in xrange(8):
+            policy.record("a")
+        self.assertEqual(policy.frequency("a"), 8)
+        # As if the rest of the sample had been of other keys: the next access halves every counter.
+        policy.samples = 10 * cache.SKETCH_WIDTH - 1
+        policy.record("b")
+        self.assertEqual(policy.frequency("a"), 4)
+        self.assertEqual(policy.samples, 0)
+
+
+class PostingsCacheTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.words = testutil.make_words(20)
+        self.documents = testutil.make_documents(self.words, 500, length=10)
+        self.index = search.load_index(*self.build(self.documents))
+
+    def tearDown(self):
+        self.index.close()
+        testutil.IndexTestCase.tearDown(self)
+
+    def test_preload(self):
+        postings_cache = cache.PostingsCache(10 ** 6)
+        self.index.use_postings_cache(postings_cache)
+        postings_cache.preload(self.index, 3)
+        self.assertEqual(sorted(postings_cache.entries), sorted(self.words[:3]))
+        self.assertTrue(self.index.read_postings(self.words[0]) is postings_cache.entries[self.words[0]][0])
+        self.assertEqual(postings_cache.hits, 1)
+
+    def test_results_through_the_cache(self):
+        rnd = random.Random(1)
+        expressions = [testutil.random_expression(rnd, self.words[:8], 2) for i in xrange(40)]
+        for policy in sorted(cache.policies):
+            self.index.use_postings_cache(cache.PostingsCache(2000, policy))
+            for backend in testutil.BACKENDS:
+                for expression in expressions:
+                    results = search.evaluate_query(testutil.query_text(expression), self.index, backend)
+                    self.assertEqual(list(results), testutil.expected_docIDs(expression, self.documents),
+                                     (policy, backend, expression))
+            postings_cache = self.index.postings_cache
+            self.assertTrue(postings_cache.hits > 0 and postings_cache.size <= postings_cache.capacity, policy)
+        self.index.use_postings_cache(None)
+
+
+class ResultCacheQueryTest(testutil.IndexTestCase):
+
+    def test_results_through_the_cache(self):
+        words = testutil.make_words(20)
+        documents = testutil.make_documents(words, 500, length=10)
+        index = search.load_index(*self.build(documents))
+        rnd = random.Random(1)
+        expressions = [testutil.random_expression(rnd, words[:8], 2) for i in xrange(40)]
+        try:
+            for backend in testutil.BACKENDS:
+                result_cache = cache.ResultCache(10 ** 6)
+                # Every query twice, so the second time is answered from the cache.
+                for expression in expressions + expressions:
+                    results = search.evaluate_query(testutil.query_text(expression), index, backend, result_cache=result_cache)
+                    self.assertEqual(list(results), testutil.expected_docIDs(expression, documents), (backend, expression))
+                # The cursor backend streams its results instead of resolving subtrees, and does not use the cache.
+                self.assertEqual(result_cache.hits > 0, backend != "cursor", backend)
+        finally:
+            index.close()
+
+    def test_operands_in_any_order(self):
+        documents = {1: ["kado", "mipu"], 2: ["kado"], 3: ["mipu", "sola"]}
+        index = search.load_index(*self.build(documents))
+        try:
+            result_cache = cache.ResultCache(10 ** 6)
+            self.assertEqual(list(search.evaluate_query("kado AND mipu", index, result_cache=result_cache)), [1])
+            plans = []
+            self.assertEqual(list(search.evaluate_query("mipu AND kado", index, plans=plans, result_cache=result_cache)), [1])
+            self.assertTrue("cached" in plans[0], plans[0])
+        finally:
+            index.close()
+
+    def test_emptied_by_delete(self):
+        self.build({1: ["kado"], 2: ["mipu"], 3: ["kado", "sola"]})
+        result_cache = cache.ResultCache(10 ** 6)
+        for expected_misses in (1, 1):
+            # Opening the unchanged index again keeps the cache.
+            index = search.load_index(*self.index_files())
+            try:
+                self.assertEqual(list(search.evaluate_query("kado OR sola", index, result_cache=result_cache)), [1, 3])
+            finally:
+                index.close()
+            self.assertEqual(result_cache.misses, expected_misses)
+        self.delete([3])
+        index = search.load_index(*self.index_files())
+        try:
+            self.assertEqual(list(search.evaluate_query("kado OR sola", index, result_cache=result_cache)), [1])
+            self.assertEqual(result_cache.misses, 2)
+        finally:
+            index.close()
+
+    def test_emptied_by_append(self):
+        self.build({1: ["kado"], 2: ["mipu"]})
+        result_cache = cache.ResultCache(10 ** 6)
+        index = search.load_index(*self.index_files())
+        try:
+            self.assertEqual(list(search.evaluate_query("kado OR sola", index, result_cache=result_cache)), [1])
+        finally:
+            index.close()
+        self.append({3: ["sola"]})
+        index = search.load_index(*self.index_files())
+        try:
+            self.assertEqual(list(search.evaluate_query("kado OR sola", index, result_cache=result_cache)), [1, 3])
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Tests of building indexes with index.py: the ways of building the same index, and updating it in place.
+"""
+
+import os
+import random
+import subprocess
+import unittest
+import testutil
+import storage
+import search
+import index
+from testutil import BACKENDS, docID_list
+
+
+class BuildTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        words = testutil.make_words(80)
+        self.documents = testutil.make_documents(words, 400, length=40)
+
+    def index_bytes(self, name):
+        """Returns the contents of every file of the index of the given name, by file name suffix."""
+        contents = {}
+        prefix = name + "."
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith(prefix) and not file_name.endswith(".docs"):
+                with open(self.path(file_name), 'rb') as index_file:
+                    contents[file_name[len(prefix):]] = index_file.read()
+        return contents
+
+    def assertSameIndex(self, name, other_name):
+        contents = self.index_bytes(name)
+        other_contents = self.index_bytes(other_name)
+        self.assertEqual(sorted(contents), sorted(other_contents))
+        for suffix in contents:
+            self.assertTrue(contents[suffix] == other_contents[suffix], suffix)
+
+    def test_index_contents(self):
+        index = storage.Index(*self.build(self.documents))
+        try:
+            self.assertEqual(list(index.all_docIDs), sorted(self.documents))
+            for term in index.terms():
+                expected = [docID for docID in sorted(self.documents) if term in self.documents[docID]]
+                self.assertEqual(docID_list(index.read_postings(term)), expected)
+                self.assertEqual(index.document_frequency(term), len(expected))
+        finally:
+            index.close()
+
+    def test_parallel_build_is_identical(self):
+        for flags in ([], ["-P", "-f"]):
+            self.build(self.documents, "serial", *flags)
+            self.build(self.documents, "parallel", "-j", "3", *flags)
+            self.assertSameIndex("serial", "parallel")
+
+    def test_memory_bounded_build_is_identical(self):
+        for flags in ([], ["-P", "-f"]):
+            self.build(self.documents, "in_memory", *flags)
+            # Small enough a budget to write several blocks and merge them.
+            self.build(self.documents, "bounded", "-m", "0.02", *flags)
+            self.assertSameIndex("in_memory", "bounded")
+
+    def count_blocks(self, docs, memory_budget, positional):
+        """Indexes documents within a memory budget, and returns the number of blocks written."""
+        block_count = [0]
+        write_block = index.write_block
+
+        def counting_write_block(postings_list):
+            block_count[0] += 1
+            return write_block(postings_list)
+        index.write_block = counting_write_block
+        index.single_pass, index.positional = True, positional
+        try:
+            list(index.index_all_docs_spimi(docs, memory_budget))
+        finally:
+            index.write_block = write_block
+            index.single_pass = index.positional = False
+        return block_count[0]
+
+    def test_memory_budget_counts_positions(self):
+        testutil.write_documents(self.path("docs"), self.documents)
+        docs = index.load_all_doc_names(self.path("docs"))
+        # Positions take several times the memory of the docIDs alone, so the same budget holds fewer documents.
+        self.assertTrue(self.count_blocks(docs, 200000, True) > 2 * self.count_blocks(docs, 200000, False))
+
+    def test_parallel_and_memory_bounded_exclusive(self):
+        testutil.write_documents(self.path("docs"), self.documents)
+        dict_file, postings_file = self.index_files()
+        self.assertRaises(subprocess.CalledProcessError, testutil.run_index, "-i", self.path("docs"), "-d", dict_file,
+                          "-p", postings_file, "-s", "-j", "2", "-m", "1")
+        self.assertFalse(os.path.exists(dict_file))
+
+
+class UpdateTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.words = testutil.make_words(30)
+        self.documents = testutil.make_documents(self.words, 300, length=15)
+
+    def check_queries(self, documents, deleted=()):
+        """Checks random queries against the documents, on every backend."""
+        index = search.load_index(*self.index_files())
+        rnd = random.Random(len(documents))
+        try:
+            for i in xrange(30):
+                expression = testutil.random_expression(rnd, self.words)
+                expected = testutil.expected_docIDs(expression, documents, deleted)
+                for backend in BACKENDS:
+                    results = search.evaluate_query(testutil.query_text(expression), index, backend)
+                    self.assertEqual(list(results), expected, (backend, expression))
+        finally:
+            index.close()
+
+    def segment_count(self):
+        return len(storage.read_segments(*self.index_files())[1])
+
+    def test_append_and_compact(self):
+        first = dict((docID, words) for docID, words in self.documents.items() if docID <= 200)
+        self.build(first)
+        self.check_queries(first)
+        self.append(dict((docID, words) for docID, words in self.documents.items() if 200 < docID <= 250))
+        self.append(dict((docID, words) for docID, words in self.documents.items() if docID > 250))
+        self.assertEqual(self.segment_count(), 3)
+        self.check_queries(self.documents)
+        # Documents already indexed are skipped, so appending them again adds no segment.
+        self.append({})
+        self.assertEqual(self.segment_count(), 3)
+
+        self.compact()
+        self.assertEqual(self.segment_count(), 1)
+        self.check_queries(self.documents)
+        dict_file, postings_file = self.index_files()
+        self.assertFalse(os.path.exists(dict_file + ".1") or os.path.exists(dict_file + ".2"))
+
+    def test_rebuild_over_segments(self):
+        self.build(dict((docID, words) for docID, words in self.documents.items() if docID <= 200))
+        self.append(dict((docID, words) for docID, words in self.documents.items() if docID > 200))
+        self.delete([1, 2, 250])
+        self.assertEqual(self.segment_count(), 2)
+        # A full build from another corpus, reusing some of the docIDs, deleted ones included.
+        documents = testutil.make_documents(self.words, 150, seed=2)
+        docs_dir = self.path("other.docs")
+        testutil.write_documents(docs_dir, documents)
+        dict_file, postings_file = self.index_files()
+        testutil.run_index("-i", docs_dir, "-d", dict_file, "-p", postings_file, "-s")
+        self.assertFalse(os.path.exists(storage.manifest_file_name(dict_file)))
+        self.assertEqual(sorted(os.listdir(self.directory)), ["index.dict", "index.docs", "index.postings", "other.docs"])
+        self.assertEqual(self.segment_count(), 1)
+        self.assertEqual(list(storage.read_tombstones(dict_file)), [])
+        self.check_queries(documents)
+
+    def test_delete_and_compact(self):
+        self.build(self.documents)
+        deleted = range(1, 301, 4)
+        self.delete(deleted[:10])
+        self.delete(deleted[10:])
+        self.assertEqual(list(storage.read_tombstones(self.index_files()[0])), deleted)
+        # NOT is taken against the documents not deleted.
+        self.check_queries(self.documents, deleted)
+        index = search.load_index(*self.index_files())
+        try:
+            self.assertEqual(list(search.evaluate_query("NOT " + self.words[0], index)),
+                             testutil.expected_docIDs(("NOT", self.words[0]), self.documents, deleted))
+        finally:
+            index.close()
+
+        # Deleted documents cannot be indexed again until compaction drops them.
+        self.append(dict((docID, self.documents[docID]) for docID in deleted))
+        self.assertEqual(self.segment_count(), 1)
+
+        self.compact()
+        live = dict((docID, words) for docID, words in self.documents.items() if docID not in set(deleted))
+        self.assertEqual(list(storage.read_tombstones(self.index_files()[0])), [])
+        index = storage.Index(*self.index_files())
+        try:
+            self.assertEqual(list(index.all_docIDs), sorted(live))
+            for term in index.terms():
+                self.assertFalse(set(deleted) & set(docID_list(index.read_postings(term))), term)
+        finally:
+            index.close()
+        self.check_queries(live)
+
+
+if __name__ == "__main__":
+    unittest.main()
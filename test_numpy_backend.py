@@ -0,0 +1,49 @@
+"""
+Tests of the NumPy evaluation backend against the set operations it stands in for. Skipped where NumPy is missing.
+"""
+
+import random
+import unittest
+from array import array
+import bitmap
+import search
+
+numpy_backend = search.numpy_backend
+
+
+@unittest.skipIf(numpy_backend is None, "NumPy is not installed")
+class NumpyBackendTest(unittest.TestCase):
+
+    def test_as_array(self):
+        docIDs = [1, 7, 8, 15, 16, 64, 1000]
+        for postings in (docIDs, array('i', docIDs), bitmap.from_docIDs(docIDs), numpy_backend.as_array(docIDs)):
+            converted = numpy_backend.as_array(postings)
+            self.assertEqual(converted.dtype, numpy_backend.np.int32)
+            self.assertEqual(converted.tolist(), docIDs)
+        for postings in ([], array('i'), bitmap.Bitmap(0)):
+            self.assertEqual(len(numpy_backend.as_array(postings)), 0)
+
+    def test_merge(self):
+        rnd = random.Random(1)
+        all_docIDs = range(1, 3000)
+        for i in xrange(200):
+            lists = [sorted(rnd.sample(all_docIDs, rnd.choice([0, 1, 30, 1500]))) for j in xrange(rnd.randint(2, 4))]
+            operands = [bitmap.from_docIDs(p) if rnd.random() < 0.3 else array('i', p) for p in lists]
+            sets = [set(p) for p in lists]
+            expected = {
+                "NOT": sorted(set(all_docIDs) - sets[0]),
+                "OR": sorted(set().union(*sets)),
+                "AND": sorted(sets[0].intersection(*sets)),
+                "AND NOT": sorted(sets[0] - sets[1]),
+            }
+            for op, docIDs in expected.items():
+                children = operands[:1] if op == "NOT" else operands[:2] if op == "AND NOT" else operands
+                self.assertEqual(numpy_backend.merge(op, children, all_docIDs).tolist(), docIDs, op)
+
+    def test_universe_follows_all_docIDs(self):
+        self.assertEqual(numpy_backend.merge("NOT", [[2]], [1, 2, 3]).tolist(), [1, 3])
+        self.assertEqual(numpy_backend.merge("NOT", [[2]], [2, 5]).tolist(), [5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,668 @@
+"""
+Tests of query parsing and evaluation, against the sample index of the repository and indexes built from a synthetic
+corpus, checked by brute force.
+"""
+
+import sys
+import math
+import fnmatch
+import random
+import unittest
+from array import array
+from StringIO import StringIO
+import testutil
+import search
+import storage
+from testutil import BACKENDS, docID_list
+
+
+def naive_evaluate(query, index):
+    """Evaluates a boolean query as sets, straight from its Reverse Polish Notation, as the searcher did before it
+    consolidated, planned and streamed query trees."""
+    universe = set(index.all_docIDs)
+    stack = []
+    for token in search.shunting_yard(query):
+        if token == "NOT":
+            stack.append(universe - stack.pop())
+        elif token in ("AND", "OR"):
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(left & right if token == "AND" else left | right)
+        else:
+            stack.append(set(docID_list(index.read_postings(token))) & universe)
+    return sorted(stack.pop())
+
+
+class BooleanTest(testutil.IndexTestCase):
+
+    def test_legacy_index_parity(self):
+        with open(testutil.repo_path("queries.txt")) as queries_file:
+            queries = queries_file.read().splitlines()
+        index = search.load_index(testutil.repo_path("dictionary.txt"), testutil.repo_path("postings.txt"))
+        try:
+            expected = [naive_evaluate(query, index) for query in queries]
+            self.assertTrue(all(expected[:4]))
+            for backend in BACKENDS:
+                for query, docIDs in zip(queries, expected):
+                    self.assertEqual(docID_list(search.evaluate_query(query, index, backend)), docIDs, (backend, query))
+                for batch in (False, True):
+                    evaluated = search.evaluate_queries(queries, index, backend, batch=batch)
+                    self.assertEqual([docID_list(results) for results, plans in evaluated], expected, backend)
+        finally:
+            index.close()
+
+    def test_random_queries(self):
+        words = testutil.make_words(40)
+        documents = testutil.make_documents(words, 800, length=20)
+        index = search.load_index(*self.build(documents))
+        rnd = random.Random(1)
+        try:
+            expressions = [testutil.random_expression(rnd, words) for i in xrange(150)]
+            queries = [testutil.query_text(expression) for expression in expressions]
+            expected = [testutil.expected_docIDs(expression, documents) for expression in expressions]
+            for backend in BACKENDS:
+                for query, docIDs in zip(queries, expected):
+                    self.assertEqual(docID_list(search.evaluate_query(query, index, backend)), docIDs, (backend, query))
+                    self.assertEqual(docID_list(search.evaluate_query(query, index, backend, limit=3)), docIDs[:3])
+        finally:
+            index.close()
+
+
+class QueryErrorTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.documents = {1: ["kado", "mipu", "sola"], 2: ["kado", "sola"], 3: ["mipu"]}
+        self.dict_file, self.postings_file = self.build(self.documents)
+        self.index = search.load_index(self.dict_file, self.postings_file)
+
+    def tearDown(self):
+        self.index.close()
+        testutil.IndexTestCase.tearDown(self)
+
+    def test_malformed(self):
+        for query in ["kado AND", "AND mipu", "NOT", "(kado OR mipu", "kado)", "kado OR (mipu AND sola))"]:
+            self.assertRaises(search.QueryError, search.evaluate_query, query, self.index)
+
+    def test_positional_needs_positions(self):
+        for query in ['"kado sola"', "kado NEAR/2 sola", 'mipu AND "kado sola"']:
+            self.assertRaises(search.QueryError, search.evaluate_query, query, self.index)
+        # A phrase of a single word is just its search token.
+        self.assertEqual(list(search.evaluate_query('"kado"', self.index)), [1, 2])
+
+    def test_near_operands(self):
+        dict_file, postings_file = self.build(self.documents, "positional", "-P")
+        index = search.load_index(dict_file, postings_file)
+        try:
+            self.assertEqual(list(search.evaluate_query("kado NEAR/1 sola", index)), [2])
+            self.assertRaises(search.QueryError, search.evaluate_query, "kado NEAR/2 (mipu OR sola)", index)
+        finally:
+            index.close()
+
+    def test_other_queries_still_answered(self):
+        queries = ["kado AND", "mipu", '"kado sola"', "kado AND NOT mipu"]
+        for batch in (False, True):
+            evaluated = list(search.evaluate_queries(queries, self.index, batch=batch))
+            self.assertTrue(isinstance(evaluated[0][0], search.QueryError))
+            self.assertEqual(list(evaluated[1][0]), [1, 3])
+            self.assertTrue(isinstance(evaluated[2][0], search.QueryError))
+            self.assertEqual(list(evaluated[3][0]), [2])
+
+    def test_process_queries_output(self):
+        queries_file = self.path("queries.txt")
+        output_file = self.path("output.txt")
+        with open(queries_file, 'w') as queries:
+            queries.write("kado AND\nmipu\n(sola\nsola\n")
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            search.process_queries(self.dict_file, self.postings_file, queries_file, output_file)
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        with open(output_file) as output:
+            self.assertEqual(output.read().split("\n"), ["", "1 3 ", "", "1 2 ", ""])
+        self.assertEqual(errors.count("error in query"), 2)
+
+
+class IntersectionTest(unittest.TestCase):
+
+    def test_gallop(self):
+        rnd = random.Random(1)
+        for i in xrange(100):
+            p = sorted(rnd.sample(xrange(1, 500), rnd.randint(0, 200)))
+            for lo in range(0, len(p) + 1, 7):
+                for target in rnd.sample(xrange(0, 510), 20):
+                    expected = lo
+                    while expected < len(p) and p[expected] < target:
+                        expected += 1
+                    self.assertEqual(search.gallop(p, target, lo), expected, (p, target, lo))
+
+    def test_skewed_lengths(self):
+        # Lists of very different lengths gallop, and of similar lengths merge, whichever order they are given in.
+        rnd = random.Random(2)
+        for i in xrange(100):
+            long_list = array('i', sorted(rnd.sample(xrange(1, 100000), 5000)))
+            short_list = array('i', sorted(rnd.sample(long_list, rnd.randint(0, 20)) + rnd.sample(xrange(1, 100000), 20)))
+            short_list = array('i', sorted(set(short_list)))
+            for p1, p2 in ((short_list, long_list), (long_list, short_list)):
+                self.assertEqual(search.op_and(p1, p2), sorted(set(p1) & set(p2)))
+                self.assertEqual(list(search.op_and_not(p1, p2)), sorted(set(p1) - set(p2)))
+            lists = [long_list, short_list, array('i', sorted(rnd.sample(xrange(1, 100000), 3000)))]
+            self.assertEqual(search.op_multi_and(list(lists)), sorted(set(lists[0]) & set(lists[1]) & set(lists[2])))
+
+
+class UnionTest(testutil.IndexTestCase):
+
+    def test_multi_or(self):
+        rnd = random.Random(1)
+        for i in xrange(200):
+            lists = [sorted(rnd.sample(xrange(1, 2000), rnd.choice([0, 1, 20, 500]))) for j in xrange(rnd.randint(1, 6))]
+            lists = [array('i', p) if rnd.random() < 0.5 else p for p in lists]
+            self.assertEqual(list(search.op_multi_or(lists)), sorted(set().union(*lists)))
+        self.assertEqual(search.op_multi_or([]), [])
+        self.assertEqual(search.op_multi_or([[], []]), [])
+
+    def test_wide_or_queries(self):
+        words = testutil.make_words(30)
+        documents = testutil.make_documents(words, 500, length=8)
+        index = search.load_index(*self.build(documents))
+        rnd = random.Random(2)
+        try:
+            for i in xrange(30):
+                expression = ("OR",) + tuple(rnd.sample(words, rnd.randint(2, 12)))
+                if i % 3 == 0:
+                    expression = ("AND", expression, ("NOT", rnd.choice(words)))
+                expected = testutil.expected_docIDs(expression, documents)
+                for backend in BACKENDS:
+                    results = search.evaluate_query(testutil.query_text(expression), index, backend)
+                    self.assertEqual(docID_list(results), expected, (backend, expression))
+        finally:
+            index.close()
+
+
+def parts_of(docIDs, part_size, decoded):
+    """Splits a sorted list into parts as read from an index, recording the index of every part decoded in decoded."""
+    parts = []
+    for start in xrange(0, len(docIDs), part_size):
+        part = docIDs[start:start + part_size]
+        parts.append((part[-1], lambda i=len(parts), part=part: decoded.append(i) or array('i', part)))
+    return parts
+
+
+class CursorTest(testutil.IndexTestCase):
+
+    def walk(self, cursor, rnd):
+        """Streams a cursor to its end with a random mix of next and skip_to, checking that it never moves back."""
+        docIDs = []
+        while True:
+            if docIDs and rnd.random() < 0.3:
+                target = docIDs[-1] + rnd.randint(1, 50)
+                docID = cursor.skip_to(target)
+                self.assertTrue(docID is None or docID >= target)
+            else:
+                docID = cursor.next()
+            if docID is None:
+                break
+            self.assertTrue(not docIDs or docID > docIDs[-1])
+            self.assertEqual(cursor.docID, docID)
+            docIDs.append(docID)
+        self.assertEqual(cursor.next(), None)
+        return docIDs
+
+    def test_operator_cursors(self):
+        rnd = random.Random(1)
+        for i in xrange(200):
+            lists = [sorted(rnd.sample(xrange(1, 1000), rnd.choice([0, 1, 30, 300]))) for j in xrange(rnd.randint(2, 4))]
+            sets = [set(p) for p in lists]
+            operators = [
+                (search.AndCursor, sets[0].intersection(*sets)),
+                (search.OrCursor, set().union(*sets)),
+                (lambda cursors: search.AndNotCursor(cursors[0], cursors[1]), sets[0] - sets[1]),
+                (lambda cursors: search.FilterCursor(cursors[0], lambda docID: docID % 3), set(p for p in sets[0] if p % 3)),
+            ]
+            for make_cursor, expected in operators:
+                cursor = make_cursor([search.PostingsCursor(parts_of(p, 7, [])) for p in lists])
+                # Without skips, every docID is streamed in order, and with skips only docIDs of the result.
+                self.assertEqual(cursor.take(), sorted(expected))
+                cursor = make_cursor([search.PostingsCursor(parts_of(p, 7, [])) for p in lists])
+                self.assertTrue(set(self.walk(cursor, rnd)) <= expected)
+
+    def test_skipped_parts_not_decoded(self):
+        decoded = []
+        cursor = search.PostingsCursor(parts_of(range(1, 1001), 100, decoded))
+        self.assertEqual(cursor.skip_to(550), 550)
+        self.assertEqual(cursor.next(), 551)
+        self.assertEqual(cursor.skip_to(950), 950)
+        self.assertEqual(decoded, [5, 9])
+        cursor = search.AndCursor([search.list_cursor([3, 720]), search.PostingsCursor(parts_of(range(1, 1001), 100, decoded))])
+        del decoded[:]
+        self.assertEqual(cursor.take(), [3, 720])
+        self.assertEqual(decoded, [0, 7])
+
+    def test_take_limit(self):
+        cursor = search.list_cursor(range(1, 10))
+        self.assertEqual(cursor.take(3), [1, 2, 3])
+        self.assertEqual(cursor.take(3), [4, 5, 6])
+        self.assertEqual(cursor.take(), [7, 8, 9])
+        self.assertEqual(cursor.count, 9)
+        self.assertEqual(search.list_cursor([]).take(), [])
+
+    def test_limited_query_streams_little(self):
+        documents = dict((docID, ["kado", "mipu"] if docID % 2 else ["kado"]) for docID in xrange(1, 2001))
+        index = search.load_index(*self.build(documents))
+        try:
+            tree = search.build_tree("kado AND mipu", index)
+            self.assertEqual(search.resolve_tree(tree, index, "cursor", limit=5), [1, 3, 5, 7, 9])
+            # Every cursor stopped at the fifth result, rather than streaming its whole postings list.
+            self.assertEqual([node.actual_count for node in tree.root.nodes()], [5, 5, 5])
+        finally:
+            index.close()
+
+
+class BatchTest(testutil.IndexTestCase):
+
+    def test_batch_parity(self):
+        words = testutil.make_words(20)
+        documents = testutil.make_documents(words, 600, length=10)
+        index = search.load_index(*self.build(documents))
+        rnd = random.Random(1)
+        # Queries built from a few shared subexpressions, so that many subtrees recur across the batch.
+        shared = [testutil.random_expression(rnd, words[:10], 2) for i in xrange(5)]
+        expressions = [(rnd.choice(["AND", "OR"]), rnd.choice(shared), rnd.choice(shared + words[:10])) for i in xrange(60)]
+        queries = [testutil.query_text(expression) for expression in expressions] + ["kado AND"]
+        try:
+            for backend in BACKENDS:
+                for limit in (None, 4):
+                    plans = []
+                    results = search.evaluate_batch(queries, index, backend, plans, limit)
+                    self.assertEqual(len(results), len(queries))
+                    for expression, docIDs in zip(expressions, results):
+                        self.assertEqual(docID_list(docIDs), testutil.expected_docIDs(expression, documents)[:limit],
+                                         (backend, expression))
+                    self.assertTrue(isinstance(results[-1], search.QueryError))
+                    self.assertEqual(len(plans), len(queries))
+                    if backend != "cursor":
+                        self.assertTrue(any("cached" in line for query_plans in plans for line in query_plans), backend)
+        finally:
+            index.close()
+
+
+class ParallelTest(testutil.IndexTestCase):
+
+    def test_parallel_parity(self):
+        words = testutil.make_words(20)
+        documents = testutil.make_documents(words, 500, length=15)
+        dict_file, postings_file = self.build(documents, "index", "-f")
+        rnd = random.Random(1)
+        queries = [testutil.query_text(testutil.random_expression(rnd, words)) for i in xrange(50)]
+        queries[10] = "(kado"
+        queries[20] = words[0] + " " + words[3]
+        searcher_args = (dict_file, postings_file, 10 ** 6, 10 ** 6, 5, "tinylfu")
+        index, result_cache = search.open_searcher(*searcher_args)
+        try:
+            for evaluation_args in [("list", True, None, False, None), ("cursor", False, 3, False, None),
+                                    ("list", False, None, True, None), ("list", False, None, False, 5)]:
+                backend, explain, limit, batch, ranked = evaluation_args
+                expected = list(search.evaluate_queries(queries, index, backend, explain, limit, result_cache, batch, ranked))
+                evaluated = search.evaluate_queries_parallel(queries, 3, searcher_args, evaluation_args)
+                self.assertEqual(len(evaluated), len(queries))
+                for (results, plans), (expected_results, expected_plans) in zip(evaluated, expected):
+                    if isinstance(expected_results, search.QueryError):
+                        self.assertEqual(str(results), str(expected_results))
+                    else:
+                        self.assertEqual(docID_list(results), docID_list(expected_results), evaluation_args)
+                        self.assertEqual(bool(plans), bool(expected_plans))
+        finally:
+            index.close()
+
+
+class PlannerTest(testutil.IndexTestCase):
+
+    def test_strategies_agree(self):
+        rnd = random.Random(1)
+        for i in xrange(200):
+            p1 = sorted(rnd.sample(xrange(1, 2000), rnd.randint(0, 300)))
+            p2 = sorted(rnd.sample(xrange(1, 2000), rnd.choice([0, 5, 50, 1000])))
+            both = sorted(set(p1) & set(p2))
+            only_first = sorted(set(p1) - set(p2))
+            for strategy in (None, "gallop", "merge"):
+                self.assertEqual(search.op_and(p1, p2, strategy), both)
+                self.assertEqual(search.op_and(p2, p1, strategy), both)
+                self.assertEqual(search.op_and_not(p1, p2, strategy), only_first)
+            self.assertEqual(search.op_multi_and([p2, p1, p1], ["merge", "gallop"]), both)
+
+    def test_plan_drives_resolution(self):
+        # kado is in every tenth document, which takes three blocks, mipu in a single document, and sola in eight.
+        documents = {}
+        for docID in xrange(1, 3001):
+            words = ["kado"] if docID % 10 == 0 else ["tuna"]
+            if docID == 1500:
+                words.append("mipu")
+            if docID % 375 == 0:
+                words.append("sola")
+            documents[docID] = words
+        index = search.load_index(*self.build(documents))
+        try:
+            tree = search.build_tree("kado AND mipu", index)
+            self.assertEqual([child.term for child in tree.root.children], ["mipu", "kado"])
+            self.assertEqual(tree.root.intersections, ["gallop"])
+            self.assertEqual(tree.root.children[1].strategy, "read matching blocks")
+            self.assertEqual(search.resolve_tree(tree, index), [1500])
+            self.assertTrue(len(tree.root.children[1].postings) < 300)
+
+            tree = search.build_tree("sola AND kado", index)
+            self.assertEqual(tree.root.children[1].strategy, "read")
+            self.assertEqual(search.resolve_tree(tree, index), [docID for docID in xrange(750, 3001, 750)])
+            self.assertEqual(len(tree.root.children[1].postings), 300)
+
+            tree = search.build_tree("kado AND NOT mipu", index)
+            self.assertEqual(tree.root.op, "AND NOT")
+            self.assertEqual(tree.root.intersections, ["gallop"])
+            self.assertEqual(len(search.resolve_tree(tree, index)), 299)
+        finally:
+            index.close()
+
+
+class WildcardTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.words = testutil.make_words(60)
+        self.documents = testutil.make_documents(self.words, 400, length=10)
+        # Two segments, so that expansions merge the terms of both.
+        self.build(dict((docID, words) for docID, words in self.documents.items() if docID <= 300))
+        self.append(dict((docID, words) for docID, words in self.documents.items() if docID > 300))
+        self.index = search.load_index(*self.index_files())
+        self.expansions = search.WILDCARD_EXPANSIONS
+
+    def tearDown(self):
+        search.WILDCARD_EXPANSIONS = self.expansions
+        self.index.close()
+        testutil.IndexTestCase.tearDown(self)
+
+    def matching_words(self, pattern):
+        return sorted(word for word in set(self.words) if fnmatch.fnmatchcase(word, pattern)
+                      and any(word in words for words in self.documents.values()))
+
+    def random_pattern(self, rnd):
+        word = rnd.choice(self.words)
+        cut = rnd.randint(0, len(word) - 1)
+        return rnd.choice([word[:cut] + "*", "*" + word[cut:], word[:cut] + "*" + word[cut + 1:], word[:1] + "*" + word[-1:]])
+
+    def test_expansion(self):
+        self.assertEqual(len(self.index.segments), 2)
+        rnd = random.Random(1)
+        for i in xrange(100):
+            pattern = self.random_pattern(rnd)
+            self.assertEqual(self.index.expand_wildcard(pattern, 1000), (self.matching_words(pattern), False), pattern)
+        self.assertEqual(self.index.expand_wildcard("qqq*", 10), ([], False))
+
+    def test_legacy_dictionary(self):
+        index = search.load_index(testutil.repo_path("dictionary.txt"), testutil.repo_path("postings.txt"))
+        try:
+            terms, truncated = index.expand_wildcard("bank*", 1000)
+            self.assertEqual(terms, sorted(term for term in index.terms() if term.startswith("bank")))
+            self.assertTrue("bank" in terms and not truncated)
+            self.assertEqual(docID_list(search.evaluate_query("bank*", index)),
+                             sorted(set().union(*[docID_list(index.read_postings(term)) for term in terms])))
+        finally:
+            index.close()
+
+    def test_wildcard_queries(self):
+        rnd = random.Random(2)
+        for i in xrange(60):
+            pattern = self.random_pattern(rnd)
+            other = rnd.choice(self.words)
+            op = rnd.choice(["AND", "OR", "AND NOT"])
+            query = "{0} {1} {2}".format(pattern, op, other)
+            expanded = ("OR",) + tuple(self.matching_words(pattern))
+            expression = {"AND": ("AND", expanded, other), "OR": ("OR", expanded, other),
+                          "AND NOT": ("AND", expanded, ("NOT", other))}[op]
+            expected = testutil.expected_docIDs(expression, self.documents)
+            for backend in BACKENDS:
+                self.assertEqual(docID_list(search.evaluate_query(query, self.index, backend)), expected, (backend, query))
+
+    def test_truncation(self):
+        search.WILDCARD_EXPANSIONS = 3
+        pattern = "*" + self.words[0][-1]
+        terms = self.matching_words(pattern)
+        self.assertTrue(len(terms) > 3)
+        plans = []
+        results = search.evaluate_query(pattern, self.index, plans=plans)
+        self.assertEqual(docID_list(results), testutil.expected_docIDs(("OR",) + tuple(terms[:3]), self.documents))
+        self.assertTrue("(3 search tokens, truncated)" in plans[0], plans[0])
+
+    def test_star_in_phrase_is_literal(self):
+        dict_file, postings_file = self.build(self.documents, "positional", "-P")
+        index = search.load_index(dict_file, postings_file)
+        try:
+            self.assertEqual(docID_list(search.evaluate_query('"{0}* {1}"'.format(self.words[0][:2], self.words[1]), index)), [])
+        finally:
+            index.close()
+
+
+def positional_spans(expression, words):
+    """Finds where a positional query expression matches in a document by brute force.
+
+    :param expression: A word, a tuple of "PHRASE" and its words, or a tuple of "NEAR", its distance and its two operand
+        expressions.
+    :param words: The list of the document's words, in order.
+    :return: A set of (first position, last position) tuples of the matches.
+    """
+    if not isinstance(expression, tuple):
+        return set((i, i) for i, word in enumerate(words) if word == expression)
+    if expression[0] == "PHRASE":
+        length = len(expression) - 1
+        return set((i, i + length - 1) for i in xrange(len(words) - length + 1)
+                   if tuple(words[i:i + length]) == expression[1:])
+    distance = expression[1]
+    return set((min(start1, start2), max(end1, end2))
+               for start1, end1 in positional_spans(expression[2], words)
+               for start2, end2 in positional_spans(expression[3], words)
+               if 1 <= max(start2 - end1, start1 - end2) <= distance)
+
+
+def positional_text(expression):
+    """Writes out a positional query expression as a query string."""
+    if not isinstance(expression, tuple):
+        return expression
+    if expression[0] == "PHRASE":
+        return '"' + " ".join(expression[1:]) + '"'
+    return "{0} NEAR/{1} {2}".format(positional_text(expression[2]), expression[1], positional_text(expression[3]))
+
+
+class PositionalTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.words = testutil.make_words(8)
+        self.documents = testutil.make_documents(self.words, 400, length=20)
+
+    def random_operand(self, rnd):
+        if rnd.random() < 0.6:
+            return rnd.choice(self.words)
+        return ("PHRASE",) + tuple(rnd.choice(self.words) for i in xrange(rnd.randint(2, 3)))
+
+    def random_positional(self, rnd):
+        """Makes up a word, phrase or chain of NEAR operators, which NEAR groups from the left."""
+        expression = self.random_operand(rnd)
+        for i in xrange(rnd.choice([0, 1, 1, 2])):
+            expression = ("NEAR", rnd.randint(1, 4), expression, self.random_operand(rnd))
+        return expression
+
+    def test_positional_queries(self):
+        index = search.load_index(*self.build(self.documents, "index", "-P"))
+        rnd = random.Random(1)
+        try:
+            for i in xrange(150):
+                positional = [self.random_positional(rnd) for j in xrange(2)]
+                matching = [set(docID for docID, words in self.documents.items() if positional_spans(expression, words))
+                            for expression in positional]
+                op = rnd.choice(["AND", "OR", "AND NOT", None])
+                if op is None:
+                    query = positional_text(positional[0])
+                    expected = matching[0]
+                else:
+                    query = positional_text(positional[0]) + " " + op + " " + positional_text(positional[1])
+                    expected = {"AND": matching[0] & matching[1], "OR": matching[0] | matching[1],
+                                "AND NOT": matching[0] - matching[1]}[op]
+                for backend in BACKENDS:
+                    self.assertEqual(docID_list(search.evaluate_query(query, index, backend)), sorted(expected),
+                                     (backend, query))
+        finally:
+            index.close()
+
+    def test_positions_across_segments(self):
+        first = dict((docID, words) for docID, words in self.documents.items() if docID <= 250)
+        second = dict((docID, words) for docID, words in self.documents.items() if docID > 250)
+        self.build(first, "index", "-P")
+        self.append(second, "index", "-P")
+        self.delete([3, 260])
+        rnd = random.Random(2)
+        queries = [self.random_positional(rnd) for i in xrange(40)]
+
+        def check():
+            index = search.load_index(*self.index_files())
+            try:
+                for expression in queries:
+                    expected = [docID for docID, words in sorted(self.documents.items())
+                                if docID not in (3, 260) and positional_spans(expression, words)]
+                    for backend in BACKENDS:
+                        results = search.evaluate_query(positional_text(expression), index, backend)
+                        self.assertEqual(docID_list(results), expected, (backend, expression))
+            finally:
+                index.close()
+        check()
+        self.compact()
+        check()
+
+    def test_postings_unchanged_by_positions(self):
+        self.build(self.documents, "plain")
+        self.build(self.documents, "positional", "-P")
+        for plain_file, positional_file in zip(self.index_files("plain"), self.index_files("positional")):
+            with open(plain_file, 'rb') as plain:
+                with open(positional_file, 'rb') as positional:
+                    self.assertTrue(plain.read() == positional.read(), positional_file)
+
+
+def bm25_ranking(documents, term_counts, deleted=(), allowed=None):
+    """Scores every document for a ranked query by brute force.
+
+    :param documents: A dict of docID -> list of the document's words.
+    :param term_counts: A dict of search token -> the number of times it is in the query.
+    :param deleted: The docIDs of documents deleted but not compacted away, which count towards document frequencies.
+    :param allowed: The docIDs that may be returned, or None for all.
+    :return: A list of (score, docID) tuples of the documents with a score, best first.
+    """
+    live = [docID for docID in documents if docID not in deleted and (allowed is None or docID in allowed)]
+    average_length = sum(len(documents[docID]) for docID in documents if docID not in deleted) / float(
+        len(documents) - len(deleted))
+    scores = {}
+    for term, count in term_counts.items():
+        document_frequency = sum(1 for words in documents.values() if term in words)
+        weight = count * math.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+        for docID in live:
+            frequency = documents[docID].count(term)
+            if frequency:
+                length = len(documents[docID])
+                scores[docID] = scores.get(docID, 0.0) + weight * frequency * 2.2 / (
+                    frequency + 1.2 * (0.25 + 0.75 * length / average_length))
+    return sorted([(score, docID) for docID, score in scores.items()], reverse=True)
+
+
+class RankedTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.words = testutil.make_words(60)
+        self.documents = testutil.make_documents(self.words, 1500, length=40)
+
+    def check_ranking(self, index, documents, deleted=(), seed=1):
+        rnd = random.Random(seed)
+        for i in xrange(40):
+            terms = [rnd.choice(self.words[:rnd.choice([5, 60])]) for j in xrange(rnd.randint(1, 4))]
+            top_k = rnd.choice([1, 10, 100])
+            filter_expression = testutil.random_expression(rnd, self.words[:10], 2) if i % 4 == 0 else None
+            query = " ".join(terms)
+            allowed = None
+            if filter_expression is not None:
+                query += " FILTER " + testutil.query_text(filter_expression)
+                allowed = set(testutil.expected_docIDs(filter_expression, documents, deleted))
+            term_counts = {}
+            for term in terms:
+                term_counts[term] = term_counts.get(term, 0) + 1
+            expected = bm25_ranking(documents, term_counts, set(deleted), allowed)[:top_k]
+            plans = []
+            ranked = search.evaluate_ranked(query, index, top_k, plans=plans)
+            scores = dict((docID, score) for score, docID in bm25_ranking(documents, term_counts, set(deleted), allowed))
+            self.assertEqual(len(ranked), len(expected), query)
+            got_scores = [scores[docID] for docID in ranked]
+            for got, wanted in zip(got_scores, [score for score, docID in expected]):
+                self.assertAlmostEqual(got, wanted, 9, query)
+        return plans
+
+    def test_single_segment(self):
+        dict_file, postings_file = self.build(self.documents, "index", "-f")
+        index = search.load_index(dict_file, postings_file)
+        try:
+            self.check_ranking(index, self.documents)
+        finally:
+            index.close()
+
+    def test_segments_and_deletions(self):
+        first = dict((docID, words) for docID, words in self.documents.items() if docID <= 1000)
+        second = dict((docID, words) for docID, words in self.documents.items() if docID > 1000)
+        self.build(first, "index", "-f")
+        self.append(second, "index", "-f")
+        deleted = range(3, 1500, 7)
+        self.delete(deleted)
+        index = search.load_index(*self.index_files())
+        try:
+            self.assertEqual(len(index.segments), 2)
+            self.check_ranking(index, self.documents, deleted, 2)
+        finally:
+            index.close()
+        self.compact()
+        compacted = dict((docID, words) for docID, words in self.documents.items() if docID not in set(deleted))
+        index = search.load_index(*self.index_files())
+        try:
+            self.check_ranking(index, compacted, (), 3)
+        finally:
+            index.close()
+
+    def test_block_bounds_skip(self):
+        # Every document has both search tokens and the same length, but only the first block has a high term frequency
+        # of one, and only the last block of the other.
+        documents = {}
+        for docID in xrange(1, 1001):
+            if docID <= 3:
+                documents[docID] = ["kado"] * 20 + ["mipu", "sola"]
+            elif docID > 997:
+                documents[docID] = ["kado"] + ["mipu"] * 20 + ["sola"]
+            else:
+                documents[docID] = ["kado", "mipu"] + ["sola"] * 20
+        dict_file, postings_file = self.build(documents, "index", "-f")
+        index = search.load_index(dict_file, postings_file)
+        try:
+            plans = []
+            self.assertEqual(search.evaluate_ranked("kado mipu", index, 1, plans=plans), [1])
+            # Plain WAND would score every document, as the bounds of the whole lists add up to more than any score.
+            scored = int(plans[0].split("scored=")[1].split()[0])
+            self.assertTrue(scored <= storage.BLOCK_SIZE, plans[0])
+        finally:
+            index.close()
+
+    def test_needs_frequencies(self):
+        dict_file, postings_file = self.build(self.documents)
+        index = search.load_index(dict_file, postings_file)
+        try:
+            self.assertRaises(search.QueryError, search.evaluate_ranked, self.words[0], index, 10)
+            evaluated = list(search.evaluate_queries([self.words[0], self.words[1]], index, ranked=10))
+            self.assertTrue(all(isinstance(results, search.QueryError) for results, plans in evaluated))
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Tests of the query server, over a TCP connection to a server running in a thread.
+"""
+
+import socket
+import threading
+import traceback
+import unittest
+import testutil
+import server
+
+
+class QuietQueryServer(server.TCPQueryServer):
+    """A query server that records what it reports instead of writing it to standard error."""
+
+    def report(self, query, results, latency):
+        self.reported.append((query.strip(), results))
+
+    def report_error(self, query, error):
+        self.reported.append((query.strip(), error))
+
+    def report_failure(self, query):
+        self.reported.append((query.strip(), traceback.format_exc()))
+
+    def handle_error(self, request, client_address):
+        self.reported.append(("closed", client_address))
+
+
+class QueryServerTest(testutil.IndexTestCase):
+
+    def setUp(self):
+        testutil.IndexTestCase.setUp(self)
+        self.documents = {1: ["kado", "mipu"], 2: ["kado"], 3: ["mipu", "sola"]}
+        dict_file, postings_file = self.build(self.documents)
+        self.server = QuietQueryServer(("127.0.0.1", 0), server.QueryHandler)
+        self.server.reported = []
+        self.server.load(dict_file, postings_file)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.server.index.close()
+        testutil.IndexTestCase.tearDown(self)
+
+    def ask(self, *queries):
+        """Sends queries over a single connection, all at once, and returns the lines received in reply."""
+        connection = socket.create_connection(self.server.server_address)
+        try:
+            connection.sendall("".join(query + "\n" for query in queries))
+            connection.shutdown(socket.SHUT_WR)
+            reply = connection.makefile().read()
+        finally:
+            connection.close()
+        return reply.split("\n")[:-1]
+
+    def test_answers(self):
+        self.assertEqual(self.ask("kado", "kado AND NOT mipu", "sola AND kado"), ["1 2", "2", ""])
+
+    def test_error_keeps_connection(self):
+        lines = self.ask("kado AND", "mipu")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("ERROR "))
+        self.assertEqual(lines[1], "1 3")
+        self.assertTrue(isinstance(self.server.reported[0][1], Exception))
+
+    def test_failure_closes_connection(self):
+        evaluate = self.server.evaluate
+
+        def failing_evaluate(query):
+            if query.strip() == "mipu":
+                raise TypeError("a bug")
+            return evaluate(query)
+        self.server.evaluate = failing_evaluate
+        self.assertEqual(self.ask("kado", "mipu", "sola"), ["1 2"])
+        self.assertEqual(self.server.reported[1][0], "mipu")
+        self.assertTrue("TypeError: a bug" in self.server.reported[1][1])
+        self.assertEqual(self.server.reported[2][0], "closed")
+        # The server goes on serving other connections.
+        self.assertEqual(self.ask("kado"), ["1 2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
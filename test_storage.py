@@ -0,0 +1,310 @@
+"""
+Tests of the postings codecs, the postings file header and reading postings lists from postings files.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import storage
+import index
+import testutil
+from testutil import docID_list
+
+
+# Postings lists that each of the adaptive containers should be picked for, and a few edge cases.
+POSTINGS = {
+    "empty": [],
+    "single": [7],
+    "large docID": [2 ** 30 + 5],
+    "sparse": [3, 1000, 70000, 2 ** 20],
+    "dense": [docID for docID in xrange(1, 600) if docID % 3],
+    "runs": range(10, 200) + range(5000, 5300),
+    "blocks": range(40, 40 * 1000, 40),
+    "blocks and a partial block": range(1, 40 * storage.BLOCK_SIZE + 17, 40),
+}
+
+
+class VbyteTest(unittest.TestCase):
+
+    def test_numbers_round_trip(self):
+        numbers = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 31 - 1]
+        self.assertEqual(storage.vb_decode_numbers(storage.vb_encode_numbers(numbers)), numbers)
+
+    def test_code_lengths(self):
+        self.assertEqual(len(storage.vb_encode_numbers([127])), 1)
+        self.assertEqual(len(storage.vb_encode_numbers([128])), 2)
+        self.assertEqual(len(storage.vb_encode_numbers([2 ** 28])), 5)
+
+    def test_decode_prefix(self):
+        data = "xx" + storage.vb_encode_numbers([5, 300, 70000, 9])
+        numbers, position = storage.vb_decode_prefix(data, 2, 3)
+        self.assertEqual(numbers, [5, 300, 70000])
+        self.assertEqual(storage.vb_decode_numbers(data[position:]), [9])
+
+    def test_postings_continue_from_previous(self):
+        data = storage.vb_encode_postings([3, 5, 9])
+        self.assertEqual(list(storage.vb_decode_postings(data, 100)), [103, 105, 109])
+
+
+class CodecTest(unittest.TestCase):
+
+    def round_trip(self, codec):
+        encode, decode = storage.codecs[codec]
+        for name, docIDs in sorted(POSTINGS.items()):
+            self.assertEqual(docID_list(decode(encode(docIDs))), docIDs, name)
+            self.assertEqual(docID_list(decode(buffer(encode(docIDs)))), docIDs, name)
+
+    def test_text(self):
+        self.round_trip(storage.CODEC_TEXT)
+        self.assertEqual(storage.text_encode_postings([1, 22, 333]), "1 22 333")
+
+    def test_vbyte(self):
+        self.round_trip(storage.CODEC_VBYTE)
+
+    def test_adaptive(self):
+        self.round_trip(storage.CODEC_ADAPTIVE)
+
+    def test_positions_docIDs(self):
+        postings = [(docID, [docID % 5, docID % 5 + 3]) for docID in POSTINGS["blocks"]]
+        data = storage.positions_encode_postings(postings)
+        self.assertEqual(list(storage.positions_decode_postings(data)), POSTINGS["blocks"])
+
+    def test_frequencies(self):
+        docIDs = POSTINGS["blocks and a partial block"]
+        postings = [(docID, docID % 7 + 1) for docID in docIDs]
+        data = storage.frequencies_encode_postings(postings)
+        self.assertEqual(list(storage.frequencies_decode_postings(data)), docIDs)
+        decoded = []
+        previous = 0
+        for last, decode, max_frequency in storage.frequencies_decode_parts(data):
+            block_docIDs, frequencies = decode()
+            self.assertEqual(block_docIDs[-1], last)
+            self.assertEqual(max(frequencies), max_frequency)
+            self.assertTrue(block_docIDs[0] > previous)
+            decoded.extend(zip(block_docIDs, frequencies))
+            previous = last
+        self.assertEqual(decoded, postings)
+
+
+class AdaptiveContainerTest(unittest.TestCase):
+
+    def container(self, docIDs):
+        return ord(storage.adaptive_encode_postings(docIDs)[0])
+
+    def test_container_choice(self):
+        self.assertEqual(self.container(POSTINGS["sparse"]), storage.CONTAINER_ARRAY)
+        self.assertEqual(self.container(POSTINGS["dense"]), storage.CONTAINER_BITMAP)
+        self.assertEqual(self.container(POSTINGS["runs"]), storage.CONTAINER_RUNS)
+        self.assertEqual(self.container(POSTINGS["blocks"]), storage.CONTAINER_BLOCKS)
+
+    def test_random_round_trip(self):
+        rnd = random.Random(1)
+        for i in xrange(200):
+            universe = rnd.choice([50, 1000, 100000])
+            docIDs = sorted(rnd.sample(xrange(1, universe), rnd.randint(0, min(universe - 1, 700))))
+            self.assertEqual(docID_list(storage.adaptive_decode_postings(storage.adaptive_encode_postings(docIDs))), docIDs)
+
+    def test_unknown_container(self):
+        self.assertRaises(ValueError, storage.adaptive_decode_postings, chr(9) + "\x81")
+
+
+class BlockIndexTest(unittest.TestCase):
+
+    def test_parts(self):
+        for name, docIDs in sorted(POSTINGS.items()):
+            parts = storage.adaptive_decode_parts(storage.adaptive_encode_postings(docIDs))
+            decoded = []
+            for last, decode in parts:
+                part = docID_list(decode())
+                if last is not None:
+                    self.assertEqual(part[-1], last, name)
+                decoded.extend(part)
+            self.assertEqual(decoded, docIDs, name)
+        parts = storage.adaptive_decode_parts(storage.adaptive_encode_postings(POSTINGS["blocks and a partial block"]))
+        self.assertEqual([last for last, decode in parts], [40 * storage.BLOCK_SIZE - 39, 40 * storage.BLOCK_SIZE + 1])
+
+    def test_matching(self):
+        rnd = random.Random(1)
+        for name, docIDs in sorted(POSTINGS.items()):
+            data = storage.adaptive_encode_postings(docIDs)
+            for i in xrange(20):
+                candidates = sorted(rnd.sample(xrange(1, 45000), rnd.choice([0, 1, 3, 10, 100])))
+                matching = docID_list(storage.adaptive_decode_matching(data, candidates))
+                self.assertTrue(set(matching) <= set(docIDs), name)
+                self.assertEqual(set(matching) & set(candidates), set(docIDs) & set(candidates), name)
+        # A single candidate only needs the block that can hold it.
+        data = storage.adaptive_encode_postings(POSTINGS["blocks"])
+        self.assertEqual(len(storage.adaptive_decode_matching(data, [40 * storage.BLOCK_SIZE + 1])), storage.BLOCK_SIZE)
+        self.assertEqual(len(storage.adaptive_decode_matching(data, [])), 0)
+
+
+class PostingsFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="test")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, codec):
+        postings_file_name = os.path.join(self.directory, "postings")
+        dict_terms = index.write_postings(POSTINGS, postings_file_name, codec)
+        return (dict_terms, postings_file_name)
+
+    def test_read_every_codec(self):
+        for codec in (storage.CODEC_TEXT, storage.CODEC_VBYTE, storage.CODEC_ADAPTIVE):
+            dict_terms, postings_file_name = self.write(codec)
+            postings_file = storage.PostingsFile(postings_file_name)
+            self.assertEqual(postings_file.codec, codec)
+            for term, docIDs in POSTINGS.items():
+                pointer, length, df = dict_terms[term]
+                self.assertEqual(df, len(docIDs))
+                self.assertEqual(docID_list(postings_file.read(pointer, length)), docIDs, (codec, term))
+            postings_file.close()
+
+    def test_read_matching_and_parts(self):
+        candidates = [40, 41, 40 * storage.BLOCK_SIZE * 3]
+        for codec in (storage.CODEC_TEXT, storage.CODEC_VBYTE, storage.CODEC_ADAPTIVE):
+            dict_terms, postings_file_name = self.write(codec)
+            postings_file = storage.PostingsFile(postings_file_name)
+            try:
+                for term, docIDs in POSTINGS.items():
+                    pointer, length, df = dict_terms[term]
+                    matching = docID_list(postings_file.read_matching(pointer, length, candidates))
+                    self.assertTrue(set(matching) <= set(docIDs))
+                    self.assertEqual(set(matching) & set(candidates), set(docIDs) & set(candidates), (codec, term))
+                    parts = postings_file.read_parts(pointer, length)
+                    self.assertEqual([docID for last, decode in parts for docID in docID_list(decode())], docIDs)
+                parts = postings_file.read_parts(*dict_terms["blocks"][:2])
+                self.assertEqual(len(parts), 1 if codec != storage.CODEC_ADAPTIVE else 8)
+            finally:
+                postings_file.close()
+
+    def test_text_postings_have_no_header(self):
+        dict_terms, postings_file_name = self.write(storage.CODEC_TEXT)
+        with open(postings_file_name, 'rb') as postings_file:
+            self.assertEqual(postings_file.readline(), storage.text_encode_postings(POSTINGS["blocks"]) + "\n")
+
+    def test_views_share_the_mapping(self):
+        dict_terms, postings_file_name = self.write(storage.CODEC_VBYTE)
+        postings_file = storage.PostingsFile(postings_file_name)
+        try:
+            pointer, length, df = dict_terms["sparse"]
+            view = postings_file.view(pointer, length)
+            self.assertTrue(isinstance(view, buffer))
+            self.assertEqual(str(view), storage.vb_encode_postings(POSTINGS["sparse"]))
+        finally:
+            postings_file.close()
+
+    def test_concurrent_reads(self):
+        dict_terms, postings_file_name = self.write(storage.CODEC_ADAPTIVE)
+        postings_file = storage.PostingsFile(postings_file_name)
+        failures = []
+
+        def read_all():
+            for i in xrange(50):
+                for term, docIDs in POSTINGS.items():
+                    if docID_list(postings_file.read(*dict_terms[term][:2])) != docIDs:
+                        failures.append(term)
+
+        threads = [threading.Thread(target=read_all) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        postings_file.close()
+        self.assertEqual(failures, [])
+
+    def test_no_postings(self):
+        postings_file_name = os.path.join(self.directory, "postings")
+        self.assertEqual(index.write_postings({}, postings_file_name, storage.CODEC_TEXT), {})
+        postings_file = storage.PostingsFile(postings_file_name)
+        self.assertEqual(postings_file.codec, storage.CODEC_TEXT)
+        postings_file.close()
+
+    def test_unsupported_header(self):
+        postings_file_name = os.path.join(self.directory, "postings")
+        with open(postings_file_name, 'wb') as postings_file:
+            postings_file.write(storage.postings_header.pack(storage.POSTINGS_MAGIC, storage.POSTINGS_VERSION + 1, 1))
+        self.assertRaises(ValueError, storage.PostingsFile, postings_file_name)
+
+
+class DictionaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="test")
+        self.dict_file_name = os.path.join(self.directory, "dictionary")
+        self.terms = {u"caf\xe9": (30, 4, 2), "bank": (0, 10, 5), "banker": (10, 6, 3), "apple": (16, 14, 7), "z": (34, 1, 1)}
+        storage.write_dictionary([1, 4, 9], self.terms, self.dict_file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        docIDs, dictionary = storage.load_dictionary(self.dict_file_name)
+        try:
+            self.assertTrue(isinstance(dictionary, storage.Dictionary))
+            self.assertEqual(list(docIDs), [1, 4, 9])
+            self.assertEqual(len(dictionary), len(self.terms))
+            self.assertEqual(list(dictionary), sorted(storage.utf8(term) for term in self.terms))
+            for term, address in self.terms.items():
+                self.assertTrue(term in dictionary)
+                self.assertEqual(dictionary[term], address)
+                self.assertEqual(dictionary[storage.utf8(term)], address)
+            for term in ["", "a", "ban", "bankers", "caf", "zz"]:
+                self.assertFalse(term in dictionary)
+                self.assertEqual(dictionary.find(term), -1)
+                self.assertRaises(KeyError, dictionary.__getitem__, term)
+        finally:
+            dictionary.close()
+
+    def test_bisect_and_prefixed(self):
+        docIDs, dictionary = storage.load_dictionary(self.dict_file_name)
+        try:
+            self.assertEqual(dictionary.bisect(""), 0)
+            self.assertEqual(dictionary.term_at(dictionary.bisect("b")), "bank")
+            self.assertEqual(dictionary.term_at(dictionary.bisect("banka")), "banker")
+            self.assertEqual(dictionary.bisect("zz"), len(dictionary))
+            self.assertEqual(list(dictionary.prefixed("bank")), ["bank", "banker"])
+            self.assertEqual(list(dictionary.prefixed("caf")), [storage.utf8(u"caf\xe9")])
+            self.assertEqual(list(dictionary.prefixed("q")), [])
+        finally:
+            dictionary.close()
+
+    def test_version_1(self):
+        # Version 1 entries have no document frequency.
+        terms = sorted((storage.utf8(term), address[:2]) for term, address in self.terms.items())
+        offsets = [0]
+        for term, address in terms:
+            offsets.append(offsets[-1] + len(term))
+        with open(self.dict_file_name, 'wb') as dict_file:
+            dict_file.write(storage.dictionary_header.pack(storage.DICTIONARY_MAGIC, 1, 3, len(terms)))
+            dict_file.write(storage.little_endian_array('i', [1, 4, 9]))
+            dict_file.write(storage.little_endian_array('I', offsets))
+            for term, address in terms:
+                dict_file.write(storage.dictionary_entries[1].pack(*address))
+            dict_file.write("".join(term for term, address in terms))
+        docIDs, dictionary = storage.load_dictionary(self.dict_file_name)
+        try:
+            self.assertEqual(dictionary["banker"], (10, 6))
+            self.assertEqual(list(dictionary.prefixed("ba")), ["bank", "banker"])
+        finally:
+            dictionary.close()
+
+    def test_legacy_json(self):
+        docIDs, dictionary = storage.load_dictionary(testutil.repo_path("dictionary.txt"))
+        self.assertTrue(isinstance(dictionary, dict))
+        self.assertEqual(list(docIDs), sorted(docIDs))
+        postings_file = storage.PostingsFile(testutil.repo_path("postings.txt"))
+        try:
+            self.assertEqual(postings_file.codec, storage.CODEC_TEXT)
+            self.assertTrue(len(postings_file.read(*dictionary[u"money"][:2])) > 0)
+        finally:
+            postings_file.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
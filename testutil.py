@@ -0,0 +1,205 @@
+"""
+Helpers shared by the tests (test_*.py, run with `python -m unittest discover -p "test_*.py"`):
+
+A small synthetic corpus of known contents, indexes built from it by running index.py, and a brute-force evaluation of
+boolean queries over the documents' words to check the searcher's results against.
+
+Documents are single lines of made-up words that the stemmer leaves as they are, and indexes are built in a single pass
+(index.py -s), so neither building nor checking them needs NLTK's Punkt data. A word's position in its line is its
+position in the document.
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import subprocess
+import unittest
+import analyzer
+import search
+from bitmap import Bitmap
+
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz" for vowel in "aiou"]
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_SCRIPT = os.path.join(REPO_DIR, "index.py")
+# The evaluation backends that can run here, as the NumPy one needs NumPy installed.
+BACKENDS = [backend for backend in search.backends if backend != "numpy" or search.numpy_backend is not None]
+
+
+def repo_path(name):
+    """Returns the path of a file of the repository, such as the sample queries.txt."""
+    return os.path.join(REPO_DIR, name)
+
+
+def docID_list(results):
+    """Returns results of any backend, or decoded postings whether an array or a Bitmap, as a list of docIDs."""
+    return list(results.docIDs() if isinstance(results, Bitmap) else results)
+
+
+def make_words(count, seed=1):
+    """Makes up distinct words that the stemmer leaves unchanged.
+
+    :param count: The number of words.
+    :param seed: The seed the words are drawn from.
+    :return: A list of words, to be read as ordered from the most to the least frequent.
+    """
+    rnd = random.Random(seed)
+    words = []
+    seen = set()
+    while len(words) < count:
+        word = "".join(rnd.choice(SYLLABLES) for i in xrange(rnd.randint(2, 3)))
+        if word not in seen and analyzer.stem(word) == word:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def make_documents(words, count, seed=1, first_docID=1, length=30):
+    """Makes up documents whose words are drawn with a skewed frequency: the word of rank r about as often as 1 / r.
+
+    :param words: The vocabulary, from the most to the least frequent word.
+    :param count: The number of documents.
+    :param seed: The seed the documents are drawn from.
+    :param first_docID: The docID of the first document, the others following one after the other.
+    :param length: The most words in a document.
+    :return: A dict of docID -> list of the document's words, in order.
+    """
+    rnd = random.Random(seed)
+    weights = [1.0 / rank for rank in xrange(1, len(words) + 1)]
+    documents = {}
+    for docID in xrange(first_docID, first_docID + count):
+        documents[docID] = [weighted_choice(rnd, words, weights) for i in xrange(rnd.randint(1, length))]
+    return documents
+
+
+def weighted_choice(rnd, items, weights):
+    """Picks one of the items with a probability proportional to its weight."""
+    target = rnd.random() * sum(weights)
+    for item, weight in zip(items, weights):
+        target -= weight
+        if target < 0:
+            return item
+    return items[-1]
+
+
+def write_documents(directory, documents):
+    """Writes documents to a directory, one file per document named by its docID.
+
+    :param directory: The directory, which is created if needed.
+    :param documents: A dict of docID -> list of the document's words.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for docID, words in documents.iteritems():
+        with open(os.path.join(directory, str(docID)), 'w') as doc_file:
+            doc_file.write(" ".join(words) + "\n")
+
+
+def run_index(*args):
+    """Runs index.py with the given arguments, hiding its progress output."""
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, INDEX_SCRIPT] + list(args), stdout=devnull)
+
+
+def query_text(expression):
+    """Writes out a query expression as a query string.
+
+    :param expression: A word, or a tuple of an operator ("NOT", "AND" or "OR") and its operand expressions.
+    :return: A string containing the query.
+    """
+    if not isinstance(expression, tuple):
+        return expression
+    operands = ["(" + query_text(operand) + ")" if isinstance(operand, tuple) else operand for operand in expression[1:]]
+    if expression[0] == "NOT":
+        return "NOT " + operands[0]
+    return (" " + expression[0] + " ").join(operands)
+
+
+def matches(expression, words):
+    """Evaluates a query expression against the set of words of a single document."""
+    if not isinstance(expression, tuple):
+        return expression in words
+    if expression[0] == "NOT":
+        return not matches(expression[1], words)
+    if expression[0] == "AND":
+        return all(matches(operand, words) for operand in expression[1:])
+    return any(matches(operand, words) for operand in expression[1:])
+
+
+def expected_docIDs(expression, documents, deleted=()):
+    """Finds the documents matching a query expression by brute force.
+
+    :param expression: A query expression, as taken by query_text.
+    :param documents: A dict of docID -> list of the document's words.
+    :param deleted: The docIDs of deleted documents, which never match.
+    :return: A sorted list of docIDs.
+    """
+    deleted = set(deleted)
+    return [docID for docID in sorted(documents)
+            if docID not in deleted and matches(expression, set(documents[docID]))]
+
+
+def random_expression(rnd, words, depth=3):
+    """Makes up a nested query expression of NOT, AND and OR over the words."""
+    if depth == 0 or rnd.random() < 0.25:
+        word = rnd.choice(words)
+        return ("NOT", word) if rnd.random() < 0.2 else word
+    op = rnd.choice(["AND", "OR", "NOT"])
+    if op == "NOT":
+        return ("NOT", random_expression(rnd, words, depth - 1))
+    return (op,) + tuple(random_expression(rnd, words, depth - 1) for i in xrange(rnd.randint(2, 3)))
+
+
+class IndexTestCase(unittest.TestCase):
+    """Base class of tests that build indexes, in a temporary directory removed after every test."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="test")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, *names):
+        """Returns the path of a file in the temporary directory."""
+        return os.path.join(self.directory, *names)
+
+    def build(self, documents, name="index", *flags):
+        """Writes documents and indexes them in a single pass.
+
+        :param documents: A dict of docID -> list of the document's words.
+        :param name: The name the documents directory and the index files are named after.
+        :param flags: Further arguments of index.py.
+        :return: A tuple of (dictionary file path, postings file path).
+        """
+        docs_dir = self.path(name + ".docs")
+        write_documents(docs_dir, documents)
+        dict_file, postings_file = self.index_files(name)
+        run_index("-i", docs_dir, "-d", dict_file, "-p", postings_file, "-s", *flags)
+        return (dict_file, postings_file)
+
+    def index_files(self, name="index"):
+        """Returns a tuple of the (dictionary file path, postings file path) of the index of the given name."""
+        return (self.path(name + ".dict"), self.path(name + ".postings"))
+
+    def append(self, documents, name="index", *flags):
+        """Writes more documents next to those of an index built by build, and indexes them as a new segment.
+
+        :param documents: A dict of docID -> list of the document's words, for docIDs not in the index yet.
+        :param name: The name of the index.
+        :param flags: Further arguments of index.py.
+        """
+        docs_dir = self.path(name + ".docs")
+        write_documents(docs_dir, documents)
+        dict_file, postings_file = self.index_files(name)
+        run_index("-i", docs_dir, "-d", dict_file, "-p", postings_file, "-s", "-a", *flags)
+
+    def delete(self, docIDs, name="index"):
+        """Deletes documents from an index."""
+        dict_file, postings_file = self.index_files(name)
+        run_index("-x", ",".join(str(docID) for docID in docIDs), "-d", dict_file, "-p", postings_file)
+
+    def compact(self, name="index"):
+        """Folds the segments of an index into one."""
+        dict_file, postings_file = self.index_files(name)
+        run_index("-c", "-d", dict_file, "-p", postings_file)